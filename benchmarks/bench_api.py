@@ -0,0 +1,110 @@
+"""
+Compare the cost of serializing a page of posts as HTML and as JSON.
+
+Seeds a temporary database, loads one page of posts, then times turning the same rows
+into a response body with:
+
+- html: the index page template, as blog.index renders it on a cache miss
+- orjson: the dicts built by fastr.api, serialized with orjson
+- pydantic: Pydantic models of each row serialized with .json(), which the API avoids
+
+Usage:
+    python -m benchmarks.bench_api [--page-size 100] [--body-size 200]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+# point the app at a scratch database before anything from fastr is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(_tmpdir, "bench.sqlite")
+
+import orjson  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from benchmarks.seed import seed_database  # noqa: E402
+from fastr import api, blog  # noqa: E402
+from fastr.db import crud, schemas  # noqa: E402
+from fastr.config import Settings  # noqa: E402
+from fastr.db.database import Database  # noqa: E402
+from fastr.main import app  # noqa: E402
+from fastr.templating import templates  # noqa: E402
+
+
+def time_call(func, repeat: int = 200) -> float:
+    """Median wall time of func() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def make_request() -> Request:
+    """A request for / with an empty session, enough to render the templates."""
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "scheme": "http",
+        "server": ("localhost", 80),
+        "root_path": "",
+        "app": app,
+        "router": app.router,
+        "session": {},
+    }
+    return Request(scope)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--body-size", type=int, default=200)
+    args = parser.parse_args()
+
+    seed_database(
+        os.environ["FASTR_DATABASE_PATH"],
+        10,
+        args.page_size,
+        rounds=4,
+        body_size=args.body_size,
+    )
+    db = Database(Settings()).session_factory()
+    posts = crud.get_post_listings(db, limit=args.page_size)
+    request = make_request()
+
+    def html():
+        feed = templates.get_template("blog/_feed.html").render(
+            {"request": request, "posts": posts, "next_cursor": "x"}
+        )
+        return blog.render_index(request, feed).encode("utf8")
+
+    def json_orjson():
+        return orjson.dumps(
+            {
+                "posts": [api._post_dict(post, api.POST_FIELDS) for post in posts],
+                "next_cursor": "x",
+            }
+        )
+
+    def json_pydantic():
+        page = [schemas.PostListing.from_orm(post).json() for post in posts]
+        return "[" + ",".join(page) + "]"
+
+    print(f"{'format':>10} {'ms/page':>8} {'bytes':>8}")
+    for name, func in (
+        ("html", html),
+        ("orjson", json_orjson),
+        ("pydantic", json_pydantic),
+    ):
+        print(f"{name:>10} {time_call(func):>8.3f} {len(func()):>8,}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
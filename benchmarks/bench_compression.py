@@ -0,0 +1,140 @@
+"""
+Measure the CPU cost and bytes saved of compressing feed pages.
+
+Renders index pages of different sizes from generated posts, then compresses each one
+with gzip and brotli at several levels, both in one go and the way
+CompressionMiddleware compresses a streamed page (in STREAM_CHUNK_SIZE parts, flushing
+after each). Prints the compressed size, time per page and bytes saved per
+millisecond of CPU.
+
+Usage:
+    python -m benchmarks.bench_compression [--pages 10,100] [--body-size 200,1000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+# point the app at a scratch database before anything from fastr is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(_tmpdir, "bench.sqlite")
+
+from starlette.requests import Request  # noqa: E402
+
+from fastr import blog  # noqa: E402
+from fastr.compression import Compressor, brotli  # noqa: E402
+from fastr.main import app  # noqa: E402
+from fastr.templating import STREAM_CHUNK_SIZE, templates  # noqa: E402
+
+LEVELS = {"gzip": (1, 5, 6, 9), "br": (1, 4, 6, 11)}
+
+
+class FakePost(NamedTuple):
+    id: int
+    title: str
+    body: str
+    created: datetime
+    author_id: int
+    username: str
+
+
+def make_posts(n: int, body_size: int, rng: random.Random) -> List[FakePost]:
+    """Posts of English-like text: words of varying length from a small vocabulary."""
+    letters = "etaoinshrdlcumwfgypbvkjxqz"
+    weights = [26 - i for i in range(26)]
+    vocabulary = [
+        "".join(rng.choices(letters, weights, k=rng.randint(2, 9))) for _ in range(2000)
+    ]
+
+    def text(size):
+        words = []
+        while sum(map(len, words)) + len(words) < size:
+            words.append(rng.choice(vocabulary))
+        return " ".join(words)[:size]
+
+    start = datetime(2021, 1, 1)
+    return [
+        FakePost(i, text(40), text(body_size), start + timedelta(minutes=i), 1, "user")
+        for i in range(n)
+    ]
+
+
+def render_page(posts: List[FakePost]) -> bytes:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "scheme": "http",
+        "server": ("localhost", 80),
+        "root_path": "",
+        "app": app,
+        "router": app.router,
+        "session": {},
+    }
+    request = Request(scope)
+    feed = templates.get_template("blog/_feed.html").render(
+        {"request": request, "posts": posts, "next_cursor": "x"}
+    )
+    return blog.render_index(request, feed).encode("utf8")
+
+
+def compress(encoding: str, level: int, body: bytes, chunk_size: int) -> bytes:
+    compressor = Compressor(encoding, gzip_level=level, brotli_quality=level)
+    parts = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    return b"".join(
+        compressor.compress(part, finish=i == len(parts) - 1)
+        for i, part in enumerate(parts)
+    )
+
+
+def time_call(func, repeat: int = 20) -> float:
+    """Median wall time of func() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", default="10,100", help="posts per page")
+    parser.add_argument("--body-size", default="200,1000", help="characters per post")
+    args = parser.parse_args()
+
+    encodings = ["gzip"] + (["br"] if brotli else [])
+    rng = random.Random(0)
+    print(
+        f"{'posts':>5} {'body':>5} {'bytes':>8} {'coding':>6} {'level':>5} "
+        f"{'mode':>6} {'bytes':>7} {'ratio':>5} {'ms':>6} {'saved/ms':>9}"
+    )
+    for n_posts in map(int, args.pages.split(",")):
+        for body_size in map(int, args.body_size.split(",")):
+            page = render_page(make_posts(n_posts, body_size, rng))
+            for encoding in encodings:
+                for level in LEVELS[encoding]:
+                    for mode, chunk_size in (
+                        ("whole", len(page)),
+                        ("stream", STREAM_CHUNK_SIZE),
+                    ):
+                        size = len(compress(encoding, level, page, chunk_size))
+                        ms = time_call(
+                            lambda: compress(encoding, level, page, chunk_size)
+                        )
+                        print(
+                            f"{n_posts:>5} {body_size:>5} {len(page):>8,} "
+                            f"{encoding:>6} {level:>5} {mode:>6} {size:>7,} "
+                            f"{size / len(page):>5.2f} {ms:>6.2f} "
+                            f"{(len(page) - size) / ms:>9,.0f}"
+                        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cost of idle live feed connections, and of sending an event to all of them (see
+fastr.live).
+
+Opens many connections to /feed/stream by calling the app directly, through all of
+its middleware, so the numbers leave out the server and sockets but include
+everything the app keeps per connection. Reports the memory each idle connection
+adds to the process and how long it takes from publishing a post until every
+connection has sent it.
+
+Usage:
+    python -m benchmarks.bench_live [--clients 1000 10000]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+
+# use a scratch database, set before fastr.db.database is imported
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+os.environ["FASTR_FEED_STREAM_MAX_CLIENTS"] = "1000000"
+
+from fastr import live
+from fastr.config import Settings
+from fastr.db import migrations
+from fastr.db.database import create_db_engine
+from fastr.main import app
+
+
+def max_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(clients: int):
+    """Returns MB per 1000 connections, and ms to send one event to all of them."""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("localhost", 8000),
+        "client": ("127.0.0.1", 50000),
+        "root_path": "",
+        "path": "/feed/stream",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost:8000"), (b"accept-encoding", b"gzip")],
+    }
+    disconnect = asyncio.Event()
+    received = 0
+    all_received = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body" and b"event:" in message["body"]:
+            received += 1
+            if received == clients:
+                all_received.set()
+
+    await app.router.startup()
+    before = max_rss_mb()
+    connections = [
+        asyncio.create_task(app(dict(scope), receive, send)) for _ in range(clients)
+    ]
+    while len(live.broadcaster.subscribers) < clients:
+        await asyncio.sleep(0.01)
+    per_thousand = (max_rss_mb() - before) / clients * 1000
+
+    start = time.perf_counter()
+    live.broadcaster.publish(live.make_event("deleted", {"id": 1}))
+    await all_received.wait()
+    fan_out = time.perf_counter() - start
+
+    disconnect.set()
+    await asyncio.gather(*connections)
+    await app.router.shutdown()
+    return per_thousand, fan_out * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10_000])
+    args = parser.parse_args()
+
+    engine = create_db_engine(Settings())
+    migrations.migrate(engine)
+    engine.dispose()
+    print(f"{'clients':>8} {'MB/1000 idle':>13} {'fan-out ms':>11}")
+    for clients in args.clients:
+        per_thousand, fan_out = asyncio.run(run(clients))
+        print(f"{clients:>8} {per_thousand:>13.1f} {fan_out:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
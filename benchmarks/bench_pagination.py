@@ -0,0 +1,74 @@
+"""
+Compare OFFSET/LIMIT pagination with keyset pagination of the post feed.
+
+Seeds a temporary database with `pages * page_size` posts, then times fetching
+individual pages from the front of the feed to the very end with both
+`crud.get_posts` (offset) and `crud.get_post_listings` (keyset).
+
+Usage:
+    python -m benchmarks.bench_pagination [--pages 10000] [--page-size 10]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+# point the app at a scratch database before anything from fastr is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(_tmpdir, "bench.sqlite")
+
+from fastr.db import crud, models  # noqa: E402
+from fastr.config import Settings  # noqa: E402
+from fastr.db.database import Database  # noqa: E402
+from benchmarks.seed import seed_database  # noqa: E402
+
+
+def time_call(func, repeat: int = 5) -> float:
+    """Median wall time of func() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=10_000)
+    parser.add_argument("--page-size", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"seeding {args.pages * args.page_size:,} posts...")
+    seed_database(
+        os.environ["FASTR_DATABASE_PATH"], 10, args.pages * args.page_size, rounds=4
+    )
+
+    db = Database(Settings()).session_factory()
+    print(f"{'page':>8} {'offset ms':>10} {'keyset ms':>10}")
+    checkpoints = [10 ** i for i in range(len(str(args.pages))) if 10 ** i < args.pages]
+    for page in checkpoints + [args.pages]:
+        skip = (page - 1) * args.page_size
+        before = None
+        if skip:
+            # key of the last post on the previous page (not timed)
+            before = tuple(
+                db.query(models.Post.created, models.Post.id)
+                .order_by(models.Post.created.desc(), models.Post.id.desc())
+                .offset(skip - 1)
+                .first()
+            )
+
+        offset_ms = time_call(
+            lambda: crud.get_posts(db, skip=skip, limit=args.page_size)
+        )
+        keyset_ms = time_call(
+            lambda: crud.get_post_listings(db, before=before, limit=args.page_size)
+        )
+        print(f"{page:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
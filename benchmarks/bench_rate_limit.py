@@ -0,0 +1,76 @@
+"""
+Cost of rate limiting login attempts (see fastr.ratelimit).
+
+Times RateLimiter.hit for each store, with hits spread over many keys like attempts
+from many clients, and the time to evict full buckets from a store with many keys.
+Both are small next to the bcrypt check they protect, which takes hundreds of
+milliseconds at the default cost.
+
+Usage:
+    python -m benchmarks.bench_rate_limit [--hits 20000] [--keys 100000]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# use a scratch database, set before fastr.db.database is imported
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+os.environ["FASTR_SQLITE_PROFILE"] = "production"
+
+from fastr.config import Settings
+from fastr.db import migrations
+from fastr.db.database import create_db_engine
+from fastr.ratelimit import (
+    MemoryRateLimitStore,
+    RateLimited,
+    RateLimiter,
+    RateLimitStore,
+    SQLiteRateLimitStore,
+)
+
+
+async def hits(store: RateLimitStore, n: int, keys: int) -> float:
+    """Returns the mean microseconds per hit."""
+    limiter = RateLimiter(store, "bench:", burst=10, per_minute=5)
+    start = time.perf_counter()
+    for i in range(n):
+        try:
+            await limiter.hit(str(i % keys))
+        except RateLimited:
+            pass
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def evict(store: RateLimitStore, keys: int) -> float:
+    """Fill the store with keys that are all full again. Returns milliseconds."""
+    for i in range(keys):
+        store.take(str(i), 1, 10, 0)
+    start = time.perf_counter()
+    store.evict(time.time())
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hits", type=int, default=20_000)
+    parser.add_argument("--keys", type=int, default=100_000)
+    args = parser.parse_args()
+
+    engine = create_db_engine(Settings())
+    migrations.migrate(engine)
+    stores = {
+        "memory": MemoryRateLimitStore(),
+        "sqlite": SQLiteRateLimitStore(engine),
+    }
+    print(f"{'store':>6} {'us/hit':>7} {'evict ms':>9}")
+    for name, store in stores.items():
+        per_hit = asyncio.run(hits(store, args.hits, args.keys))
+        store.clear()
+        evict_ms = evict(store, args.keys)
+        print(f"{name:>6} {per_hit:>7.1f} {evict_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
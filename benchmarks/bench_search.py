@@ -0,0 +1,125 @@
+"""
+Compare full-text search through the FTS5 index with a LIKE scan of the post table.
+
+Seeds a temporary database with posts made of words drawn from a synthetic vocabulary,
+with a few words much more common than the rest like in real text. Then times the
+first page of results for common, rare and multi-word queries with
+`crud.search_posts` and with an unindexed `LIKE '%word%'` query.
+
+Usage:
+    python -m benchmarks.bench_search [--posts 1000000] [--vocabulary 50000]
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+# point the app at a scratch database before anything from fastr is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(_tmpdir, "bench.sqlite")
+
+from fastr.db import crud  # noqa: E402
+from fastr.config import Settings  # noqa: E402
+from fastr.db.database import Database  # noqa: E402
+from benchmarks.seed import seed_database  # noqa: E402
+
+N_USERS = 100
+PAGE_SIZE = 20
+
+
+def time_call(func, repeat: int = 5) -> float:
+    """Median wall time of func() in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def make_vocabulary(size: int) -> list:
+    rng = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(letters, k=rng.randint(3, 10))))
+    return sorted(words)
+
+
+def seed_posts(database_path: str, vocabulary: list, n_posts: int, batch_size=10_000):
+    """Insert posts with a title of 3-8 words and a body of 20-60 words."""
+    rng = random.Random(1)
+    # Zipf-like word frequencies: the word at rank r is drawn with weight 1 / r
+    weights = list(itertools.accumulate(1 / r for r in range(1, len(vocabulary) + 1)))
+
+    def words(n):
+        return " ".join(rng.choices(vocabulary, cum_weights=weights, k=n))
+
+    posts = (
+        (words(rng.randint(3, 8)), words(rng.randint(20, 60)), i % N_USERS + 1)
+        for i in range(n_posts)
+    )
+    db = sqlite3.connect(database_path)
+    while True:
+        batch = list(itertools.islice(posts, batch_size))
+        if not batch:
+            break
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES (?, ?, ?)", batch
+        )
+        db.commit()
+    db.close()
+
+
+def like_search(db, query: str):
+    """The search a site without a full-text index would do."""
+    words = query.split()
+    where = " AND ".join(
+        f"(title LIKE :w{i} OR body LIKE :w{i})" for i in range(len(words))
+    )
+    params = {f"w{i}": f"%{word}%" for i, word in enumerate(words)}
+    return db.execute(
+        f"SELECT id, title, body FROM post WHERE {where} LIMIT {PAGE_SIZE}", params
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--posts", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    args = parser.parse_args()
+
+    database_path = os.environ["FASTR_DATABASE_PATH"]
+    vocabulary = make_vocabulary(args.vocabulary)
+    print(f"seeding {args.posts:,} posts...")
+    start = time.perf_counter()
+    seed_database(database_path, N_USERS, 0, rounds=4)
+    seed_posts(database_path, vocabulary, args.posts)
+    print(f"seeded in {time.perf_counter() - start:.1f}s")
+
+    queries = {
+        "common": vocabulary[0],
+        "rare": vocabulary[-1],
+        "two common": f"{vocabulary[0]} {vocabulary[1]}",
+        "common + rare": f"{vocabulary[0]} {vocabulary[len(vocabulary) // 2]}",
+        "no match": "zzzzzzzzzzzz",
+    }
+    db = Database(Settings()).session_factory()
+    print(f"{'query':>14} {'matches':>9} {'fts ms':>8} {'like ms':>9}")
+    for name, query in queries.items():
+        matches = db.execute(
+            "SELECT count(*) FROM post_fts WHERE post_fts MATCH :q",
+            {"q": crud._match_expression(query)},
+        ).scalar()
+        fts_ms = time_call(lambda: crud.search_posts(db, query, limit=PAGE_SIZE))
+        like_ms = time_call(lambda: like_search(db, query), repeat=3)
+        print(f"{name:>14} {matches:>9,} {fts_ms:>8.2f} {like_ms:>9.2f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
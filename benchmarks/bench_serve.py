@@ -0,0 +1,110 @@
+"""
+Throughput of fastr.serve with 1 to N worker processes.
+
+Seeds a scratch database, then for each worker count starts the launcher, waits for it
+to answer, and drives a route from load generator processes for a fixed time. The load
+generators need CPU too, so the numbers understate the scaling unless the machine has
+spare cores for them.
+
+Usage:
+    python -m benchmarks.bench_serve [--max-workers N] [--seconds 10]
+        [--path /] [--clients 4] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.seed import seed_database
+from fastr.serve import available_cpus
+
+PORT = 8765
+
+
+def generate_load(url: str, seconds: float, concurrency: int) -> int:
+    """Request url from concurrent connections for the given time. Returns the count."""
+
+    async def run() -> int:
+        done = 0
+        deadline = time.perf_counter() + seconds
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits) as client:
+
+            async def worker():
+                nonlocal done
+                while time.perf_counter() < deadline:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                    done += 1
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return done
+
+    return asyncio.run(run())
+
+
+def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            httpx.get(url).raise_for_status()
+            return
+        except httpx.HTTPError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-workers", type=int, default=available_cpus())
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--path", default="/", help="route to request")
+    parser.add_argument("--clients", type=int, default=4, help="load generators")
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="connections per load generator"
+    )
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    seed_database(database_path, n_users=100, n_posts=10_000, rounds=4)
+    env = {
+        **os.environ,
+        "FASTR_DATABASE_PATH": database_path,
+        "FASTR_SQLITE_PROFILE": "production",
+    }
+    url = f"http://127.0.0.1:{PORT}"
+
+    print(f"{'workers':>8} {'req/s':>8} {'speedup':>8}")
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        server = subprocess.Popen(
+            [sys.executable, "-m", "fastr.serve", "--port", str(PORT)]
+            + ["--workers", str(workers)],
+            env=env,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(url + "/hello")
+            with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+                counts = pool.starmap(
+                    generate_load,
+                    [(url + args.path, args.seconds, args.concurrency)] * args.clients,
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+        throughput = sum(counts) / args.seconds
+        baseline = baseline or throughput
+        print(f"{workers:>8} {throughput:>8.0f} {throughput / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
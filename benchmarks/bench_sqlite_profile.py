@@ -0,0 +1,130 @@
+"""
+Concurrent read/write load test for the SQLite tuning profiles.
+
+For each profile, reader processes fetch the first page of the feed while writer
+processes create and update posts at a fixed rate, so both profiles are given the
+same write work. Separate processes are used (like separate server workers) so the
+results reflect SQLite locking rather than GIL contention. Reports read latency
+percentiles and the write throughput achieved.
+
+Usage:
+    python -m benchmarks.bench_sqlite_profile [--seconds 5] [--readers 4] [--writers 2]
+        [--write-rate 40]
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from fastr.config import Settings
+from benchmarks.seed import seed_database
+from fastr.db import crud, schemas
+from fastr.db.database import create_db_engine
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _session(settings: Settings):
+    engine = create_db_engine(settings)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def reader(settings: Settings, seconds: float) -> Tuple[List[float], int]:
+    """Read the feed for the given time. Returns the latencies and error count."""
+    db = _session(settings)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            crud.get_post_listings(db, limit=20)
+        except Exception:
+            errors += 1
+        db.rollback()  # end the read transaction
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+
+def writer(settings: Settings, seconds: float, rate: float) -> Tuple[int, int]:
+    """Create and update posts at the given rate. Returns the write and error counts."""
+    db = _session(settings)
+    writes, errors, i = 0, 0, 0
+    interval = 2 / rate  # each iteration does two writes
+    next_write = start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        next_write += interval
+        time.sleep(max(0.0, next_write - time.perf_counter()))
+        try:
+            crud.create_post(db, schemas.Post(title="new", body="y" * 500), 1)
+            update = schemas.PostUpdate(id=i % 200 + 1, title="up", body="")
+            crud.update_post(db, update)
+            writes += 2
+        except Exception:
+            errors += 1
+            db.rollback()
+        i += 1
+    return writes, errors
+
+
+def run_profile(profile: str, args: argparse.Namespace) -> Dict[str, float]:
+    settings = Settings(
+        database_path=os.path.join(tempfile.mkdtemp(), "bench.sqlite"),
+        sqlite_profile=profile,
+    )
+    seed_database(settings.database_path, n_users=1, n_posts=200, rounds=4)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.readers + args.writers) as pool:
+        readers = [
+            pool.apply_async(reader, (settings, args.seconds))
+            for _ in range(args.readers)
+        ]
+        writers = [
+            pool.apply_async(writer, (settings, args.seconds, args.write_rate))
+            for _ in range(args.writers)
+        ]
+        read_results = [r.get() for r in readers]
+        write_results = [w.get() for w in writers]
+
+    latencies = [t for result in read_results for t in result[0]]
+    return {
+        "reads": len(latencies),
+        "read_p50_ms": statistics.median(latencies) * 1000,
+        "read_p99_ms": percentile(latencies, 99) * 1000,
+        "writes_per_sec": sum(w for w, _ in write_results) / args.seconds,
+        "errors": sum(e for _, e in read_results) + sum(e for _, e in write_results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument(
+        "--write-rate", type=float, default=40, help="writes per second per writer"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'profile':>12} {'reads':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'writes/s':>9} {'errors':>7}"
+    )
+    for profile in ("default", "production"):
+        r = run_profile(profile, args)
+        print(
+            f"{profile:>12} {r['reads']:>8} {r['read_p50_ms']:>8.2f} "
+            f"{r['read_p99_ms']:>8.2f} {r['writes_per_sec']:>9.0f} {r['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure how long a new worker takes to start.
+
+Each measurement runs in a fresh Python process, like a new server worker:
+
+- import: `import fastr.main`, which builds the app
+- startup: the app's startup events
+- first request: a request to /hello once the app has started
+- schema check: the database work at startup, fastr.db.migrations.check
+- create_all: what each worker used to do at import instead, create_all on an already
+  created database
+
+Keep an eye on these as the app grows, since every worker (and every test run) pays
+them.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.seed import seed_database
+
+# run in the child processes; prints the timings in milliseconds as JSON
+CHILD = """
+import json, time
+start = time.perf_counter()
+import fastr.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(fastr.main.app)
+start_startup = time.perf_counter()
+client.__enter__()
+started = time.perf_counter()
+client.get("/hello")
+responded = time.perf_counter()
+client.__exit__(None, None, None)
+
+from sqlalchemy import create_engine
+from fastr.db import migrations, models
+from fastr.config import Settings
+settings = Settings()
+engine = create_engine(f"sqlite:///{settings.database_path}")
+start_check = time.perf_counter()
+migrations.check(engine)
+checked = time.perf_counter()
+engine.dispose()
+engine = create_engine(f"sqlite:///{settings.database_path}")
+start_create = time.perf_counter()
+models.Base.metadata.create_all(bind=engine)
+created = time.perf_counter()
+
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "startup": (started - start_startup) * 1000,
+    "first request": (responded - started) * 1000,
+    "schema check": (checked - start_check) * 1000,
+    "create_all": (created - start_create) * 1000,
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    seed_database(database_path, n_users=10, n_posts=1000, rounds=4)
+    env = {**os.environ, "FASTR_DATABASE_PATH": database_path}
+
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", CHILD],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(args.runs)
+    ]
+
+    print(f"{'step':>15} {'median ms':>10} {'max ms':>8}")
+    for step in runs[0]:
+        timings = [run[step] for run in runs]
+        print(f"{step:>15} {statistics.median(timings):>10.1f} {max(timings):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Cost of the background task queue (see fastr.tasks).
+
+Enqueues no-op tasks and reports what enqueueing costs the request that does it and
+how many tasks a second the workers get through, for coroutine tasks, which run on the
+event loop, and plain function tasks, which run on the threadpool.
+
+Usage:
+    python -m benchmarks.bench_tasks [--tasks 2000]
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable
+
+from fastr.config import Settings
+from fastr.tasks import TaskQueue
+
+
+async def noop_async(i):
+    pass
+
+
+def noop_sync(i):
+    pass
+
+
+async def run(queue: TaskQueue, task: Callable, n: int):
+    """Returns microseconds per enqueue, and tasks run per second."""
+    queue.start()
+    start = time.perf_counter()
+    for i in range(n):
+        await queue.enqueue(task, i)
+    enqueued = time.perf_counter()
+    await queue.stop(timeout=600)
+    done = time.perf_counter()
+    return (enqueued - start) / n * 1e6, n / (done - start)
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=settings.task_workers)
+    args = parser.parse_args()
+
+    print(f"{'task':>6} {'us/enqueue':>11} {'tasks/s':>8}")
+    for name, task in (("async", noop_async), ("sync", noop_sync)):
+        queue = TaskQueue(args.workers, max_attempts=1, retry_delay=1)
+        queue.task()(task)
+        per_enqueue, per_second = asyncio.run(run(queue, task, args.tasks))
+        print(f"{name:>6} {per_enqueue:>11.1f} {per_second:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Post writes per second with and without group commit (see fastr.db.batching).
+
+Concurrent tasks each create posts one after another through async_crud, like
+requests to POST /create. Without batching every post is its own transaction; with it,
+posts that arrive together are committed in one. Both runs use the production SQLite
+profile.
+
+Usage:
+    python -m benchmarks.bench_write_batching [--seconds 5] [--concurrency 1 8 32 64]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# use a scratch database, set before fastr.db.database is imported
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+os.environ["FASTR_SQLITE_PROFILE"] = "production"
+
+from benchmarks.seed import seed_database
+from fastr.config import Settings
+from fastr.db import async_crud, schemas
+from fastr.db.database import Database
+
+
+async def run(database: Database, concurrency: int, seconds: float) -> int:
+    """Create posts from concurrent tasks for the given time. Returns the count."""
+    post = schemas.Post(title="new", body="y" * 500)
+    deadline = time.perf_counter() + seconds
+    writes = 0
+
+    async def writer():
+        nonlocal writes
+        while time.perf_counter() < deadline:
+            # a session per write, like a session per request
+            with database.session_factory() as db:
+                await async_crud.create_post(db, post, 1)
+            writes += 1
+
+    await asyncio.gather(*(writer() for _ in range(concurrency)))
+    await database.close()
+    return writes
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument(
+        "--delay-ms", type=float, default=settings.write_batch_delay_ms
+    )
+    args = parser.parse_args()
+
+    seed_database(settings.database_path, n_users=1, n_posts=200, rounds=4)
+
+    print(f"{'tasks':>6} {'batching':>9} {'writes/s':>9} {'per batch':>10}")
+    for concurrency in args.concurrency:
+        for batching in (False, True):
+            database = Database(
+                settings.copy(
+                    update={
+                        "write_batching": batching,
+                        "write_batch_delay_ms": args.delay_ms,
+                    }
+                )
+            )
+            writes = asyncio.run(run(database, concurrency, args.seconds))
+            stats = database.write_batcher.stats()
+            per_batch = stats["writes"] / stats["batches"] if batching else 1
+            print(
+                f"{concurrency:>6} {str(batching):>9} {writes / args.seconds:>9.0f} "
+                f"{per_batch:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
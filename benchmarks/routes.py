@@ -0,0 +1,214 @@
+"""
+Load test every route of the app in-process and report the results as JSON.
+
+Seeds a scratch database (see benchmarks.seed), then drives each route through an
+in-process ASGI client with the given number of concurrent clients. Each client is
+logged in as its own user and only updates and deletes that user's posts. Routes are
+run one after another so the SQL statements can be attributed to each of them.
+
+For each route the report has the throughput, latency percentiles, SQL statements per
+request and any unexpected status codes, which also make it exit with status 1. App
+settings are taken from the environment as usual (except that login rate limiting is
+off unless FASTR_LOGIN_RATE_LIMIT says otherwise), e.g.
+
+    FASTR_DATABASE_MODE=async python -m benchmarks.routes --concurrency 16
+
+Usage:
+    python -m benchmarks.routes [--users 100] [--posts 10000] [--concurrency 8]
+        [--requests 200] [--routes index login ...] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Callable, Dict, List
+
+# point the app at a scratch database before anything from fastr is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["FASTR_DATABASE_PATH"] = os.path.join(_tmpdir, "bench.sqlite")
+# every client comes from the same address, so the per-IP login limit would turn most
+# logins into 429s
+os.environ.setdefault("FASTR_LOGIN_RATE_LIMIT", "false")
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from benchmarks.seed import PASSWORD, seed_database  # noqa: E402
+from fastr.config import Settings  # noqa: E402
+from fastr.db.database import Database  # noqa: E402
+from fastr.main import app  # noqa: E402
+
+
+class Client:
+    """An HTTP client logged in as one of the seeded users, and that user's posts."""
+
+    def __init__(self, http: httpx.AsyncClient, username: str, post_ids: List[int]):
+        self.http = http
+        self.username = username
+        self.post_ids = post_ids
+
+
+# route name -> (expected status, function making one request)
+ROUTES: Dict[str, tuple] = {
+    "index": (200, lambda c, i: c.http.get("/")),
+    "api_posts": (200, lambda c, i: c.http.get("/api/v1/posts")),
+    "login": (
+        302,
+        lambda c, i: c.http.post(
+            "/auth/login", data={"username": c.username, "password": PASSWORD}
+        ),
+    ),
+    "create": (
+        302,
+        lambda c, i: c.http.post("/create", data={"title": f"new {i}", "body": "b"}),
+    ),
+    "update_page": (200, lambda c, i: c.http.get(f"/{c.post_ids[i]}/update")),
+    "update": (
+        302,
+        lambda c, i: c.http.post(
+            f"/{c.post_ids[i]}/update", data={"title": f"up {i}", "body": "b"}
+        ),
+    ),
+    "delete": (302, lambda c, i: c.http.post(f"/{c.post_ids[i]}/delete")),
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class StatementCounter:
+    """Count the SQL statements run on the app's engines."""
+
+    def __init__(self, database: Database):
+        self.count = 0
+        for engine in (database.engine, database.async_engine.sync_engine):
+            event.listen(engine, "before_cursor_execute", self._increment)
+
+    def _increment(self, *args):
+        self.count += 1
+
+
+async def run_route(
+    clients: List[Client], n_requests: int, expected: int, request: Callable
+) -> dict:
+    """Make n_requests spread over the clients, which all run concurrently."""
+    latencies: List[float] = []
+    unexpected: Counter = Counter()
+
+    async def run_client(client: Client, indexes: range):
+        for i in indexes:
+            start = time.perf_counter()
+            response = await request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != expected:
+                unexpected[response.status_code] += 1
+
+    per_client = n_requests // len(clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(c, range(per_client)) for c in clients))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "unexpected_status": dict(unexpected),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    settings = Settings()
+    seed_database(
+        settings.database_path, args.users, args.posts, rounds=settings.bcrypt_rounds
+    )
+    await app.router.startup()
+    counter = StatementCounter(app.state.database)
+
+    # client c is user c + 1, who wrote posts c + 1, c + 1 + n_users, ...
+    clients = []
+    for c in range(args.concurrency):
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench"
+        )
+        post_ids = list(range(c + 1, args.posts + 1, args.users))
+        clients.append(Client(http, f"user{c}", post_ids))
+        await ROUTES["login"][1](clients[-1], 0)
+
+    results = {}
+    for name in args.routes:
+        expected, request = ROUTES[name]
+        counter.count = 0
+        result = await run_route(clients, args.requests, expected, request)
+        result["sql_per_request"] = counter.count / result["requests"]
+        results[name] = result
+        print(f"{name}: {result['throughput']:.1f} req/s", file=sys.stderr)
+
+    for client in clients:
+        await client.http.aclose()
+    await app.router.shutdown()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--output", help="write the JSON report here, not stdout")
+    args = parser.parse_args()
+
+    if args.concurrency > args.users:
+        parser.error("--concurrency can't be more than --users")
+    if args.requests // args.concurrency > args.posts // args.users:
+        parser.error("not enough posts per user for --requests updates and deletes")
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "settings": Settings().dict(exclude={"secret_key", "database_path"}),
+        "routes": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    unexpected = {
+        name: result["unexpected_status"]
+        for name, result in report["routes"].items()
+        if result["unexpected_status"]
+    }
+    if unexpected:
+        sys.exit(f"unexpected status codes: {unexpected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Fill a database with synthetic users and posts for benchmarking.
+
+Like tests/data.sql, but generated at any size. Users are named user0, user1, ... and
+all share one password. Post i is written by user (i % n_users) and posts are a few
+seconds apart, starting on 2000-01-01.
+
+Usage:
+    python -m benchmarks.seed PATH [--users 100] [--posts 10000]
+"""
+import argparse
+import itertools
+import sqlite3
+
+from fastr.config import Settings
+from fastr.db import author_stats, migrations
+from fastr.db.database import create_db_engine
+from fastr.hashing import make_context
+
+PASSWORD = "bench"
+
+
+def seed_database(
+    database_path: str,
+    n_users: int,
+    n_posts: int,
+    rounds: int = 12,
+    body_size: int = 200,
+    batch_size: int = 10_000,
+):
+    """
+    Create the tables in a database and insert the synthetic users and posts.
+
+    Parameters
+    ----------
+    database_path
+        SQLite database to fill
+    n_users
+        number of users
+    n_posts
+        number of posts
+    rounds
+        bcrypt cost of the users' password hash, which sets the cost of logging in
+    body_size
+        length of each post body in characters
+    batch_size
+        rows inserted per executemany call
+    """
+    engine = create_db_engine(Settings(database_path=database_path))
+    migrations.migrate(engine)
+    engine.dispose()
+
+    hashed_password = make_context(rounds).hash(PASSWORD)
+    body = ("lorem ipsum " * (body_size // 12 + 1))[:body_size]
+    db = sqlite3.connect(database_path)
+    db.executemany(
+        "INSERT INTO user (username, hashed_password) VALUES (?, ?)",
+        ((f"user{i}", hashed_password) for i in range(n_users)),
+    )
+    posts = ((f"post {i}", body, i % n_users + 1, i * 7) for i in range(n_posts))
+    while True:
+        batch = list(itertools.islice(posts, batch_size))
+        if not batch:
+            break
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created) "
+            "VALUES (?, ?, ?, datetime('2000-01-01', ? || ' seconds'))",
+            batch,
+        )
+    db.execute(author_stats.REPAIR)
+    db.commit()
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="SQLite database to create or add to")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    args = parser.parse_args()
+    seed_database(args.path, args.users, args.posts, rounds=args.rounds)
+
+
+if __name__ == "__main__":
+    main()
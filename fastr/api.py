@@ -0,0 +1,115 @@
+"""
+JSON API for clients that would otherwise scrape the HTML pages.
+
+Responses are serialized with orjson. List endpoints build plain dicts from the rows
+crud returns rather than going through Pydantic models, which would cost more than
+the query for a full page. The field names come from fastr.db.schemas, and `fields`
+selects a subset of them, e.g. `/api/v1/posts?fields=id,title`.
+
+Pages of the post list are cached along with the HTML feed (see fastr.cache).
+"""
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy.engine import Row
+from typing import Optional, Tuple
+
+from fastr import cache
+from fastr.db.database import DBSession, get_read_session, is_replica
+from fastr.db import async_crud, schemas
+from fastr.db.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+router = APIRouter(
+    prefix="/api/v1", tags=["api"], default_response_class=ORJSONResponse
+)
+
+MAX_PAGE_SIZE = 100
+
+POST_FIELDS = tuple(schemas.PostListing.__fields__)
+USER_FIELDS = tuple(schemas.LoggedInUser.__fields__)
+
+
+def post_fields(
+    fields: Optional[str] = Query(
+        None, description=f"comma separated subset of: {', '.join(POST_FIELDS)}"
+    )
+) -> Tuple[str, ...]:
+    """The post fields to include in a response, from the `fields` parameter."""
+    if not fields:
+        return POST_FIELDS
+    selected = tuple(dict.fromkeys(field.strip() for field in fields.split(",")))
+    unknown = [field for field in selected if field not in POST_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def _post_dict(row: Row, fields: Tuple[str, ...]) -> dict:
+    mapping = row._mapping
+    return {field: mapping[field] for field in fields}
+
+
+@router.get("/posts")
+async def list_posts(
+    cursor: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Tuple[str, ...] = Depends(post_fields),
+    db: DBSession = Depends(get_read_session),
+):
+    """
+    List posts, most recent first.
+
+    Pass the returned `next_cursor` as `cursor` to get the next page. It is null on the
+    last page.
+    """
+    # read before querying, so a concurrent write prevents caching
+    generation = cache.feed_generation()
+    key = ("api_posts", cursor, limit, fields)
+    body = cache.feed_cache.get(key)
+    if body is None:
+        try:
+            before = decode_cursor(cursor) if cursor else None
+        except InvalidCursor as e:
+            raise HTTPException(400, str(e))
+
+        # fetch one extra post to find out whether there is another page
+        posts = await async_crud.get_post_listings(db, before=before, limit=limit + 1)
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1].created, posts[-1].id)
+
+        body = orjson.dumps(
+            {
+                "posts": [_post_dict(post, fields) for post in posts],
+                "next_cursor": next_cursor,
+            }
+        )
+        # not from a replica, which may not have the latest writes yet
+        if not is_replica(db):
+            cache.set_feed(key, body, generation)
+
+    return Response(body, media_type="application/json")
+
+
+@router.get("/posts/{id}")
+async def get_post(
+    id: int,
+    fields: Tuple[str, ...] = Depends(post_fields),
+    db: DBSession = Depends(get_read_session),
+):
+    """Get one post."""
+    post = await async_crud.get_post_listing(db, id)
+    if post is None:
+        raise HTTPException(404, f"Post id {id} doesn't exist.")
+    return ORJSONResponse(_post_dict(post, fields))
+
+
+@router.get("/users/{username}")
+async def get_user(username: str, db: DBSession = Depends(get_read_session)):
+    """Get a user's public details."""
+    user = await async_crud.get_user_by_username(db, username)
+    if user is None:
+        raise HTTPException(404, f"User {username} doesn't exist.")
+    return ORJSONResponse({field: getattr(user, field) for field in USER_FIELDS})
@@ -0,0 +1,115 @@
+"""
+Static files served with content-hashed URLs.
+
+url_for('static', path='style.css') in a template gives a URL with a hash of the
+file's contents in its name, e.g. /static/style.0b8e7c1d2f3a.css. A changed file gets a
+new URL, so responses for hashed URLs can be cached by browsers forever. The plain URL
+still works, but clients have to revalidate it.
+
+Every file is read when the app starts, along with gzip and (if the brotli or
+brotlicffi package is installed) brotli compressed copies, and is served from memory.
+Files added or changed after startup are served from disk by the normal StaticFiles
+code, without a hashed URL.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from fastapi.staticfiles import StaticFiles
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Scope
+from typing import Dict, NamedTuple, Optional
+
+from fastr.compression import brotli
+from fastr.utils import etag_matches, make_etag, negotiate_encoding
+
+
+# a year, the longest max-age clients are expected to honour
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Asset(NamedTuple):
+    hashed_path: str
+    media_type: str
+    # the file's contents and their ETags, keyed by content coding ("identity", "gzip"
+    # or "br")
+    bodies: Dict[str, bytes]
+    etags: Dict[str, str]
+
+
+class HashedStaticFiles(StaticFiles):
+    """StaticFiles that serves files from memory under content-hashed names."""
+
+    def __init__(self, *, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self._assets: Optional[Dict[str, Asset]] = None
+
+    @property
+    def assets(self) -> Dict[str, Asset]:
+        """Assets by both their plain and hashed paths. Loaded on first use."""
+        if self._assets is None:
+            self.load()
+        return self._assets
+
+    def load(self):
+        """Read, hash and compress every file in the directory."""
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    asset = _make_asset(path, f.read())
+                assets[path] = assets[asset.hashed_path] = asset
+        self._assets = assets
+
+    def url_path(self, path: str) -> str:
+        """The hashed path of a file, for use in URLs."""
+        asset = self.assets.get(path)
+        return path if asset is None else asset.hashed_path
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        path = path.replace(os.sep, "/")
+        asset = self.assets.get(path)
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        request = Request(scope)
+        encoding = negotiate_encoding(
+            request.headers.get("accept-encoding", ""), asset.bodies
+        )
+        headers = {
+            "ETag": asset.etags[encoding],
+            "Cache-Control": IMMUTABLE if path == asset.hashed_path else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request, asset.etags[encoding]):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            asset.bodies[encoding], media_type=asset.media_type, headers=headers
+        )
+
+
+def _make_asset(path: str, body: bytes) -> Asset:
+    digest = hashlib.blake2b(body, digest_size=6).hexdigest()
+    stem, ext = os.path.splitext(path)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    bodies = {"identity": body}
+    compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(body)
+    for encoding, data in compressed.items():
+        # images and the like are compressed already
+        if len(data) < len(body):
+            bodies[encoding] = data
+
+    etags = {encoding: make_etag(data) for encoding, data in bodies.items()}
+    return Asset(f"{stem}.{digest}{ext}", media_type, bodies, etags)
+
+
+static_files = HashedStaticFiles(directory="fastr/static")
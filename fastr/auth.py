@@ -1,39 +1,120 @@
+import time
+from typing import NamedTuple
+
 from fastapi import APIRouter, Request, Form, Depends
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-
-from fastr.db.database import get_db
-from fastr.db import crud, schemas
+from sqlalchemy.engine import Engine
+
+from fastr import tasks
+from fastr.config import Settings
+from fastr.db.database import DBSession, get_read_session, get_session
+from fastr.db import async_crud, schemas
+from fastr.hashing import HasherBusy, hasher
+from fastr.metrics import add_hash_time
+from fastr.ratelimit import MemoryRateLimitStore, RateLimiter, SQLiteRateLimitStore
+from fastr.templating import templates
 from fastr.utils import flash
 
 
 router = APIRouter(prefix="/auth", tags=["auth"])
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-templates = Jinja2Templates(directory=str("fastr/templates"))
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+class LoginLimits(NamedTuple):
+    """The rate limits on login and registration attempts."""
+
+    ip: RateLimiter
+    username: RateLimiter
+
+
+def create_login_limits(settings: Settings, engine: Engine) -> LoginLimits:
+    """
+    Create the login rate limits described by settings. engine is the app's database,
+    where the sqlite backend keeps them.
+    """
+    if settings.rate_limit_backend == "sqlite":
+        store = SQLiteRateLimitStore(engine)
+    else:
+        store = MemoryRateLimitStore()
+    return LoginLimits(
+        ip=RateLimiter(
+            store,
+            "login_ip:",
+            burst=settings.login_ip_burst,
+            per_minute=settings.login_ip_per_minute,
+        ),
+        username=RateLimiter(
+            store,
+            "login_username:",
+            burst=settings.login_username_burst,
+            per_minute=settings.login_username_per_minute,
+        ),
+    )
+
+
+# username is optional here so a missing one is only reported once, by the route
+async def limit_attempts(request: Request, username: str = Form("")):
+    """
+    Limit the login and registration attempts from each client IP and for each
+    username, since each one costs a bcrypt hash. Runs before the route touches the
+    database or the hasher, and raises fastr.ratelimit.RateLimited when the client
+    should back off. The limits are created when the app starts, in
+    app.state.login_limits.
+    """
+    if not request.app.state.settings.login_rate_limit:
+        return
+    limits: LoginLimits = request.app.state.login_limits
+    await limits.ip.hit(request.client.host)
+    await limits.username.hit(username.lower())
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    start = time.perf_counter()
+    try:
+        return await hasher.verify(plain_password, hashed_password)
+    finally:
+        add_hash_time(time.perf_counter() - start)
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    start = time.perf_counter()
+    try:
+        return await hasher.hash(password)
+    finally:
+        add_hash_time(time.perf_counter() - start)
+
+
+@tasks.queue.task()
+async def rehash_password(user: schemas.UserInDB, password: str):
+    """
+    Replace a user's password hash with one made with the configured scheme and cost.
+    Runs as a background task, so the login doesn't wait for a second hash. Skipped
+    when the hasher is busy; the next login will try again.
+    """
+    if tasks.queue.app is None:
+        return
+    try:
+        hashed_password = await hasher.hash(password)
+    except HasherBusy:
+        return
+    async with tasks.queue.app.state.database.primary_session() as db:
+        if await async_crud.update_password_hash(db, user, hashed_password):
+            hasher.stats.rehashed += 1
 
 
 @router.get("/register", response_class=HTMLResponse)
-def register_page(request: Request):
+async def register_page(request: Request):
     """Display the user registration page"""
     return templates.TemplateResponse("auth/register.html", {"request": request})
 
 
-@router.post("/register", response_class=HTMLResponse)
-def register_post(
+@router.post(
+    "/register", dependencies=[Depends(limit_attempts)], response_class=HTMLResponse
+)
+async def register_post(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_session),
 ):
     """
     Register a new user.
@@ -46,14 +127,14 @@ def register_post(
     """
     error = None
 
-    if crud.get_user_by_username(db, username):
+    if await async_crud.get_user_by_username(db, username):
         error = f"User {username} is already registered."
 
     if error is None:
         # Success -- add user to database and redirect to login screen
-        hashed_password = get_password_hash(password)
+        hashed_password = await get_password_hash(password)
         user = schemas.UserCreate(username=username, hashed_password=hashed_password)
-        crud.create_user(db, user)
+        await async_crud.create_user(db, user)
         return RedirectResponse("/auth/login", status_code=302)
     else:
         # Error -- redirect back to register page and flash the error
@@ -62,26 +143,28 @@ def register_post(
 
 
 @router.get("/login", response_class=HTMLResponse)
-def login_page(request: Request):
+async def login_page(request: Request):
     """Display the login page"""
     return templates.TemplateResponse("auth/login.html", {"request": request})
 
 
-@router.post("/login", response_class=HTMLResponse)
-def login_post(
+@router.post(
+    "/login", dependencies=[Depends(limit_attempts)], response_class=HTMLResponse
+)
+async def login_post(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_read_session),
 ):
     """Log in a registered user by adding the user id to the session."""
     error = None
 
-    user = crud.get_user_by_username(db, username)
+    user = await async_crud.get_user_by_username(db, username)
 
     if user is None:
         error = "Incorrect username."
-    elif not verify_password(password, user.hashed_password):
+    elif not await verify_password(password, user.hashed_password):
         error = "Incorrect password."
 
     if error is None:
@@ -89,6 +172,9 @@ def login_post(
         clear_session(request)
         logged_in_user = schemas.LoggedInUser(id=user.id, username=user.username)
         request.session["user"] = logged_in_user.dict()
+        rehash = request.app.state.settings.password_rehash
+        if rehash and hasher.needs_update(user.hashed_password):
+            await tasks.queue.enqueue(rehash_password, user, password)
         return RedirectResponse("/", status_code=302)
     else:
         # Error -- redirect back to login page
@@ -97,7 +183,7 @@ def login_post(
 
 
 @router.get("/logout", response_class=HTMLResponse)
-def logout_page(request: Request):
+async def logout_page(request: Request):
     """Clear the current session, including the stored user id."""
     clear_session(request)
     return RedirectResponse("/", status_code=302)
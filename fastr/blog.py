@@ -1,14 +1,66 @@
+import time
+
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from fastapi.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from markupsafe import Markup
+from sqlalchemy.engine import Row
+from typing import Iterator, List, NamedTuple, Optional, Tuple
 
-from fastr.db.database import get_db
-from fastr.db import crud, schemas, models
+from fastr import cache, live, tasks
+from fastr.db.database import DBSession, get_read_session, get_session, is_replica
+from fastr.db import async_crud, schemas, models
+from fastr.db.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    decode_rank_cursor,
+    encode_cursor,
+    encode_rank_cursor,
+)
+from fastr.templating import stream_response, templates
+from fastr.utils import anonymous_request, http_date, make_etag, not_modified
 
 
 router = APIRouter(tags=["blog"])
-templates = Jinja2Templates(directory=str("fastr/templates"))
+
+POSTS_PER_PAGE = 100
+SEARCH_RESULTS_PER_PAGE = 20
+
+
+# stands in for the feed when the index is rendered around a streamed feed
+FEED_PLACEHOLDER = "<!-- feed -->"
+
+
+class CachedPage(NamedTuple):
+    body: bytes
+    etag: str
+    # unix time the page was rendered, sent as Last-Modified
+    modified: float
+
+
+def make_page(body: bytes) -> CachedPage:
+    """Wrap a freshly rendered page with its validators."""
+    return CachedPage(body, make_etag(body), time.time())
+
+
+def page_response(request: Request, page: CachedPage) -> Response:
+    """
+    Send a rendered page with its ETag and Last-Modified validators, or a 304 if the
+    client's copy is still current.
+    """
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": http_date(page.modified),
+        "Cache-Control": "no-cache",
+        "Vary": "Cookie",
+    }
+    if not_modified(request, page.etag, page.modified):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(page.body, headers=headers)
 
 
 # https://github.com/tiangolo/fastapi/issues/1039#issuecomment-591661667
@@ -23,25 +75,303 @@ class RequiresLoginException(Exception):
     pass
 
 
-def login_required(request: Request):
+async def login_required(request: Request):
     """Ensure a user is logged in."""
     if not request.session.get("user"):
         raise RequiresLoginException
 
 
 @router.get("/", response_class=HTMLResponse)
-def index(request: Request, db: Session = Depends(get_db)):
-    """Show all the posts, most recent first."""
-    posts = crud.get_posts(db)
+async def index(
+    request: Request,
+    cursor: Optional[str] = None,
+    db: DBSession = Depends(get_read_session),
+):
+    """
+    Show the posts, most recent first.
+
+    Posts are paginated with an opaque cursor. The "next" link on each page carries the
+    cursor for the page after it.
+
+    Rendered pages are cached until a post is written (see fastr.cache). Anonymous
+    visitors share cached pages. Logged in users get their own copy of the feed because
+    it has Edit links for their posts. A cache hit doesn't touch the database, and a
+    client whose copy of the page is current (by its ETag or Last-Modified) gets a 304.
+    """
+    # read before anything is rendered, so a concurrent write prevents caching
+    generation = cache.feed_generation()
+    feed_key, page_key = index_cache_keys(request, cursor)
+    page = cache.feed_cache.get(page_key) if page_key is not None else None
+
+    if page is None:
+        feed_html = cache.feed_cache.get(feed_key)
+        if feed_html is None and request.app.state.settings.stream_index:
+            feed = await render_feed(request, cursor, db)
+            if is_replica(db):
+                feed_key = page_key = None
+            return stream_index(request, feed, feed_key, page_key, generation)
+        page = await render_page(request, cursor, db, generation, feed_html)
+
+    return page_response(request, page)
+
+
+def index_cache_keys(
+    request: Request, cursor: Optional[str]
+) -> Tuple[tuple, Optional[tuple]]:
+    """
+    The keys a page of the index is cached under: one for the feed part, and one for
+    the whole page, or None if the page can't be shared by anonymous visitors.
+    """
+    user = request.session.get("user")
+    base_url = str(request.base_url)
+    feed_key = ("feed", base_url, cursor, user and user["id"])
+    # pages with flashed messages are one-offs, so only cache the feed part of them
+    if user is None and not request.session.get("flashes"):
+        return feed_key, ("page", base_url, cursor)
+    return feed_key, None
+
+
+async def render_page(
+    request: Request,
+    cursor: Optional[str],
+    db: DBSession,
+    generation: int,
+    feed_html: Optional[str] = None,
+) -> CachedPage:
+    """
+    Render a page of the index and cache it: the feed part, unless the cached one is
+    passed as feed_html, and the whole page if anonymous visitors can share it.
+
+    Nothing is cached if db is a replica. It may not have the write that cleared the
+    cache yet, and the old posts would then stay cached for Settings.feed_cache_ttl,
+    much longer than the replica lags.
+    """
+    feed_key, page_key = index_cache_keys(request, cursor)
+    if is_replica(db):
+        feed_key = page_key = None
+    if feed_html is None:
+        feed_html = "".join(await render_feed(request, cursor, db))
+        if feed_key is not None:
+            cache.set_feed(feed_key, feed_html, generation)
+
+    page = make_page(render_index(request, feed_html).encode("utf8"))
+    if page_key is not None:
+        cache.set_feed(page_key, page, generation)
+    return page
+
+
+async def render_feed(
+    request: Request, cursor: Optional[str], db: DBSession
+) -> Iterator[str]:
+    """Load one page of the feed and start rendering it."""
+    posts, next_cursor = await load_feed(cursor, db)
+    return templates.get_template("blog/_feed.html").generate(
+        {"request": request, "posts": posts, "next_cursor": next_cursor}
+    )
+
+
+async def load_feed(
+    cursor: Optional[str], db: DBSession, author_id: Optional[int] = None
+) -> Tuple[List[Row], Optional[str]]:
+    """
+    Load the posts on one page of the feed, or of one author's posts, and the cursor
+    for the next page.
+    """
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(400, str(e))
+
+    # fetch one extra post to find out whether there is another page
+    posts = await async_crud.get_post_listings(
+        db, before=before, limit=POSTS_PER_PAGE + 1, author_id=author_id
+    )
+    next_cursor = None
+    if len(posts) > POSTS_PER_PAGE:
+        posts = posts[:POSTS_PER_PAGE]
+        next_cursor = encode_cursor(posts[-1].created, posts[-1].id)
+    return posts, next_cursor
+
+
+@tasks.queue.task()
+async def warm_feed(base_url: str):
+    """
+    Render the first page of the index for anonymous visitors into the cache, after a
+    post write cleared it, so the next visitor doesn't wait for the render.
+    """
+    app = tasks.queue.app
+    if app is None:
+        return
+    request = anonymous_request(app, base_url)
+    generation = cache.feed_generation()
+    async with app.state.database.primary_session() as db:
+        await render_page(request, None, db, generation)
+
+
+async def after_post_write(request: Request, db: DBSession, kind: str, post_id: int):
+    """
+    Send a post that was just created, updated or deleted (the kind) to the live feed,
+    and enqueue the work that follows.
+    """
+    await live.publish_post(db, kind, post_id)
+    if request.app.state.settings.feed_warmup:
+        await tasks.queue.enqueue(warm_feed, str(request.base_url))
+
+
+def render_index(request: Request, feed_html: str) -> str:
+    """Render the index page around an already rendered feed."""
+    return templates.get_template("blog/index.html").render(
+        {
+            "request": request,
+            "feed_html": Markup(feed_html),
+            # only the first page shows new posts as they arrive
+            "live": "cursor" not in request.query_params,
+        }
+    )
+
+
+def stream_index(
+    request: Request,
+    feed: Iterator[str],
+    feed_key: Optional[tuple],
+    page_key: Optional[tuple],
+    generation: int,
+) -> StreamingResponse:
+    """
+    Send the index page while the feed is still rendering. Once it has all been sent,
+    the feed is cached under feed_key, and the whole page under page_key, if given.
+    """
+    head, tail = render_index(request, FEED_PLACEHOLDER).split(FEED_PLACEHOLDER)
+
+    def generate() -> Iterator[str]:
+        yield head
+        parts = []
+        for chunk in feed:
+            parts.append(chunk)
+            yield chunk
+        yield tail
+
+        feed_html = "".join(parts)
+        if feed_key is not None:
+            cache.set_feed(feed_key, feed_html, generation)
+        if page_key is not None:
+            page = make_page((head + feed_html + tail).encode("utf8"))
+            cache.set_feed(page_key, page, generation)
+
+    return stream_response(
+        generate(), headers={"Cache-Control": "no-cache", "Vary": "Cookie"}
+    )
+
+
+@router.get("/search", response_class=HTMLResponse)
+async def search(
+    request: Request,
+    q: str = "",
+    cursor: Optional[str] = None,
+    db: DBSession = Depends(get_read_session),
+):
+    """
+    Search the posts, best matches first, with the matched words highlighted.
+
+    Results are paginated with an opaque cursor, like the index.
+    """
+    try:
+        after = decode_rank_cursor(cursor) if cursor else None
+    except InvalidCursor as e:
+        raise HTTPException(400, str(e))
+
+    # fetch one extra result to find out whether there is another page
+    results = await async_crud.search_posts(
+        db, q, after=after, limit=SEARCH_RESULTS_PER_PAGE + 1
+    )
+    next_cursor = None
+    if len(results) > SEARCH_RESULTS_PER_PAGE:
+        results = results[:SEARCH_RESULTS_PER_PAGE]
+        last, rank = results[-1]
+        next_cursor = encode_rank_cursor(rank, last.id)
+
     return templates.TemplateResponse(
-        "blog/index.html", {"request": request, "posts": posts}
+        "blog/search.html",
+        {
+            "request": request,
+            "q": q,
+            "posts": [post for post, _ in results],
+            "next_cursor": next_cursor,
+        },
     )
 
 
+@router.get("/post/{id}", response_class=HTMLResponse)
+async def post_page(
+    request: Request, id: int, db: DBSession = Depends(get_read_session)
+):
+    """
+    Show a single post.
+
+    Cached and validated like the index page: anonymous visitors share a cached copy
+    until a post is written, and clients with a current copy get a 304.
+    """
+    generation = cache.feed_generation()
+    cache_page = not request.session.get("user") and not request.session.get("flashes")
+    key = ("post", str(request.base_url), id)
+    page = cache.feed_cache.get(key) if cache_page else None
+
+    if page is None:
+        post = await async_crud.get_post_listing(db, id)
+        if post is None:
+            raise HTTPException(404, f"Post id {id} doesn't exist.")
+        body = templates.get_template("blog/post.html").render(
+            {"request": request, "post": post}
+        )
+        page = make_page(body.encode("utf8"))
+        # not from a replica, which may not have the latest writes (see render_page)
+        if cache_page and not is_replica(db):
+            cache.set_feed(key, page, generation)
+
+    return page_response(request, page)
+
+
+@router.get("/user/{username}", response_class=HTMLResponse)
+async def user_page(
+    request: Request,
+    username: str,
+    cursor: Optional[str] = None,
+    db: DBSession = Depends(get_read_session),
+):
+    """
+    Show a user's posts, most recent first, and how many they have written.
+
+    Paginated like the index, and cached and validated like the post pages.
+    """
+    generation = cache.feed_generation()
+    cache_page = not request.session.get("user") and not request.session.get("flashes")
+    key = ("user", str(request.base_url), username, cursor)
+    page = cache.feed_cache.get(key) if cache_page else None
+
+    if page is None:
+        author = await async_crud.get_author(db, username)
+        if author is None:
+            raise HTTPException(404, f"User {username} doesn't exist.")
+        posts, next_cursor = await load_feed(cursor, db, author_id=author.id)
+        body = templates.get_template("blog/user.html").render(
+            {
+                "request": request,
+                "author": author,
+                "posts": posts,
+                "next_cursor": next_cursor,
+            }
+        )
+        page = make_page(body.encode("utf8"))
+        if cache_page and not is_replica(db):
+            cache.set_feed(key, page, generation)
+
+    return page_response(request, page)
+
+
 @router.get(
     "/create", dependencies=[Depends(login_required)], response_class=HTMLResponse
 )
-def create_page(request: Request):
+async def create_page(request: Request):
     """Create post page."""
     return templates.TemplateResponse("blog/create.html", {"request": request})
 
@@ -49,11 +379,11 @@ def create_page(request: Request):
 @router.post(
     "/create", dependencies=[Depends(login_required)], response_class=HTMLResponse
 )
-def create_post(
+async def create_post(
     request: Request,
     title: str = Form(...),
     body: str = Form(""),
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_session),
 ):
     """
     Create a new post for the current user.
@@ -62,16 +392,21 @@ def create_post(
     make sure it is populated. No need for an explicit check that it is not None or "".
     """
     post = schemas.Post(title=title, body=body)
-    crud.create_post(db=db, create_data=post, user_id=request.session["user"]["id"])
+    post = await async_crud.create_post(
+        db=db, create_data=post, user_id=request.session["user"]["id"]
+    )
+    await after_post_write(request, db, "created", post.id)
     return RedirectResponse("/", status_code=302)
 
 
 @router.get(
     "/{id}/update", dependencies=[Depends(login_required)], response_class=HTMLResponse
 )
-def update_page(request: Request, id: int, db: Session = Depends(get_db)):
+async def update_page(
+    request: Request, id: int, db: DBSession = Depends(get_read_session)
+):
     """Update post page."""
-    post = get_and_validate_post(id=id, db=db, request=request)
+    post = await get_and_validate_post(id=id, db=db, request=request)
     return templates.TemplateResponse(
         "blog/update.html", {"request": request, "post": post}
     )
@@ -80,12 +415,12 @@ def update_page(request: Request, id: int, db: Session = Depends(get_db)):
 @router.post(
     "/{id}/update", dependencies=[Depends(login_required)], response_class=HTMLResponse
 )
-def update_post(
+async def update_post(
     request: Request,
     id: int,
     title: str = Form(...),
     body: str = Form(""),
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_session),
 ):
     """
     Update an existing post that was created by the logged in user.
@@ -93,30 +428,32 @@ def update_post(
     Note: title is specified as a required field, so FastAPI's input validation will
     make sure it is populated. No need for an explicit check that it is not None or "".
     """
-    get_and_validate_post(id=id, db=db, request=request)
+    await get_and_validate_post(id=id, db=db, request=request)
 
     update_data = schemas.PostUpdate(id=id, title=title, body=body)
-    crud.update_post(db, update_data)
+    await async_crud.update_post(db, update_data)
+    await after_post_write(request, db, "updated", id)
     return RedirectResponse("/", status_code=302)
 
 
 @router.post(
     "/{id}/delete", dependencies=[Depends(login_required)], response_class=HTMLResponse
 )
-def delete_post(
+async def delete_post(
     request: Request,
     id: int,
-    db: Session = Depends(get_db),
+    db: DBSession = Depends(get_session),
 ):
     """Delete a post that was created by the logged in user."""
-    get_and_validate_post(id=id, db=db, request=request)
-    crud.delete_post(db, post_id=id)
+    await get_and_validate_post(id=id, db=db, request=request)
+    await async_crud.delete_post(db, post_id=id)
+    await after_post_write(request, db, "deleted", id)
     return RedirectResponse("/", status_code=302)
 
 
-def get_and_validate_post(
+async def get_and_validate_post(
     id: int,
-    db: Session,
+    db: DBSession,
     request: Request,
     check_author: bool = True,
 ) -> models.Post:
@@ -129,7 +466,7 @@ def get_and_validate_post(
     id
         id of post we were looking for
     db
-        database from get_db
+        session from get_session, or from get_read_session for pages that only read
     request
         API request
     check_author
@@ -146,15 +483,16 @@ def get_and_validate_post(
     403
         if the current user isn't the author
     """
-    post = crud.get_post_by_id(db, id)
+    post = await async_crud.get_post_by_id(db, id)
     if post is None:
         raise HTTPException(404, f"Post id {id} doesn't exist.")
 
-    user = schemas.LoggedInUser(**request.session.get("user", {}))
-    if check_author and post.author_id != user.id:
+    user = request.session.get("user", {})
+    if check_author and post.author_id != user.get("id"):
         raise HTTPException(
             403,
-            f"Post {id} was not posted by currently logged in user ({user.username}).",
+            f"Post {id} was not posted by currently logged in user "
+            f"({user.get('username')}).",
         )
 
     return post
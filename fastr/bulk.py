@@ -0,0 +1,308 @@
+"""
+Bulk import and export of users and posts as NDJSON (one JSON object per line).
+
+Each line is a user or a post:
+
+    {"type": "user", "id": 1, "username": "test", "hashed_password": "$2b$12$..."}
+    {"type": "post", "id": 1, "author_id": 1, "created": "2018-01-01T00:00:00",
+     "title": "test title", "body": "test body"}
+
+Both directions stream, so memory use doesn't grow with the size of the data. Exports
+write every user, then every post, in id order, and can be imported as they are.
+
+Imports insert rows in batches with executemany, one transaction per batch, instead of
+a commit per row like crud.create_user and crud.create_post. A user may have a plain
+"password" instead of a "hashed_password"; those are hashed in a process pool. The ids
+and post "created" times are optional and are assigned by the database when missing.
+A bad line stops the import with an error giving its line number. Batches before it
+have already been committed. Once every batch is in, the users' post counts are
+recomputed (see fastr.db.author_stats).
+
+The caches of a running server aren't invalidated by an import, so new posts show up
+on its index once the feed cache TTL runs out.
+
+Usage:
+    python -m fastr.bulk export [FILE]
+    python -m fastr.bulk import [FILE] [--batch-size 10000] [--workers N]
+
+FILE defaults to stdout or stdin. Progress is reported on stderr.
+"""
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from fastr.config import DEFAULTS, Settings
+from fastr.db import author_stats, models
+from fastr.db.crud import timestamp_key
+from fastr.db.database import create_db_engine
+from fastr.hashing import HashPolicy, _get_context
+
+
+USER_INSERT = "INSERT INTO user (id, username, hashed_password) VALUES (?, ?, ?)"
+POST_INSERT = (
+    "INSERT INTO post (id, author_id, created, title, body) "
+    "VALUES (?, ?, coalesce(?, CURRENT_TIMESTAMP), ?, ?)"
+)
+
+
+class InvalidRecord(ValueError):
+    """Raised when a line of an import can't be imported."""
+
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f"line {line_number}: {message}")
+        self.line_number = line_number
+
+
+class Progress:
+    """Prints a running count of rows and their rate to stderr, once a second."""
+
+    def __init__(self, verb: str, stream: Optional[TextIO] = sys.stderr):
+        self.verb = verb
+        self.stream = stream
+        self.counts: Dict[str, int] = {"user": 0, "post": 0}
+        self.start = self.last_report = time.perf_counter()
+
+    def add(self, kind: str, n: int):
+        self.counts[kind] += n
+        now = time.perf_counter()
+        if now - self.last_report >= 1:
+            self.last_report = now
+            self.report(end="\r")
+
+    def report(self, end: str = "\n"):
+        if self.stream is None:
+            return
+        total = sum(self.counts.values())
+        elapsed = time.perf_counter() - self.start
+        rate = total / elapsed if elapsed else 0
+        print(
+            f"{self.verb} {self.counts['user']:,} users and {self.counts['post']:,} "
+            f"posts in {elapsed:.1f}s ({rate:,.0f} rows/s)",
+            end=end,
+            file=self.stream,
+            flush=True,
+        )
+
+
+def export_ndjson(
+    engine: Engine,
+    out: TextIO,
+    batch_size: int = 10_000,
+    progress: Optional[Progress] = None,
+) -> Dict[str, int]:
+    """
+    Write every user and post to out as NDJSON.
+
+    Rows are fetched from the database batch_size at a time, so only one batch is in
+    memory however many posts there are.
+
+    Returns
+    -------
+    The number of users and posts written, keyed by "user" and "post"
+    """
+    progress = progress or Progress("exported", stream=None)
+    users = models.User.__table__
+    posts = models.Post.__table__
+    queries = (
+        ("user", select(users.c.id, users.c.username, users.c.hashed_password)),
+        (
+            "post",
+            select(
+                posts.c.id,
+                posts.c.author_id,
+                posts.c.created,
+                posts.c.title,
+                posts.c.body,
+            ),
+        ),
+    )
+
+    with engine.connect() as conn:
+        for kind, query in queries:
+            result = conn.execute(query.order_by("id")).yield_per(batch_size)
+            for rows in result.partitions():
+                for row in rows:
+                    record = {"type": kind, **row._mapping}
+                    if kind == "post":
+                        record["created"] = row.created.isoformat()
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                progress.add(kind, len(rows))
+
+    progress.report()
+    return progress.counts
+
+
+def import_ndjson(
+    lines: Iterable[str],
+    engine: Engine,
+    batch_size: int = 10_000,
+    workers: Optional[int] = None,
+    rounds: int = DEFAULTS.bcrypt_rounds,
+    progress: Optional[Progress] = None,
+) -> Dict[str, int]:
+    """
+    Insert the users and posts in an NDJSON stream.
+
+    Parameters
+    ----------
+    lines
+        the NDJSON lines, e.g. an open file; blank lines are skipped
+    engine
+        database to import into
+    batch_size
+        lines inserted per transaction
+    workers
+        processes used to hash plain passwords (defaults to one per CPU)
+    rounds
+        bcrypt cost factor for hashing plain passwords
+    progress
+        reports the number of rows imported so far
+
+    Returns
+    -------
+    The number of users and posts imported, keyed by "user" and "post"
+
+    Raises
+    ------
+    InvalidRecord
+        if a line isn't a valid user or post
+    """
+    progress = progress or Progress("imported", stream=None)
+    policy = HashPolicy(rounds)
+    workers = workers or os.cpu_count() or 1
+    numbered = ((n, line) for n, line in enumerate(lines, start=1) if line.strip())
+
+    # spawn rather than fork, in case this runs in a process with threads. Workers are
+    # only started once there is a password to hash.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        while True:
+            batch = list(itertools.islice(numbered, batch_size))
+            if not batch:
+                break
+            users, passwords, posts = _parse_batch(batch, _get_context(policy))
+            if passwords:
+                indexes, plain = zip(*passwords)
+                hashed = executor.map(
+                    functools.partial(_hash_password, policy=policy),
+                    plain,
+                    chunksize=max(1, len(plain) // (4 * workers)),
+                )
+                for i, hashed_password in zip(indexes, hashed):
+                    users[i] = users[i][:2] + (hashed_password,)
+
+            with engine.begin() as conn:
+                if users:
+                    conn.exec_driver_sql(USER_INSERT, users)
+                if posts:
+                    conn.exec_driver_sql(POST_INSERT, posts)
+            progress.add("user", len(users))
+            progress.add("post", len(posts))
+
+    author_stats.repair(engine)
+    progress.report()
+    return progress.counts
+
+
+def _parse_batch(
+    batch: List[Tuple[int, str]], context: CryptContext
+) -> Tuple[List[tuple], List[Tuple[int, str]], List[tuple]]:
+    """
+    Turn numbered lines into user and post rows for executemany.
+
+    Users with a plain password get None for their hashed password. Their index in
+    the user rows and their password are returned so they can be hashed.
+    """
+    users, passwords, posts = [], [], []
+    for line_number, line in batch:
+        try:
+            record = json.loads(line)
+            kind = record["type"]
+            if kind == "user":
+                hashed = record.get("hashed_password")
+                if hashed is None:
+                    passwords.append((len(users), record["password"]))
+                elif not context.identify(hashed):
+                    raise ValueError(
+                        "hashed_password is not a supported password hash "
+                        "(bcrypt or argon2)"
+                    )
+                users.append((record.get("id"), record["username"], hashed))
+            elif kind == "post":
+                created = record.get("created")
+                if created is not None:
+                    created = timestamp_key(datetime.fromisoformat(created))
+                posts.append(
+                    (
+                        record.get("id"),
+                        record["author_id"],
+                        created,
+                        record["title"],
+                        record.get("body", ""),
+                    )
+                )
+            else:
+                raise ValueError(f"unknown type {kind!r}")
+        except KeyError as e:
+            raise InvalidRecord(line_number, f"missing {e}") from e
+        except (ValueError, TypeError) as e:
+            raise InvalidRecord(line_number, str(e)) from e
+    return users, passwords, posts
+
+
+def _hash_password(password: str, policy: HashPolicy) -> str:
+    """Hash a password in a worker process."""
+    return _get_context(policy).hash(password)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write users and posts as NDJSON")
+    export.add_argument("file", nargs="?", help="output file (default: stdout)")
+
+    import_ = commands.add_parser("import", help="read users and posts from NDJSON")
+    import_.add_argument("file", nargs="?", help="input file (default: stdin)")
+    import_.add_argument("--batch-size", type=int, default=10_000)
+    import_.add_argument(
+        "--workers", type=int, help="password hashing processes (default: CPUs)"
+    )
+    args = parser.parse_args()
+
+    settings = Settings()
+    engine = create_db_engine(settings)
+    if args.command == "export":
+        out = open(args.file, "w", encoding="utf8") if args.file else sys.stdout
+        with out:
+            export_ndjson(engine, out, progress=Progress("exported"))
+    else:
+        lines = open(args.file, encoding="utf8") if args.file else sys.stdin
+        with lines:
+            try:
+                import_ndjson(
+                    lines,
+                    engine,
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    rounds=settings.bcrypt_rounds,
+                    progress=Progress("imported"),
+                )
+            except InvalidRecord as e:
+                sys.exit(f"\nimport stopped at {e}")
+
+
+if __name__ == "__main__":
+    main()
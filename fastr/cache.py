@@ -0,0 +1,159 @@
+"""
+In-process caches.
+
+Caches implement the small CacheBackend interface, so the LRUCache used by default can
+be replaced with a shared backend (memcached, redis, ...) by assigning a different
+backend to the module attribute, e.g. `fastr.cache.feed_cache = MyBackend()`. The app
+sizes the default caches from its settings when it starts (see configure).
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from fastr.config import DEFAULTS, Settings
+
+
+class CacheBackend(ABC):
+    """Interface for the caches used by the app."""
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value. ttl overrides the backend's default time to live."""
+
+    @abstractmethod
+    def delete(self, key: Hashable):
+        """Remove a value if it is present."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every value."""
+
+    def stats(self) -> Dict[str, int]:
+        """Counters reported on the /metrics page."""
+        return {}
+
+
+class LRUCache(CacheBackend):
+    """
+    Thread-safe least-recently-used cache with a time to live.
+
+    Parameters
+    ----------
+    maxsize
+        number of entries kept before the least recently used ones are evicted
+    ttl
+        default number of seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize: int, ttl: float):
+        """Change the size and the default time to live of new entries."""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counts, for sizing the cache."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+
+# rendered index pages and feed fragments, cleared whenever a post changes
+feed_cache: CacheBackend = LRUCache(
+    maxsize=DEFAULTS.feed_cache_size, ttl=DEFAULTS.feed_cache_ttl
+)
+
+# bumped by every invalidation so renders that started before a write aren't cached
+_feed_generation = 0
+_feed_lock = threading.Lock()
+
+
+def feed_generation() -> int:
+    """Current feed generation. Read it before loading the posts to be cached."""
+    return _feed_generation
+
+
+def set_feed(key: Hashable, value: Any, generation: int):
+    """
+    Cache part of the feed, unless a post was written since `generation` was read.
+    Otherwise a render of the old posts could be stored after the invalidation.
+    """
+    with _feed_lock:
+        if generation == _feed_generation:
+            feed_cache.set(key, value)
+
+
+def invalidate_feed():
+    """Drop every cached page of the feed. Called after any post is written."""
+    global _feed_generation
+    with _feed_lock:
+        _feed_generation += 1
+        feed_cache.clear()
+
+
+# user records by ("username", username), for logins. Unknown usernames are cached as
+# False, so repeated attempts with made up usernames don't reach the database.
+user_cache: CacheBackend = LRUCache(
+    maxsize=DEFAULTS.user_cache_size, ttl=DEFAULTS.user_cache_ttl
+)
+# seconds an unknown username is cached as False
+user_negative_ttl = DEFAULTS.user_cache_negative_ttl
+
+
+def configure(settings: Settings):
+    """
+    Size the caches from the app's settings, when it starts. Backends assigned in
+    place of the default LRUCaches are left as they are.
+    """
+    global user_negative_ttl
+    if isinstance(feed_cache, LRUCache):
+        feed_cache.resize(settings.feed_cache_size, settings.feed_cache_ttl)
+    if isinstance(user_cache, LRUCache):
+        user_cache.resize(settings.user_cache_size, settings.user_cache_ttl)
+    user_negative_ttl = settings.user_cache_negative_ttl
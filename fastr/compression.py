@@ -0,0 +1,175 @@
+"""
+Compression of responses with gzip or brotli.
+
+CompressionMiddleware compresses responses with whichever coding the client prefers,
+using brotli only if the brotli or brotlicffi package is installed. It compresses
+streamed responses as they are sent, so the levels are low by default: higher ones
+save a few percent more bytes for several times the CPU (see
+benchmarks/bench_compression.py).
+
+Responses that are small, not text, already compressed (like static files, see
+fastr.assets), redirects and 304s are sent unchanged, as are event streams: they stay
+open, and a compressor's buffers for each of thousands of them would cost far more
+memory than the few bytes each idle one sends.
+"""
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Optional, Tuple
+
+from fastr.utils import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+
+# content codings this server can produce, see utils.ENCODINGS
+AVAILABLE_ENCODINGS: Tuple[str, ...] = ("br", "gzip") if brotli else ("gzip",)
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+class Compressor:
+    """Incremental gzip or brotli compression of a response body."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits=31 writes a gzip header and trailer rather than raw zlib
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        """
+        Compress the next part of the body. Unless this is the last part, the output is
+        flushed so the client can decode everything sent so far.
+        """
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if finish else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+def compressible(start: Message, min_size: int) -> bool:
+    """Whether a response is worth compressing, judging by its start message."""
+    status = start["status"]
+    if status < 200 or status in (204, 304) or 300 <= status < 400:
+        return False
+    headers = Headers(raw=start["headers"])
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False
+    if content_type.startswith("text/event-stream"):
+        return False
+    length = headers.get("content-length")
+    return length is None or int(length) >= min_size
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with gzip or brotli, as negotiated with the client.
+
+    Parameters
+    ----------
+    app
+        the ASGI app
+    min_size
+        responses with fewer bytes than this are sent uncompressed
+    gzip_level
+        zlib compression level, 1-9
+    brotli_quality
+        brotli quality, 0-11
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        min_size: int = 1024,
+        gzip_level: int = 5,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate_encoding(accept_encoding, AVAILABLE_ENCODINGS)
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        # the start message is held back until the first part of the body shows
+        # whether the response is big enough to compress
+        start: Optional[Message] = None
+        compressor: Optional[Compressor] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                if compressible(message, self.min_size):
+                    start = message
+                else:
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or (
+                start is None and compressor is None
+            ):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                first, start = start, None
+                if not more_body and len(body) < self.min_size:
+                    await send(first)
+                    await send(message)
+                    return
+
+                compressor = Compressor(
+                    encoding, self.gzip_level, self.brotli_quality
+                )
+                headers = MutableHeaders(scope=first)
+                del headers["content-length"]
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # the compressed body is a different representation, so a strong
+                # ETag would be wrong. If-None-Match uses weak comparison, so the
+                # weak one still validates the page (see utils.etag_matches).
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                data = compressor.compress(body, finish=not more_body)
+                if not more_body:
+                    headers["Content-Length"] = str(len(data))
+                await send(first)
+            else:
+                data = compressor.compress(body, finish=not more_body)
+
+            await send(
+                {"type": "http.response.body", "body": data, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,4 +1,5 @@
 from pydantic import BaseSettings
+from typing import List, Literal, Optional
 
 
 class Settings(BaseSettings):
@@ -9,8 +10,110 @@ class Settings(BaseSettings):
     `export FASTR_SECRET_KEY=secret`
     """
     database_path: str = "./fastr.sqlite"
+    # "sync" runs database calls on the threadpool, "async" uses aiosqlite
+    database_mode: Literal["sync", "async"] = "sync"
+    # "production" turns on WAL and the other pragmas in fastr.db.database
+    sqlite_profile: Literal["default", "production"] = "default"
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    # SQLAlchemy URLs of read-only copies of the database, e.g.
+    # FASTR_REPLICA_URLS='["sqlite:////data/replica.sqlite"]'
+    replica_urls: List[str] = []
+    # seconds a replica may fall behind before it stops getting reads
+    replica_max_lag: float = 5
+    replica_check_interval: float = 1
+    # seconds a user's reads go to the primary after they write
+    read_your_writes_seconds: float = 10
     secret_key: str = "<override_in_production>"
+    # "cookie" keeps the whole session in a signed cookie. "memory" and "sqlite" keep
+    # it on the server and only put a session id in the cookie.
+    session_backend: Literal["cookie", "memory", "sqlite"] = "cookie"
+    session_max_age: int = 14 * 24 * 60 * 60
+    # scheme for new password hashes; "argon2" needs the argon2-cffi package
+    password_hash_scheme: Literal["bcrypt", "argon2"] = "bcrypt"
+    bcrypt_rounds: int = 12
+    # argon2 passes, and KiB of memory per hash
+    argon2_time_cost: int = 3
+    argon2_memory_cost: int = 65536
+    # replace a user's password hash after they log in if it was made with another
+    # scheme or cost
+    password_rehash: bool = True
+    password_hash_workers: int = 2
+    # hashes allowed to wait for a worker before logins are rejected with a 503
+    password_hash_queue_limit: int = 32
+    # worker processes started by fastr.serve; None starts one per available CPU
+    serve_workers: Optional[int] = None
+    # requests a worker serves before it is replaced, to bound its memory; 0 for no
+    # limit
+    serve_max_requests: int = 10_000
+    # up to this many more, chosen per worker so they aren't all replaced at once
+    serve_max_requests_jitter: int = 1_000
+    # limit login and registration attempts per client IP and per username
+    login_rate_limit: bool = True
+    # "memory" keeps the limits in each worker, "sqlite" shares them between workers
+    rate_limit_backend: Literal["memory", "sqlite"] = "memory"
+    # attempts allowed at once, and per minute after that
+    login_ip_burst: int = 20
+    login_ip_per_minute: float = 10
+    login_username_burst: int = 10
+    login_username_per_minute: float = 5
+    # commit post writes that arrive close together in one transaction
+    write_batching: bool = False
+    # milliseconds the first write of a batch waits for others
+    write_batch_delay_ms: float = 5
+    write_batch_max_size: int = 100
+    # background tasks that may run at once (see fastr.tasks)
+    task_workers: int = 2
+    task_max_attempts: int = 5
+    # seconds before a failed task is retried; doubles with each attempt
+    task_retry_delay: float = 1
+    # seconds the queued tasks get to finish when the app shuts down
+    task_drain_timeout: float = 10
+    # render the first page of the feed in the background after each post write
+    feed_warmup: bool = True
+    # clients each worker streams live feed events to at once
+    feed_stream_max_clients: int = 10_000
+    # events a live feed client may fall behind by before it is disconnected
+    feed_stream_buffer: int = 64
+    # seconds between keepalive comments on an idle live feed stream
+    feed_stream_keepalive: float = 15
+    # seconds between checks for posts created by other worker processes; 0 to only
+    # stream this process's writes
+    feed_stream_poll_interval: float = 1
+    feed_cache_size: int = 1024
+    # seconds; bounds staleness from writes made by other processes
+    feed_cache_ttl: float = 60
+    user_cache_size: int = 10_000
+    user_cache_ttl: float = 300
+    # seconds an unknown username is remembered as unknown. Each worker process has its
+    # own cache, so a user who registers on one worker can get "Incorrect username."
+    # from another for this long; kept short so it only absorbs bursts of failed logins.
+    user_cache_negative_ttl: float = 2
+    # re-read templates that changed on disk; turn on for development
+    template_auto_reload: bool = False
+    # where compiled templates are cached; None uses the system temp directory
+    template_cache_dir: Optional[str] = None
+    # stream the index page while it renders instead of sending it all at once
+    stream_index: bool = False
+    # compress responses with gzip, or brotli if it is installed
+    compression_enabled: bool = True
+    # bytes; smaller responses aren't worth compressing
+    compression_min_size: int = 1024
+    # low levels suit compressing responses as they stream
+    gzip_level: int = 5
+    brotli_quality: int = 4
+    # time requests and serve the results on /metrics and in Server-Timing headers
+    metrics_enabled: bool = True
+    # queries slower than this are logged to the fastr.slow_query logger
+    slow_query_ms: float = 100
 
     class Config:
         env_prefix = "fastr_"
         env_file = ".env"
+
+
+# the defaults, without reading the environment. The objects shared by every app in a
+# process (the caches, the password hasher, the task queue, the live feed and the
+# templates) start with these, and each app configures them from its own settings when
+# it starts.
+DEFAULTS = Settings.construct()
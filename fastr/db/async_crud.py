@@ -0,0 +1,108 @@
+"""
+Awaitable versions of the functions in fastr.db.crud.
+
+Each function accepts either kind of session from fastr.db.database.get_session. An
+AsyncSession runs the crud function on its aiosqlite connection without blocking the
+event loop; a regular Session runs it on the threadpool, the same way FastAPI runs
+sync routes.
+"""
+from datetime import datetime
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Callable, List, Optional, Tuple
+
+from . import crud, models, schemas
+from .database import DBSession
+
+
+async def _run(db: DBSession, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Call func(session, *args, **kwargs) without blocking the event loop."""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args, **kwargs)
+    return await run_in_threadpool(func, db, *args, **kwargs)
+
+
+async def get_user_by_username(
+    db: DBSession, username: str
+) -> Optional[schemas.UserInDB]:
+    return await _run(db, crud.get_user_by_username, username)
+
+
+async def create_user(db: DBSession, user: schemas.UserCreate):
+    await _run(db, crud.create_user, user)
+
+
+async def update_password_hash(
+    db: DBSession, user: schemas.UserInDB, hashed_password: str
+) -> bool:
+    return await _run(db, crud.update_password_hash, user, hashed_password)
+
+
+async def get_posts(
+    db: DBSession, skip: int = 0, limit: int = 100
+) -> List[models.Post]:
+    return await _run(db, crud.get_posts, skip=skip, limit=limit)
+
+
+async def get_author(db: DBSession, username: str) -> Optional[Row]:
+    return await _run(db, crud.get_author, username)
+
+
+async def get_post_listings(
+    db: DBSession,
+    before: Optional[Tuple[datetime, int]] = None,
+    limit: int = 100,
+    author_id: Optional[int] = None,
+) -> List[Row]:
+    return await _run(
+        db, crud.get_post_listings, before=before, limit=limit, author_id=author_id
+    )
+
+
+async def get_new_post_listings(
+    db: DBSession, after: Tuple[datetime, int], limit: int = 100
+) -> List[Row]:
+    return await _run(db, crud.get_new_post_listings, after, limit)
+
+
+async def get_post_listing(db: DBSession, id: int) -> Optional[Row]:
+    return await _run(db, crud.get_post_listing, id)
+
+
+async def search_posts(
+    db: DBSession,
+    query: str,
+    after: Optional[Tuple[float, int]] = None,
+    limit: int = 100,
+) -> List[Tuple[Row, float]]:
+    return await _run(db, crud.search_posts, query, after=after, limit=limit)
+
+
+async def get_post_by_id(db: DBSession, id: int) -> models.Post:
+    return await _run(db, crud.get_post_by_id, id)
+
+
+async def create_post(
+    db: DBSession, create_data: schemas.Post, user_id: int
+) -> models.Post:
+    return await _write(db, crud.create_post, create_data, user_id)
+
+
+async def update_post(db: DBSession, update_data: schemas.PostUpdate):
+    await _write(db, crud.update_post, update_data)
+
+
+async def delete_post(db: DBSession, post_id: int):
+    await _write(db, crud.delete_post, post_id)
+
+
+async def _write(db: DBSession, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a write, through the group commit batcher of the session's Database if it's
+    on (see db.batching).
+    """
+    database = db.info.get("database")
+    if database is not None and database.settings.write_batching:
+        return await database.write_batcher.submit(func, *args, **kwargs)
+    return await _run(db, func, *args, **kwargs)
@@ -0,0 +1,56 @@
+"""
+Per-author post counts, stored on the user table.
+
+User.post_count and User.last_posted_at are copies of what could be computed from the
+post table, kept so author pages don't have to count an author's posts. crud keeps
+them up to date in the same transaction as each post it adds or deletes.
+
+Posts written some other way (e.g. by fastr.bulk, or by hand) leave the copies out of
+date. To recompute them from the post table, run:
+
+    python -m fastr.db.author_stats repair
+"""
+import argparse
+
+from sqlalchemy.engine import Engine
+
+# each subquery is a lookup in ix_post_author_created_id
+REPAIR = """
+    UPDATE user
+    SET post_count = stats.post_count, last_posted_at = stats.last_posted_at
+    FROM (
+        SELECT
+            user.id AS id,
+            (SELECT count(*) FROM post WHERE author_id = user.id) AS post_count,
+            (SELECT max(created) FROM post WHERE author_id = user.id) AS last_posted_at
+        FROM user
+    ) AS stats
+    WHERE user.id = stats.id
+    AND (
+        user.post_count IS NOT stats.post_count
+        OR user.last_posted_at IS NOT stats.last_posted_at
+    )
+"""
+
+
+def repair(engine: Engine) -> int:
+    """Recompute every user's post stats. Returns the number that were wrong."""
+    with engine.begin() as conn:
+        return conn.exec_driver_sql(REPAIR).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-author post stats.")
+    parser.add_argument("command", choices=["repair"])
+    parser.parse_args()
+
+    from fastr.config import Settings
+    from fastr.db.database import create_db_engine
+
+    engine = create_db_engine(Settings())
+
+    print(f"repaired {repair(engine)} users")
+
+
+if __name__ == "__main__":
+    main()
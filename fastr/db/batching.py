@@ -0,0 +1,126 @@
+"""
+Group commit of post writes.
+
+Every commit to SQLite waits for the disk, and only one can happen at a time, so a
+burst of posts queues up behind the write lock one fsync at a time. With
+Settings.write_batching on, async_crud sends post writes to the WriteBatcher instead.
+It collects the writes that arrive within a few milliseconds of each other and
+commits them in one transaction, then hands each waiting request its own result.
+
+Each write runs in its own savepoint, so one that fails (e.g. a post that was deleted
+in the meantime) is rolled back on its own and its request gets the exception, while
+the rest of the batch is still committed.
+"""
+import asyncio
+import threading
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastr import cache
+
+
+# (crud function, its arguments after the session, its keyword arguments)
+Write = Tuple[Callable, tuple, Dict[str, Any]]
+
+
+class WriteBatcher:
+    """
+    Commit concurrent writes together.
+
+    Parameters
+    ----------
+    session_factory
+        makes the sessions for the batches
+    max_delay
+        seconds the first write of a batch waits for more to join it
+    max_size
+        number of writes that ends the wait early
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_delay: float, max_size: int):
+        self.session_factory = session_factory
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.batches = 0
+        self.writes = 0
+        self.max_batch_size = 0
+        self._pending: List[Tuple[Write, asyncio.Future]] = []
+        self._full: Optional[asyncio.Event] = None
+        # batches are committed one at a time; SQLite only has one writer anyway
+        self._commit_lock = threading.Lock()
+
+    async def submit(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        Run func(session, *args, **kwargs, commit=False) in the next batch, and return
+        its result once the batch has been committed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((func, args, kwargs), future))
+        if len(self._pending) == 1:
+            # the first write starts a new batch. The flush runs as its own task so it
+            # happens even if this request is cancelled.
+            self._full = asyncio.Event()
+            loop.create_task(self._flush(self._full))
+        elif len(self._pending) >= self.max_size:
+            self._full.set()
+        return await future
+
+    async def _flush(self, full: asyncio.Event):
+        try:
+            await asyncio.wait_for(full.wait(), self.max_delay)
+        except asyncio.TimeoutError:
+            pass
+        batch, self._pending = self._pending, []
+
+        try:
+            outcomes = await run_in_threadpool(
+                self._commit, [write for write, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _commit(self, writes: List[Write]) -> List[Tuple[bool, Any]]:
+        """Run the writes in one transaction, each in a savepoint."""
+        outcomes = []
+        with self._commit_lock:
+            db = self.session_factory()
+            try:
+                # pysqlite doesn't begin a transaction before a SAVEPOINT, which would
+                # make each savepoint a transaction of its own
+                db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+                for func, args, kwargs in writes:
+                    try:
+                        with db.begin_nested():
+                            result = func(db, *args, **kwargs, commit=False)
+                        outcomes.append((True, result))
+                    except Exception as e:
+                        outcomes.append((False, e))
+                db.commit()
+            finally:
+                db.close()
+
+        cache.invalidate_feed()
+        self.batches += 1
+        self.writes += len(writes)
+        self.max_batch_size = max(self.max_batch_size, len(writes))
+        return outcomes
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "max_batch_size": self.max_batch_size,
+        }
@@ -1,20 +1,74 @@
+import re
+from datetime import datetime
+from sqlalchemy import (
+    DateTime,
+    String,
+    bindparam,
+    func,
+    literal,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple
 
+from fastr import cache
 from . import models, schemas
 
 
-def get_user_by_username(db: Session, username: str) -> models.User:
-    return db.query(models.User).filter(models.User.username == username).first()
+def get_user_by_username(db: Session, username: str) -> Optional[schemas.UserInDB]:
+    """
+    Look up a user by username. Results are cached, including usernames that don't
+    exist, so repeated logins don't query the database.
+    """
+    key = ("username", username)
+    cached = cache.user_cache.get(key)
+    if cached is not None:
+        return cached or None
+
+    db_user = db.query(models.User).filter(models.User.username == username).first()
+    if db_user is None:
+        cache.user_cache.set(key, False, ttl=cache.user_negative_ttl)
+        return None
+    user = schemas.UserInDB.from_orm(db_user)
+    cache.user_cache.set(key, user)
+    return user
 
 
 def create_user(db: Session, user: schemas.UserCreate):
     db_user = models.User(username=user.username, hashed_password=user.hashed_password)
     db.add(db_user)
     db.commit()
+    # the username may have been cached as unknown
+    cache.user_cache.delete(("username", user.username))
     db.refresh(db_user)
 
 
+def update_password_hash(
+    db: Session, user: schemas.UserInDB, hashed_password: str
+) -> bool:
+    """
+    Replace a user's password hash, unless it has changed since `user` was read.
+    Returns whether it was replaced.
+    """
+    updated = (
+        db.query(models.User)
+        .filter(
+            models.User.id == user.id,
+            models.User.hashed_password == user.hashed_password,
+        )
+        .update(
+            {models.User.hashed_password: hashed_password}, synchronize_session=False
+        )
+    )
+    db.commit()
+    cache.user_cache.delete(("username", user.username))
+    return bool(updated)
+
+
 def get_posts(db: Session, skip: int = 0, limit: int = 100) -> List[models.Post]:
     return (
         db.query(models.Post)
@@ -25,26 +79,271 @@ def get_posts(db: Session, skip: int = 0, limit: int = 100) -> List[models.Post]
     )
 
 
+def get_author(db: Session, username: str) -> Optional[Row]:
+    """Get a user's public details and post stats, for their author page."""
+    return (
+        db.query(
+            models.User.id,
+            models.User.username,
+            models.User.post_count,
+            models.User.last_posted_at,
+        )
+        .filter(models.User.username == username)
+        .first()
+    )
+
+
+def get_post_listings(
+    db: Session,
+    before: Optional[Tuple[datetime, int]] = None,
+    limit: int = 100,
+    author_id: Optional[int] = None,
+) -> List[Row]:
+    """
+    Get a page of posts for the index page, most recent first.
+
+    Posts are joined to their authors so the whole page is loaded in a single query,
+    and only the columns the page displays are selected. The returned rows are
+    read-only named tuples rather than ORM objects.
+
+    Pages are keyed on (created, id) rather than an offset, so every page is a range
+    scan of the ix_post_created_id index (or ix_post_author_created_id for one
+    author's posts) no matter how deep it is.
+
+    Parameters
+    ----------
+    db
+        database session
+    before
+        (created, id) of the last post on the previous page, or None for the first page
+    limit
+        maximum number of posts to return
+    author_id
+        only get posts by this user
+    """
+    query = _post_listing_query(db)
+    if author_id is not None:
+        query = query.filter(models.Post.author_id == author_id)
+    if before is not None:
+        created, id = before
+        query = query.filter(
+            tuple_(models.Post.created, models.Post.id)
+            < tuple_(literal(timestamp_key(created), String), id)
+        )
+
+    return (
+        query.order_by(models.Post.created.desc(), models.Post.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def get_new_post_listings(
+    db: Session, after: Tuple[datetime, int], limit: int = 100
+) -> List[Row]:
+    """
+    Get the posts after (created, id), oldest first, with the same columns as
+    get_post_listings. Used to catch up on the posts a live feed missed.
+    """
+    created, id = after
+    return (
+        _post_listing_query(db)
+        .filter(
+            tuple_(models.Post.created, models.Post.id)
+            > tuple_(literal(timestamp_key(created), String), id)
+        )
+        .order_by(models.Post.created, models.Post.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def get_post_listing(db: Session, id: int) -> Optional[Row]:
+    """Get one post with the same columns as get_post_listings."""
+    return _post_listing_query(db).filter(models.Post.id == id).first()
+
+
+def _post_listing_query(db: Session):
+    return db.query(
+        models.Post.id,
+        models.Post.title,
+        models.Post.body,
+        models.Post.created,
+        models.Post.author_id,
+        models.User.username,
+    ).join(models.Post.author)
+
+
+def timestamp_key(value: datetime) -> str:
+    """
+    Format a datetime the way SQLite stores it so it can be compared with the stored
+    text directly. CURRENT_TIMESTAMP (the server default for Post.created) has no
+    fractional seconds, so they are only included when present.
+    """
+    if value.microsecond:
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# marks the start and end of matched terms in highlighted search results
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+# BM25 with the title and body weighted so a match in the title counts for more
+_BM25 = "bm25(post_fts, 10.0, 1.0)"
+
+_SEARCH_RANKS = text(
+    f"""
+    SELECT rowid AS id, {_BM25} AS rank
+    FROM post_fts
+    WHERE post_fts MATCH :query AND ({_BM25}, rowid) > (:after_rank, :after_id)
+    ORDER BY rank, rowid
+    LIMIT :limit
+    """
+)
+
+_SEARCH_RESULTS = text(
+    f"""
+    SELECT post.id, post.created, post.author_id, user.username,
+        highlight(post_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}') AS title,
+        snippet(post_fts, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 32) AS body
+    FROM post_fts
+    JOIN post ON post.id = post_fts.rowid
+    JOIN user ON user.id = post.author_id
+    WHERE post_fts MATCH :query AND post_fts.rowid IN :ids
+    """
+)
+_SEARCH_RESULTS = _SEARCH_RESULTS.bindparams(bindparam("ids", expanding=True))
+_SEARCH_RESULTS = _SEARCH_RESULTS.columns(created=DateTime)
+
+
+def search_posts(
+    db: Session,
+    query: str,
+    after: Optional[Tuple[float, int]] = None,
+    limit: int = 100,
+) -> List[Tuple[Row, float]]:
+    """
+    Full-text search of post titles and bodies, best matches first.
+
+    Results are ranked by BM25 using the post_fts index (see fastr.db.fts). The search
+    is done in two steps: first the ids of one page of matches are found from the index
+    alone, then the highlighted title and a snippet of the body are built for just
+    those posts, rather than for every match.
+
+    Every word in the query has to appear in a post for it to match. Words are matched
+    literally, so FTS5 query syntax in user input has no effect, and control characters
+    are removed from them. A query FTS5 still rejects matches nothing.
+
+    Parameters
+    ----------
+    db
+        database session
+    query
+        the words to search for
+    after
+        (rank, id) of the last result on the previous page, or None for the first page
+    limit
+        maximum number of results to return
+
+    Returns
+    -------
+    (row, rank) pairs. Matched words in the title and body of each row are wrapped in
+    HIGHLIGHT_START and HIGHLIGHT_END. The text is not escaped for HTML.
+    """
+    match = _match_expression(query)
+    if not match:
+        return []
+
+    after_rank, after_id = after if after is not None else (float("-inf"), 0)
+    try:
+        ranks = db.execute(
+            _SEARCH_RANKS,
+            {
+                "query": match,
+                "after_rank": after_rank,
+                "after_id": after_id,
+                "limit": limit,
+            },
+        ).all()
+        if not ranks:
+            return []
+
+        rows = db.execute(
+            _SEARCH_RESULTS, {"query": match, "ids": [id for id, _ in ranks]}
+        ).all()
+    except OperationalError:
+        # a query FTS5 can't parse
+        db.rollback()
+        return []
+    rows_by_id = {row.id: row for row in rows}
+    return [(rows_by_id[id], rank) for id, rank in ranks if id in rows_by_id]
+
+
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+
+
+def _match_expression(query: str) -> str:
+    """Turn user input into an FTS5 query that matches all of its words literally."""
+    words = (_CONTROL_CHARACTERS.sub("", word) for word in query.split())
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words if word)
+
+
 def get_post_by_id(db: Session, id: int) -> models.Post:
     return db.query(models.Post).filter(models.Post.id == id).first()
 
 
-def create_post(db: Session, create_data: schemas.Post, user_id: int):
+def create_post(
+    db: Session, create_data: schemas.Post, user_id: int, commit: bool = True
+) -> models.Post:
+    """
+    Add a post. With commit=False the post is only added to the session, and the
+    caller commits it (see fastr.db.batching).
+    """
     post = models.Post(**create_data.dict(), author_id=user_id)
     db.add(post)
-    db.commit()
-    db.refresh(post)
+    _update_author_stats(db, user_id, 1)
+    if commit:
+        db.commit()
+        cache.invalidate_feed()
+        db.refresh(post)
+    return post
 
 
-def update_post(db: Session, update_data: schemas.PostUpdate):
+def update_post(db: Session, update_data: schemas.PostUpdate, commit: bool = True):
     post = get_post_by_id(db, update_data.id)
     post.title = update_data.title
     post.body = update_data.body
-    db.commit()
-    db.refresh(post)
+    if commit:
+        db.commit()
+        cache.invalidate_feed()
+        db.refresh(post)
 
 
-def delete_post(db: Session, post_id: int):
+def delete_post(db: Session, post_id: int, commit: bool = True):
     post = get_post_by_id(db, post_id)
     db.delete(post)
-    db.commit()
+    _update_author_stats(db, post.author_id, -1)
+    if commit:
+        db.commit()
+        cache.invalidate_feed()
+
+
+def _update_author_stats(db: Session, author_id: int, change: int):
+    """
+    Update an author's post_count and last_posted_at for an added (change=1) or
+    deleted (change=-1) post, in the same transaction.
+    """
+    db.flush()
+    last_posted_at = (
+        select(func.max(models.Post.created))
+        .where(models.Post.author_id == author_id)
+        .scalar_subquery()
+    )
+    db.query(models.User).filter(models.User.id == author_id).update(
+        {
+            models.User.post_count: models.User.post_count + change,
+            models.User.last_posted_at: last_posted_at,
+        },
+        synchronize_session=False,
+    )
@@ -1,24 +1,255 @@
-from sqlalchemy import create_engine
+import time
+from contextlib import asynccontextmanager
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from fastr.config import Settings
+from .batching import WriteBatcher
+from .replicas import ReplicaSet
 
-from typing import Generator
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Generator, Union
 
 
-settings = Settings()
+# pragmas run on every new connection, by Settings.sqlite_profile
+SQLITE_PRAGMAS: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "production": {
+        # readers don't block the writer (or each other) in WAL mode
+        "journal_mode": "WAL",
+        # with WAL, only fsync at checkpoints rather than on every commit
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        # negative values are in KiB
+        "cache_size": -64 * 1024,
+        # wait for the write lock instead of failing with "database is locked"
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def _engine_options(settings: Settings, poolclass: type) -> Dict[str, Any]:
+    """Connection pool options for the selected SQLite profile."""
+    if settings.sqlite_profile == "default":
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+    }
+
+
+def _set_pragmas(engine: Engine, pragmas: Dict[str, Any]):
+    """Run the given pragmas on each new connection made by the engine."""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def create_db_engine(settings: Settings) -> Engine:
+    """Create the engine for the SQLite database described by settings."""
+    engine = create_engine(
+        url=f"sqlite:///{settings.database_path}",
+        connect_args={"check_same_thread": False},
+        **_engine_options(settings, QueuePool),
+    )
+    _set_pragmas(engine, SQLITE_PRAGMAS[settings.sqlite_profile])
+    return engine
+
+
+def create_async_db_engine(settings: Settings) -> AsyncEngine:
+    """Create an aiosqlite engine for the SQLite database described by settings."""
+    engine = create_async_engine(
+        url=f"sqlite+aiosqlite:///{settings.database_path}",
+        **_engine_options(settings, AsyncAdaptedQueuePool),
+    )
+    _set_pragmas(engine.sync_engine, SQLITE_PRAGMAS[settings.sqlite_profile])
+    return engine
+
+
+def create_replica_engine(url: str, settings: Settings) -> Engine:
+    """
+    Create the engine for a read replica. SQLite replicas are opened with query_only
+    set, so a write sent to one by mistake fails instead of making it diverge.
+    """
+    options = _engine_options(settings, QueuePool)
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(url, **options)
+
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **options)
+    _set_pragmas(engine, {"query_only": 1})
+    return engine
+
+
+def warm_pool(engine: Engine, size: int):
+    """
+    Open connections now, so the first requests don't wait for them. Only pooled
+    engines (the production profile) keep them open afterwards.
+    """
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
+
 
-database_url = f"sqlite:///{settings.database_path}"
-engine = create_engine(url=database_url, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# either kind of session can be passed to the functions in fastr.db.async_crud
+DBSession = Union[Session, AsyncSession]
+
+# request.session key holding the time of the user's last write
+LAST_WRITE_KEY = "last_write"
+
+
+class Database:
+    """
+    The app's connections to its database: the engines and session factories for the
+    primary, the read replicas and the write batcher, all set up from one Settings.
+
+    The app creates it when it starts and keeps it in app.state.database (see
+    fastr.main.create_app); the dependencies below get their sessions from there.
+    Creating it doesn't connect to anything. Sessions it makes carry it in
+    Session.info["database"], so the functions they are passed to can find the write
+    batcher.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        info = {"database": self}
+        self.engine = create_db_engine(settings)
+        self.session_factory = sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine, info=info
+        )
+        self.async_engine = create_async_db_engine(settings)
+        self.async_session_factory = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            expire_on_commit=False,
+            bind=self.async_engine,
+            class_=AsyncSession,
+            info=info,
+        )
+
+        self.write_batcher = WriteBatcher(
+            sessionmaker(
+                autocommit=False,
+                autoflush=False,
+                expire_on_commit=False,
+                bind=self.engine,
+            ),
+            max_delay=settings.write_batch_delay_ms / 1000,
+            max_size=settings.write_batch_max_size,
+        )
 
-def get_db() -> Generator[Session, None, None]:
+        self.replicas = ReplicaSet(
+            self.engine,
+            [create_replica_engine(url, settings) for url in settings.replica_urls],
+            max_lag=settings.replica_max_lag,
+        )
+        # replicas can be any database, so they are always used through regular
+        # sessions
+        self.replica_session_factory = sessionmaker(
+            autocommit=False, autoflush=False, info={**info, "replica": True}
+        )
+
+    @asynccontextmanager
+    async def primary_session(self) -> AsyncIterator[DBSession]:
+        """
+        A session on the primary database, of the type selected by
+        settings.database_mode.
+        """
+        if self.settings.database_mode == "async":
+            async with self.async_session_factory() as db:
+                yield db
+        else:
+            db = self.session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+    def start(self):
+        """Start checking the replicas' health, if there are any."""
+        if self.replicas:
+            self.replicas.start(self.settings.replica_check_interval)
+
+    async def close(self):
+        """Stop the replica checks and close every connection."""
+        self.replicas.stop()
+        for replica in self.replicas.replicas:
+            replica.engine.dispose()
+        self.engine.dispose()
+        await self.async_engine.dispose()
+
+
+def get_database(request: Request) -> Database:
+    """The database of the app handling the request."""
+    return request.app.state.database
+
+
+def get_db(request: Request) -> Generator[Session, None, None]:
     """Connect to the database"""
-    db = SessionLocal()
+    db = get_database(request).session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_session(request: Request) -> AsyncGenerator[DBSession, None]:
+    """
+    Connect to the primary database using the session type selected by
+    settings.database_mode. Routes pass the session to fastr.db.async_crud, which
+    handles both kinds.
+
+    When there are replicas, a POST with this session records the time in the user's
+    session, so get_read_session sends their next reads to the primary too and they
+    see their own writes.
+    """
+    database = get_database(request)
+    if database.replicas and request.method == "POST":
+        request.session[LAST_WRITE_KEY] = time.time()
+    async with database.primary_session() as db:
+        yield db
+
+
+async def get_read_session(request: Request) -> AsyncGenerator[DBSession, None]:
+    """
+    Connect to a healthy read replica, for routes that only read. Uses the primary if
+    there are no replicas, none of them are healthy, or the user wrote something in
+    the last settings.read_your_writes_seconds.
+    """
+    database = get_database(request)
+    last_write = request.session.get(LAST_WRITE_KEY, 0)
+    recent_write = (
+        time.time() - last_write < database.settings.read_your_writes_seconds
+    )
+    replica = None if recent_write else database.replicas.choose()
+    if replica is None:
+        async with database.primary_session() as db:
+            yield db
+        return
+
+    db = database.replica_session_factory(bind=replica)
     try:
         yield db
     finally:
         db.close()
+
+
+def is_replica(db: DBSession) -> bool:
+    """
+    Whether a session from get_read_session reads from a replica, which may not have
+    the latest writes yet. Pages rendered from one aren't cached.
+    """
+    return db.info.get("replica", False)
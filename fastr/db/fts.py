@@ -0,0 +1,85 @@
+"""
+Full-text index of posts, using an SQLite FTS5 virtual table.
+
+post_fts is an external content table: it only stores the index and reads the post
+titles and bodies from the post table. Triggers on post keep it up to date, so it
+changes in the same transaction as the posts themselves.
+
+The index is created along with the post table, and added to databases created before
+search existed by fastr.db.migrations. If it is ever out of sync, run:
+
+    python -m fastr.db.fts reindex
+"""
+import argparse
+
+from sqlalchemy.engine import Connection, Engine
+
+FTS_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS post_fts
+    USING fts5(title, body, content='post', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+        INSERT INTO post_fts (rowid, title, body)
+        VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+        INSERT INTO post_fts (post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body ON post
+    BEGIN
+        INSERT INTO post_fts (post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO post_fts (rowid, title, body)
+        VALUES (new.id, new.title, new.body);
+    END
+    """,
+)
+
+FTS_DROP = (
+    "DROP TRIGGER IF EXISTS post_fts_insert",
+    "DROP TRIGGER IF EXISTS post_fts_delete",
+    "DROP TRIGGER IF EXISTS post_fts_update",
+    "DROP TABLE IF EXISTS post_fts",
+)
+
+
+def create_index(connection: Connection):
+    """Create the index table and triggers, if they don't exist yet."""
+    for statement in FTS_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def drop_index(connection: Connection):
+    for statement in FTS_DROP:
+        connection.exec_driver_sql(statement)
+
+
+def reindex(engine: Engine):
+    """Create the index if needed and rebuild it from the post table."""
+    with engine.begin() as conn:
+        create_index(conn)
+        conn.exec_driver_sql("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the full-text post index.")
+    parser.add_argument("command", choices=["reindex"])
+    parser.parse_args()
+
+    from fastr.config import Settings
+    from fastr.db.database import create_db_engine
+
+    engine = create_db_engine(Settings())
+
+    reindex(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Versioned changes to the database schema.
+
+The schema version is kept in SQLite's user_version pragma. Migrate once per deploy,
+before starting the workers:
+
+    python -m fastr.db.migrations
+
+The app only checks the version when it starts (one PRAGMA), rather than every worker
+inspecting every table with create_all. It refuses to start on a database that isn't
+at the version it expects.
+
+A new database gets the current models with create_all and is marked as being at the
+latest version. An existing one has the migrations after its version applied in order,
+all in one transaction. Version 0 is any database from before versioning, which may be
+missing any of the later tables and columns, so those migrations check what's there.
+Migrations added from now on can assume the previous version's schema, and must not
+use the models, which describe the latest one.
+"""
+import argparse
+import sys
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from typing import Callable, List, Tuple
+
+from . import author_stats, fts, models
+
+
+class SchemaVersionError(RuntimeError):
+    """The database isn't at the schema version this code expects."""
+
+
+def _create_missing_tables(conn: Connection):
+    """Version 1: add the tables, indexes and full-text index from before versioning."""
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_post_created_id ON post (created, id)"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS session (id VARCHAR NOT NULL PRIMARY KEY, "
+        "data VARCHAR NOT NULL, expires FLOAT NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS replica_heartbeat "
+        "(id INTEGER NOT NULL PRIMARY KEY, updated FLOAT NOT NULL)"
+    )
+    if not inspect(conn).has_table("post_fts"):
+        fts.create_index(conn)
+        conn.exec_driver_sql("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+
+
+def _add_author_stats(conn: Connection):
+    """Version 2: per-author post counts and the index for author pages."""
+    columns = {column["name"] for column in inspect(conn).get_columns("user")}
+    if "post_count" not in columns:
+        conn.exec_driver_sql(
+            "ALTER TABLE user ADD COLUMN post_count INTEGER NOT NULL DEFAULT 0"
+        )
+    if "last_posted_at" not in columns:
+        conn.exec_driver_sql("ALTER TABLE user ADD COLUMN last_posted_at DATETIME")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_post_author_created_id "
+        "ON post (author_id, created, id)"
+    )
+    conn.exec_driver_sql(author_stats.REPAIR)
+
+
+def _add_rate_limit(conn: Connection):
+    """Version 3: token buckets shared by workers, see fastr.ratelimit."""
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS rate_limit "
+        "(key VARCHAR NOT NULL PRIMARY KEY, full_at FLOAT NOT NULL)"
+    )
+
+
+# MIGRATIONS[i] takes a database from version i to version i + 1
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _create_missing_tables,
+    _add_author_stats,
+    _add_rate_limit,
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine: Engine) -> Tuple[int, int]:
+    """
+    Bring the database up to the latest schema version.
+
+    Returns
+    -------
+    The versions before and after
+
+    Raises
+    ------
+    SchemaVersionError
+        if the database is at a later version than this code knows about
+    """
+    with engine.begin() as conn:
+        # pysqlite only begins transactions before DML, so begin one explicitly to
+        # make the DDL atomic. IMMEDIATE takes the write lock, so two processes
+        # migrating at once take turns.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        version = schema_version(conn)
+        if version > LATEST_VERSION:
+            raise SchemaVersionError(
+                f"database is at version {version}, newer than this code "
+                f"({LATEST_VERSION})"
+            )
+        if version == 0 and not inspect(conn).has_table("user"):
+            models.Base.metadata.create_all(bind=conn)
+        else:
+            for migration in MIGRATIONS[version:]:
+                migration(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {LATEST_VERSION}")
+    return version, LATEST_VERSION
+
+
+def check(engine: Engine):
+    """
+    Raises
+    ------
+    SchemaVersionError
+        if the database isn't at the latest schema version
+    """
+    with engine.connect() as conn:
+        version = schema_version(conn)
+    if version != LATEST_VERSION:
+        raise SchemaVersionError(
+            f"database is at schema version {version}, expected {LATEST_VERSION}. "
+            "Run `python -m fastr.db.migrations` to migrate it."
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the database schema.")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check the version, exiting with status 1 if it is out of date",
+    )
+    args = parser.parse_args()
+
+    from fastr.config import Settings
+    from fastr.db.database import create_db_engine
+
+    engine = create_db_engine(Settings())
+
+    if args.check:
+        try:
+            check(engine)
+        except SchemaVersionError as e:
+            sys.exit(str(e))
+        print(f"database is at the latest version ({LATEST_VERSION})")
+        return
+
+    before, after = migrate(engine)
+    if before == after:
+        print(f"database is at the latest version ({after})")
+    else:
+        print(f"migrated database from version {before} to {after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
+from . import fts
 from .database import Base
 
 
@@ -11,12 +21,20 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # copied from the user's posts by crud, see fastr.db.author_stats
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_posted_at = Column(DateTime(timezone=True))
 
     posts = relationship("Post", back_populates="author")
 
 
 class Post(Base):
     __tablename__ = "post"
+    __table_args__ = (
+        # support keyset pagination of the feed and of author pages, newest first
+        Index("ix_post_created_id", "created", "id"),
+        Index("ix_post_author_created_id", "author_id", "created", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     author_id = Column(Integer, ForeignKey("user.id"))
@@ -25,3 +43,42 @@ class Post(Base):
     body = Column(String, nullable=False)
 
     author = relationship("User", back_populates="posts")
+
+
+# the full-text index is created and dropped along with the post table
+@event.listens_for(Post.__table__, "after_create")
+def create_post_index(target, connection, **kw):
+    fts.create_index(connection)
+
+
+@event.listens_for(Post.__table__, "before_drop")
+def drop_post_index(target, connection, **kw):
+    fts.drop_index(connection)
+
+
+class SessionRecord(Base):
+    """Session data for fastr.sessions.SQLiteSessionStore"""
+    __tablename__ = "session"
+
+    id = Column(String, primary_key=True)
+    data = Column(String, nullable=False)
+    # unix timestamp
+    expires = Column(Float, nullable=False, index=True)
+
+
+class ReplicaHeartbeat(Base):
+    """Written to the primary and read from replicas, see fastr.db.replicas"""
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    # unix timestamp
+    updated = Column(Float, nullable=False)
+
+
+class RateLimitBucket(Base):
+    """Token buckets for fastr.ratelimit.SQLiteRateLimitStore"""
+    __tablename__ = "rate_limit"
+
+    key = Column(String, primary_key=True)
+    # unix timestamp at which the bucket will be full again
+    full_at = Column(Float, nullable=False)
@@ -0,0 +1,65 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor can't be decoded."""
+    pass
+
+
+def encode_cursor(created: datetime, id: int) -> str:
+    """
+    Encode the (created, id) key of the last row on a page as an opaque cursor.
+
+    The cursor is URL-safe so it can be passed as a query parameter.
+    """
+    return _encode(f"{created.isoformat()}|{id}")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor created by encode_cursor back into its (created, id) key.
+
+    Raises
+    ------
+    InvalidCursor
+        if the cursor is malformed
+    """
+    try:
+        created, id = _decode(cursor).split("|")
+        return datetime.fromisoformat(created), int(id)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def encode_rank_cursor(rank: float, id: int) -> str:
+    """Encode the (rank, id) key of the last search result on a page as a cursor."""
+    # repr round-trips floats exactly, so the next page starts at the right result
+    return _encode(f"{rank!r}|{id}")
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Decode a cursor created by encode_rank_cursor back into its (rank, id) key.
+
+    Raises
+    ------
+    InvalidCursor
+        if the cursor is malformed
+    """
+    try:
+        rank, id = _decode(cursor).split("|")
+        return float(rank), int(id)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+def _encode(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode("utf8")).decode("ascii").rstrip("=")
+
+
+def _decode(cursor: str) -> str:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    # binascii.Error and UnicodeDecodeError are both ValueErrors
+    return base64.urlsafe_b64decode(padded).decode("utf8")
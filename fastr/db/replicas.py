@@ -0,0 +1,126 @@
+"""
+Routing of reads to replicas of the database.
+
+Replicas are copies of the primary database kept up to date by something outside the
+app (e.g. Litestream or LiteFS for SQLite copies, or a server database's own
+replication). The app never writes to them.
+
+To tell how far behind a replica is, the ReplicaSet writes the current time to the
+replica_heartbeat table of the primary every few seconds, and reads it back from each
+replica. A replica whose heartbeat is more than max_lag seconds old (or that can't be
+reached) stops getting reads until it catches up. Since the heartbeat is only written
+every check interval, max_lag should be a few times longer than the interval.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_HEARTBEAT = text(
+    "INSERT INTO replica_heartbeat (id, updated) VALUES (1, :now) "
+    "ON CONFLICT (id) DO UPDATE SET updated = excluded.updated"
+)
+READ_HEARTBEAT = text("SELECT updated FROM replica_heartbeat WHERE id = 1")
+
+
+class Replica:
+    """A read replica and the result of its last health check."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        # unhealthy until the first check shows it is up to date
+        self.healthy = False
+        self.lag: Optional[float] = None
+
+
+class ReplicaSet:
+    """
+    The replicas of the primary database, and which of them are fit to read from.
+
+    Parameters
+    ----------
+    primary
+        engine for the primary database, where the heartbeat is written
+    replicas
+        engines for the replicas
+    max_lag
+        seconds a replica may be behind the primary and still be read from
+    """
+
+    def __init__(self, primary: Engine, replicas: List[Engine], max_lag: float):
+        self.primary = primary
+        self.replicas = [Replica(engine) for engine in replicas]
+        self.max_lag = max_lag
+        self._next = itertools.cycle(self.replicas)
+        self._monitor: Optional[asyncio.Task] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Engine]:
+        """The next healthy replica in turn, or None if there isn't one."""
+        for _ in range(len(self.replicas)):
+            replica = next(self._next)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+    def check(self):
+        """Write a heartbeat to the primary and measure each replica's lag."""
+        now = time.time()
+        with self.primary.begin() as conn:
+            conn.execute(WRITE_HEARTBEAT, {"now": now})
+
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    updated = conn.execute(READ_HEARTBEAT).scalar()
+            except SQLAlchemyError:
+                logger.warning("replica %s is unreachable", replica.engine.url)
+                updated = None
+
+            replica.lag = None if updated is None else now - updated
+            healthy = replica.lag is not None and replica.lag <= self.max_lag
+            if replica.healthy and replica.lag is not None and not healthy:
+                logger.warning(
+                    "replica %s is lagging by %ss", replica.engine.url, replica.lag
+                )
+            replica.healthy = healthy
+
+    async def monitor(self, interval: float):
+        """Check the replicas every interval seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(self.check)
+            except SQLAlchemyError:
+                logger.exception("replica health check failed")
+
+    def start(self, interval: float):
+        """Check the replicas now, then keep checking them in the background."""
+        self.check()
+        self._monitor = asyncio.get_running_loop().create_task(
+            self.monitor(interval)
+        )
+
+    def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "count": len(self.replicas),
+            "healthy": sum(replica.healthy for replica in self.replicas),
+            "max_lag_seconds": max(
+                (r.lag for r in self.replicas if r.lag is not None), default=0
+            ),
+        }
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional
 
@@ -18,6 +19,10 @@ class LoggedInUser(User):
     id: int
 
 
+class UserInDB(UserCreate):
+    id: int
+
+
 ### post schemas
 class Post(BaseModel):
     title: str
@@ -29,3 +34,10 @@ class Post(BaseModel):
 
 class PostUpdate(Post):
     id: int
+
+
+class PostListing(Post):
+    id: int
+    created: datetime
+    author_id: int
+    username: str
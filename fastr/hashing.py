@@ -0,0 +1,378 @@
+"""
+Password hashing service.
+
+bcrypt is deliberately slow and holds the GIL while it runs, so hashing in the request
+thread stalls every other request in the worker. The PasswordHasher runs it in a
+ProcessPoolExecutor instead, and rejects new work with HasherBusy once too many
+hashes are waiting so a burst of logins can't queue up indefinitely.
+
+New hashes use the scheme and cost in the app's settings: bcrypt, or argon2 if the
+optional argon2-cffi package is installed. Hashes made with another scheme or cost still
+verify, and auth replaces them after a successful login (see needs_update). To pick a
+cost that suits this machine, run:
+
+    python -m fastr.hashing calibrate --target-ms 250
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import statistics
+import sys
+import time
+from concurrent import futures
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastr.config import DEFAULTS, Settings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds clients are told to wait before retrying when the hasher is busy
+RETRY_AFTER = 1
+
+SCHEMES = ("bcrypt", "argon2")
+
+
+class HashPolicy(NamedTuple):
+    """The scheme and cost of new password hashes, as make_context's arguments."""
+
+    rounds: int
+    scheme: str = "bcrypt"
+    argon2_time_cost: int = 3
+    argon2_memory_cost: int = 65536
+
+
+# CryptContext for each policy, cached per process
+_contexts: Dict[HashPolicy, CryptContext] = {}
+
+
+def make_context(
+    rounds: int,
+    scheme: str = "bcrypt",
+    argon2_time_cost: int = 3,
+    argon2_memory_cost: int = 65536,
+) -> CryptContext:
+    """
+    Create the passlib context used to hash and verify passwords.
+
+    Parameters
+    ----------
+    rounds
+        bcrypt cost factor; each one more doubles the time a hash takes
+    scheme
+        "bcrypt" or "argon2" for new hashes. Hashes made with the other still verify,
+        but need an update.
+    argon2_time_cost
+        argon2 passes over its memory
+    argon2_memory_cost
+        KiB of memory argon2 uses per hash
+    """
+    return CryptContext(
+        schemes=[scheme] + [other for other in SCHEMES if other != scheme],
+        deprecated="auto",
+        bcrypt__rounds=rounds,
+        argon2__time_cost=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+    )
+
+
+def _get_context(policy: HashPolicy) -> CryptContext:
+    if policy not in _contexts:
+        _contexts[policy] = make_context(*policy)
+    return _contexts[policy]
+
+
+def _hash(password: str, policy: HashPolicy) -> Tuple[str, float]:
+    """Hash a password in a worker process. Also returns the time spent hashing."""
+    start = time.perf_counter()
+    hashed = _get_context(policy).hash(password)
+    return hashed, time.perf_counter() - start
+
+
+def _verify(password: str, hashed: str, policy: HashPolicy) -> Tuple[bool, float]:
+    """Verify a password in a worker process. Also returns the time spent hashing."""
+    start = time.perf_counter()
+    valid = _get_context(policy).verify(password, hashed)
+    return valid, time.perf_counter() - start
+
+
+def _load(policy: HashPolicy):
+    """Load passlib and the hashing backend in a worker process."""
+    _get_context(policy).handler().get_backend()
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full. The request should be retried later."""
+
+    def __init__(self, retry_after: int = RETRY_AFTER):
+        super().__init__(f"Password hashing queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class HashStats:
+    """Running totals for the work done by a PasswordHasher."""
+
+    def __init__(self):
+        self.count = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        # stored hashes replaced with ones made with the current policy
+        self.rehashed = 0
+
+    def record(self, queue_seconds: float, hash_seconds: float):
+        self.count += 1
+        self.queue_seconds += queue_seconds
+        self.hash_seconds += hash_seconds
+        self.max_queue_seconds = max(self.max_queue_seconds, queue_seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "rejected": self.rejected,
+            "queue_seconds": self.queue_seconds,
+            "hash_seconds": self.hash_seconds,
+            "max_queue_seconds": self.max_queue_seconds,
+            "rehashed": self.rehashed,
+        }
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords in a pool of worker processes.
+
+    Parameters
+    ----------
+    workers
+        number of worker processes
+    queue_limit
+        maximum number of hashes waiting for a worker before new ones are rejected
+    rounds
+        bcrypt cost factor for new hashes
+    scheme, argon2_time_cost, argon2_memory_cost
+        the rest of the policy for new hashes, see make_context
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        queue_limit: int,
+        rounds: int,
+        scheme: str = "bcrypt",
+        argon2_time_cost: int = 3,
+        argon2_memory_cost: int = 65536,
+    ):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.policy = HashPolicy(rounds, scheme, argon2_time_cost, argon2_memory_cost)
+        self.stats = HashStats()
+        self._pending = 0
+        self._executor: Optional[Executor] = None
+
+    def configure(self, settings: Settings):
+        """
+        Use the app's hashing settings, when it starts. The worker processes are
+        restarted if their number changed.
+        """
+        self.queue_limit = settings.password_hash_queue_limit
+        self.policy = HashPolicy(
+            settings.bcrypt_rounds,
+            settings.password_hash_scheme,
+            settings.argon2_time_cost,
+            settings.argon2_memory_cost,
+        )
+        if settings.password_hash_workers != self.workers:
+            self.shutdown()
+            self.workers = settings.password_hash_workers
+
+    @property
+    def executor(self) -> Executor:
+        """The process pool, started on first use."""
+        if self._executor is None:
+            # spawn rather than fork: the server process has threads running
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def start(self):
+        """Start the worker processes now, rather than on the first logins."""
+        futures.wait(
+            [self.executor.submit(_load, self.policy) for _ in range(self.workers)]
+        )
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured scheme and cost."""
+        return await self._submit(_hash, password, self.policy)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """Check a password against a stored hash."""
+        return await self._submit(_verify, password, hashed, self.policy)
+
+    def needs_update(self, hashed: str) -> bool:
+        """
+        Whether a stored hash was made with another scheme or cost than the configured
+        one. Only parses the hash, so it is cheap enough to call in the event loop.
+        """
+        return _get_context(self.policy).needs_update(hashed)
+
+    def shutdown(self):
+        """Stop the worker processes. They are started again if the hasher is used."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def _submit(self, func: Callable, *args: Any) -> Any:
+        if self._pending >= self.workers + self.queue_limit:
+            self.stats.rejected += 1
+            raise HasherBusy()
+
+        self._pending += 1
+        submitted = time.perf_counter()
+        try:
+            try:
+                result, hash_seconds = await self._run(func, *args)
+            except BrokenProcessPool:
+                # a process died, e.g. killed for using too much memory. The pool
+                # can't be used again, so the retry starts a new one.
+                try:
+                    result, hash_seconds = await self._run(func, *args)
+                except BrokenProcessPool as e:
+                    self.stats.rejected += 1
+                    raise HasherBusy() from e
+        finally:
+            self._pending -= 1
+
+        elapsed = time.perf_counter() - submitted
+        self.stats.record(elapsed - hash_seconds, hash_seconds)
+        return result
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        executor = self.executor
+        try:
+            return await asyncio.wrap_future(executor.submit(func, *args))
+        except BrokenProcessPool:
+            # other hashes may have already replaced it
+            if self._executor is executor:
+                logger.warning("a password hashing process died, restarting the pool")
+                executor.shutdown(wait=False)
+                self._executor = None
+            raise
+
+
+# configured by the app when it starts
+hasher = PasswordHasher(
+    workers=DEFAULTS.password_hash_workers,
+    queue_limit=DEFAULTS.password_hash_queue_limit,
+    rounds=DEFAULTS.bcrypt_rounds,
+)
+
+
+def time_verify(policy: HashPolicy, runs: int) -> float:
+    """Median seconds to verify a password against a hash made with policy."""
+    context = make_context(*policy)
+    hashed = context.hash("calibrate")
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        context.verify("calibrate", hashed)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def calibrate(
+    scheme: str, target: float, runs: int = 3, memory_cost: int = 65536
+) -> List[Tuple[HashPolicy, float]]:
+    """
+    Time verifying with increasing costs, on this machine, until one takes longer
+    than twice the target.
+
+    Parameters
+    ----------
+    scheme
+        "bcrypt" to try each bcrypt cost factor, or "argon2" to try each time cost
+        with the given memory cost
+    target
+        seconds a verify should take
+    runs
+        verifies timed for each cost
+    memory_cost
+        argon2 KiB of memory per hash
+
+    Returns
+    -------
+    Each policy tried, with its median verify time in seconds
+    """
+    results = []
+    for cost in range(4, 32) if scheme == "bcrypt" else range(1, 100):
+        if scheme == "bcrypt":
+            policy = HashPolicy(rounds=cost)
+        else:
+            policy = HashPolicy(
+                rounds=DEFAULTS.bcrypt_rounds,
+                scheme="argon2",
+                argon2_time_cost=cost,
+                argon2_memory_cost=memory_cost,
+            )
+        seconds = time_verify(policy, runs)
+        results.append((policy, seconds))
+        if seconds > 2 * target:
+            break
+    return results
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description="Password hashing tools.")
+    parser.add_argument(
+        "command",
+        choices=["calibrate"],
+        help="find the highest cost that verifies within the target time here",
+    )
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument(
+        "--scheme", choices=SCHEMES, default=settings.password_hash_scheme
+    )
+    parser.add_argument(
+        "--memory-cost",
+        type=int,
+        default=settings.argon2_memory_cost,
+        help="argon2 KiB of memory per hash",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="verifies timed per cost")
+    args = parser.parse_args()
+
+    if args.scheme == "argon2":
+        from passlib.hash import argon2
+
+        if not argon2.has_backend():
+            sys.exit("argon2 needs the argon2-cffi package: pip install argon2-cffi")
+
+    target = args.target_ms / 1000
+    results = calibrate(args.scheme, target, args.runs, args.memory_cost)
+    # each hashing process (and CPU) handles one login at a time
+    print(f"{'cost':>5} {'verify ms':>10} {'logins/s per process':>21}")
+    for policy, seconds in results:
+        cost = policy.rounds if args.scheme == "bcrypt" else policy.argon2_time_cost
+        print(f"{cost:>5} {seconds * 1000:>10.1f} {1 / seconds:>21.1f}")
+
+    within = [policy for policy, seconds in results if seconds <= target]
+    if not within:
+        sys.exit(f"even the lowest cost takes longer than {args.target_ms:.0f}ms")
+    print("\nset:")
+    print(f"FASTR_PASSWORD_HASH_SCHEME={args.scheme}")
+    if args.scheme == "bcrypt":
+        print(f"FASTR_BCRYPT_ROUNDS={within[-1].rounds}")
+    else:
+        print(f"FASTR_ARGON2_TIME_COST={within[-1].argon2_time_cost}")
+        print(f"FASTR_ARGON2_MEMORY_COST={within[-1].argon2_memory_cost}")
+
+
+if __name__ == "__main__":
+    main()
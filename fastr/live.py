@@ -0,0 +1,329 @@
+"""
+Live updates of the feed, sent to browsers as server-sent events.
+
+GET /feed/stream is an event stream of the posts created, updated and deleted while it
+is open:
+
+    id: <cursor of the post>
+    event: created
+    data: {"id": 1, "title": "...", "body": "...", ...}
+
+Updated posts are sent the same way, without the id line, and deleted ones as just
+{"id": ...}.
+
+Each worker has a Broadcaster. The blog routes publish to it after they write a post,
+and it formats each event once and adds it to the buffer of every connected client.
+Connections are coroutines waiting on their buffers, so an idle one costs a little
+memory and no thread or database connection. A client whose buffer fills up, because
+it isn't reading as fast as posts are written, is dropped rather than holding up the
+others or buffering without bound. Browsers reconnect on their own.
+
+Created events carry the post's pagination cursor as their id. A browser that
+reconnects sends the last one it saw as the Last-Event-ID header, and is sent the
+posts created since then before the live events. The index page passes the cursor of
+its newest post as the last_event_id parameter, so posts created between rendering
+the page and connecting aren't missed either. Updates and deletions made while a
+client was disconnected aren't replayed.
+
+Posts created through other worker processes reach this one by polling: while clients
+are connected, the broadcaster checks for posts newer than the last one it published
+every Settings.feed_stream_poll_interval seconds. That is one query per worker, not
+per client.
+"""
+import asyncio
+import collections
+import logging
+import orjson
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import SQLAlchemyError
+from typing import AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from fastr.api import POST_FIELDS
+from fastr.config import DEFAULTS, Settings
+from fastr.db import async_crud
+from fastr.db.database import Database, DBSession, get_database
+from fastr.db.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["live"])
+
+# posts sent to a reconnecting client to catch it up. One that missed more is told to
+# reload the page instead.
+BACKLOG_SIZE = 100
+
+# milliseconds browsers wait before reconnecting
+RETRY = b"retry: 3000\n\n"
+# a comment, sent when nothing else has been for a while so proxies keep the
+# connection open
+KEEPALIVE = b": keepalive\n\n"
+RESET = b"event: reset\ndata: {}\n\n"
+
+PostKey = Tuple[datetime, int]
+
+
+class FeedEvent(NamedTuple):
+    kind: str
+    # (created, id) of a created post, for resuming after it
+    key: Optional[PostKey]
+    # the event, formatted for the stream
+    message: bytes
+
+
+def make_event(kind: str, data: dict, key: Optional[PostKey] = None) -> FeedEvent:
+    message = b"data: " + orjson.dumps(data) + b"\n\n"
+    message = f"event: {kind}\n".encode("utf8") + message
+    if key is not None:
+        message = f"id: {encode_cursor(*key)}\n".encode("utf8") + message
+    return FeedEvent(kind, key, message)
+
+
+def post_event(kind: str, post: Row) -> FeedEvent:
+    """An event for a created or updated post, from a get_post_listing row."""
+    data = {field: post._mapping[field] for field in POST_FIELDS}
+    key = (post.created, post.id) if kind == "created" else None
+    return make_event(kind, data, key)
+
+
+class Subscriber:
+    """The events waiting to be sent to one client."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.events: Deque[FeedEvent] = collections.deque()
+        self.dropped = False
+        self._ready = asyncio.Event()
+
+    def push(self, event: FeedEvent) -> bool:
+        """Add an event. Returns False if the buffer is full."""
+        if len(self.events) >= self.size:
+            return False
+        self.events.append(event)
+        self._ready.set()
+        return True
+
+    def drop(self):
+        self.dropped = True
+        self.events.clear()
+        self._ready.set()
+
+    async def next(self, timeout: float) -> Optional[FeedEvent]:
+        """
+        The next event, or None if there is none within timeout seconds or the
+        subscriber was dropped.
+        """
+        if not self.events and not self.dropped:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.events.popleft() if self.events else None
+
+
+class Broadcaster:
+    """
+    Send feed events to every connected client.
+
+    Parameters
+    ----------
+    buffer_size
+        events a client may fall behind by before it is dropped
+    max_clients
+        clients that may be connected at once
+    keepalive
+        seconds between keepalive comments on an idle stream
+    """
+
+    def __init__(self, buffer_size: int, max_clients: int, keepalive: float):
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self.keepalive = keepalive
+        self.subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+        # the newest created post published, so each is only published once
+        self.newest: Optional[PostKey] = None
+        # the app's database, polled for posts created by other processes
+        self.database: Optional[Database] = None
+        self._poll: Optional[asyncio.Task] = None
+
+    @property
+    def full(self) -> bool:
+        return len(self.subscribers) >= self.max_clients
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.buffer_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: FeedEvent):
+        """Add an event to every client's buffer, dropping the clients that are full."""
+        if event.key is not None:
+            if self.newest is not None and event.key <= self.newest:
+                return
+            self.newest = event.key
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            if not subscriber.push(event):
+                subscriber.drop()
+                self.subscribers.discard(subscriber)
+                self.dropped += 1
+
+    async def poll(self):
+        """Publish the posts created since the newest one published."""
+        if not self.subscribers:
+            # start from the newest post once clients connect; they catch up on
+            # anything older themselves
+            self.newest = None
+            return
+        async with self.database.primary_session() as db:
+            if self.newest is None:
+                newest = await async_crud.get_post_listings(db, limit=1)
+                if newest:
+                    self.newest = (newest[0].created, newest[0].id)
+                return
+            posts = await async_crud.get_new_post_listings(db, self.newest)
+        for post in posts:
+            self.publish(post_event("created", post))
+
+    async def monitor(self, interval: float):
+        """Poll every interval seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.poll()
+            except SQLAlchemyError:
+                logger.exception("polling for new posts failed")
+
+    def start(self, database: Database, settings: Settings):
+        """
+        Use the app's live feed settings, and start polling its database every
+        settings.feed_stream_poll_interval seconds, unless that is 0.
+        """
+        self.database = database
+        self.buffer_size = settings.feed_stream_buffer
+        self.max_clients = settings.feed_stream_max_clients
+        self.keepalive = settings.feed_stream_keepalive
+        if settings.feed_stream_poll_interval:
+            self._poll = asyncio.get_running_loop().create_task(
+                self.monitor(settings.feed_stream_poll_interval)
+            )
+
+    def stop(self):
+        """Stop polling, and end every client's stream."""
+        if self._poll is not None:
+            self._poll.cancel()
+            self._poll = None
+        for subscriber in self.subscribers:
+            subscriber.drop()
+        self.subscribers.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "clients": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+# configured by the app when it starts
+broadcaster = Broadcaster(
+    buffer_size=DEFAULTS.feed_stream_buffer,
+    max_clients=DEFAULTS.feed_stream_max_clients,
+    keepalive=DEFAULTS.feed_stream_keepalive,
+)
+
+
+async def publish_post(db: DBSession, kind: str, post_id: int):
+    """
+    Send a post that was just created, updated or deleted to the connected clients.
+    db must be a session on the primary, so it sees the write.
+    """
+    if not broadcaster.subscribers:
+        return
+    if kind == "deleted":
+        broadcaster.publish(make_event(kind, {"id": post_id}))
+        return
+    post = await async_crud.get_post_listing(db, post_id)
+    if post is not None:
+        broadcaster.publish(post_event(kind, post))
+
+
+@router.get("/feed/stream")
+async def feed_stream(request: Request, last_event_id: Optional[str] = None):
+    """
+    Stream the posts created, updated and deleted from now on as server-sent events.
+
+    Pass the id of the last event received as the Last-Event-ID header (browsers do
+    this when they reconnect) or the last_event_id parameter to be sent the posts
+    created since then first.
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    try:
+        after = decode_cursor(last_event_id) if last_event_id else None
+    except InvalidCursor as e:
+        raise HTTPException(400, str(e))
+    if broadcaster.full:
+        broadcaster.rejected += 1
+        raise HTTPException(
+            503, "Too many live feed clients", headers={"Retry-After": "10"}
+        )
+
+    return StreamingResponse(
+        _stream(get_database(request), after),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _stream(
+    database: Database, after: Optional[PostKey]
+) -> AsyncIterator[bytes]:
+    # subscribed before catching up, so no post falls between the two
+    subscriber = broadcaster.subscribe()
+    try:
+        yield RETRY
+        if after is not None:
+            backlog = await _backlog(database, after)
+            if len(backlog) > BACKLOG_SIZE:
+                yield RESET
+                return
+            for event in backlog:
+                after = event.key
+                yield event.message
+
+        while True:
+            event = await subscriber.next(broadcaster.keepalive)
+            if event is None:
+                if subscriber.dropped:
+                    return
+                yield KEEPALIVE
+                continue
+            if event.key is not None:
+                # already sent in the backlog
+                if after is not None and event.key <= after:
+                    continue
+                after = event.key
+            yield event.message
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def _backlog(database: Database, after: PostKey) -> List[FeedEvent]:
+    """The posts created after `after`, up to one more than BACKLOG_SIZE."""
+    async with database.primary_session() as db:
+        posts = await async_crud.get_new_post_listings(
+            db, after, limit=BACKLOG_SIZE + 1
+        )
+    return [post_event("created", post) for post in posts]
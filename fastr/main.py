@@ -1,35 +1,71 @@
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from starlette.middleware.sessions import SessionMiddleware
+"""
+The FastAPI app.
 
-from fastr import auth, blog
-from fastr.db import models
-from fastr.db.database import engine
-from fastr.config import Settings
+`uvicorn fastr.main:app` serves an app built from the environment's settings. Use
+create_app to build one with other settings, e.g. `uvicorn --factory
+fastr.main:create_app`.
 
+Building the app doesn't touch the database. The app creates its engines when it
+starts and disposes of them when it shuts down. The schema is created and migrated by
+`python -m fastr.db.migrations` (see fastr.db.migrations), run once per deploy rather
+than by every worker; the app only checks its version when it starts.
+"""
+import functools
+from typing import Optional
 
-# create the database tables
-models.Base.metadata.create_all(bind=engine)
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse
+from starlette.middleware.sessions import SessionMiddleware
 
-app = FastAPI()
+from fastr import api, auth, blog, cache, live, metrics, tasks, templating
+from fastr.assets import static_files
+from fastr.compression import CompressionMiddleware
+from fastr.hashing import HasherBusy, hasher
+from fastr.ratelimit import RateLimited, retry_after_header
+from fastr.db import migrations
+from fastr.db.database import Database
+from fastr.config import Settings
+from fastr.sessions import (
+    MemorySessionStore,
+    SQLiteSessionStore,
+    ServerSessionMiddleware,
+)
 
-settings = Settings()
-app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
 
-app.mount("/static", StaticFiles(directory="fastr/static"), name="static")
-app.include_router(auth.router)
-app.include_router(blog.router)
+router = APIRouter()
 
 
-@app.get("/hello", response_class=HTMLResponse)
+@router.get("/hello", response_class=HTMLResponse)
 async def hello() -> str:
     """A simple page that says hello"""
     return "Hello, World!"
 
 
-@app.exception_handler(blog.RequiresLoginException)
-def exception_handler(request: Request, exc: blog.RequiresLoginException) -> Response:
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_page(request: Request) -> str:
+    """Request timings and internal counters in the Prometheus text format."""
+    database = request.app.state.database
+    login_limits = request.app.state.login_limits
+    lines = [
+        *metrics.render_histograms(),
+        *metrics.render_stats("fastr_password_hash", hasher.stats.as_dict()),
+        *metrics.render_stats("fastr_feed_cache", cache.feed_cache.stats()),
+        *metrics.render_stats("fastr_user_cache", cache.user_cache.stats()),
+        *metrics.render_stats("fastr_replicas", database.replicas.stats()),
+        *metrics.render_stats("fastr_write_batches", database.write_batcher.stats()),
+        *metrics.render_stats("fastr_tasks", tasks.queue.stats()),
+        *metrics.render_stats("fastr_live_feed", live.broadcaster.stats()),
+        *metrics.render_stats("fastr_login_ip_limit", login_limits.ip.stats()),
+        *metrics.render_stats(
+            "fastr_login_username_limit", login_limits.username.stats()
+        ),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def login_required_handler(
+    request: Request, exc: blog.RequiresLoginException
+) -> Response:
     """
     Redirect to login screen if someone tries to access a view that requires login.
 
@@ -37,3 +73,142 @@ def exception_handler(request: Request, exc: blog.RequiresLoginException) -> Res
     https://github.com/tiangolo/fastapi/issues/1039#issuecomment-591661667
     """
     return RedirectResponse(url="/auth/login", status_code=302)
+
+
+def hasher_busy_handler(request: Request, exc: HasherBusy) -> Response:
+    """Tell the client to come back later when too many logins are queued up."""
+    return HTMLResponse(
+        "Server busy, please try again shortly.",
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def rate_limited_handler(request: Request, exc: RateLimited) -> Response:
+    """Tell the client how long to wait before trying again."""
+    return HTMLResponse(
+        "Too many attempts, please try again later.",
+        status_code=429,
+        headers={"Retry-After": retry_after_header(exc)},
+    )
+
+
+def start_database(app: FastAPI, settings: Settings):
+    """
+    Connect the app to the database described by settings, and set up what depends on
+    it. Refuses to start on a database that hasn't been migrated.
+    """
+    database = Database(settings)
+    try:
+        migrations.check(database.engine)
+    except migrations.SchemaVersionError:
+        database.engine.dispose()
+        raise
+    app.state.database = database
+    if settings.metrics_enabled:
+        for e in (database.engine, database.async_engine.sync_engine):
+            metrics.instrument_engine(e, settings.slow_query_ms)
+    database.start()
+
+    app.state.login_limits = auth.create_login_limits(settings, database.engine)
+    store = app.state.session_store
+    if isinstance(store, SQLiteSessionStore) and store.engine is None:
+        store.engine = database.engine
+
+
+def configure_shared(settings: Settings):
+    """
+    Configure the objects shared by every app in the process from this app's settings.
+    If several apps run in one process, the last one started wins.
+    """
+    cache.configure(settings)
+    hasher.configure(settings)
+    templating.configure(settings)
+
+
+def start_live_feed(app: FastAPI, settings: Settings):
+    live.broadcaster.start(app.state.database, settings)
+
+
+async def close_database(app: FastAPI):
+    await app.state.database.close()
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the app.
+
+    Parameters
+    ----------
+    settings
+        settings for the app; defaults to the settings in the environment. They are
+        kept in app.state.settings. The app configures its database and the objects
+        shared by every app in the process (the caches, the templates, the password
+        hasher, the task queue and the live feed) from them when it starts.
+    """
+    settings = settings or Settings()
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.session_store = None
+
+    if settings.session_backend == "cookie":
+        app.add_middleware(
+            SessionMiddleware,
+            secret_key=settings.secret_key,
+            max_age=settings.session_max_age,
+        )
+    else:
+        if settings.session_backend == "memory":
+            store = MemorySessionStore()
+        else:
+            # gets the app's engine when it starts
+            store = SQLiteSessionStore()
+        app.state.session_store = store
+        app.add_middleware(
+            ServerSessionMiddleware, store=store, max_age=settings.session_max_age
+        )
+
+    if settings.compression_enabled:
+        app.add_middleware(
+            CompressionMiddleware,
+            min_size=settings.compression_min_size,
+            gzip_level=settings.gzip_level,
+            brotli_quality=settings.brotli_quality,
+        )
+
+    if settings.metrics_enabled:
+        # added last so it is the outermost middleware and times everything else
+        app.add_middleware(metrics.MetricsMiddleware)
+
+    app.mount("/static", static_files, name="static")
+    app.include_router(auth.router)
+    app.include_router(blog.router)
+    app.include_router(api.router)
+    app.include_router(live.router)
+    app.include_router(router)
+
+    app.add_exception_handler(blog.RequiresLoginException, login_required_handler)
+    app.add_exception_handler(HasherBusy, hasher_busy_handler)
+    app.add_exception_handler(RateLimited, rate_limited_handler)
+
+    app.add_event_handler("startup", functools.partial(configure_shared, settings))
+    app.add_event_handler("startup", functools.partial(start_database, app, settings))
+    app.add_event_handler("startup", templating.precompile_templates)
+    app.add_event_handler("startup", static_files.load)
+    app.add_event_handler(
+        "startup", functools.partial(tasks.queue.start, app, settings)
+    )
+    app.add_event_handler(
+        "startup", functools.partial(start_live_feed, app, settings)
+    )
+    # before the hasher and the database close, since the tasks use them
+    app.add_event_handler(
+        "shutdown", functools.partial(tasks.queue.stop, settings.task_drain_timeout)
+    )
+    app.add_event_handler("shutdown", live.broadcaster.stop)
+    app.add_event_handler("shutdown", hasher.shutdown)
+    app.add_event_handler("shutdown", functools.partial(close_database, app))
+    return app
+
+
+app = create_app()
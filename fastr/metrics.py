@@ -0,0 +1,217 @@
+"""
+Request-level performance instrumentation.
+
+MetricsMiddleware times every request and keeps a RequestTimings object in a context
+variable while it runs. SQLAlchemy event hooks (see instrument_engine), the template
+class in fastr.templating and the password hasher add their time to it. The totals are
+sent back in a Server-Timing header, and collected in per-route histograms that are
+served in the Prometheus text format by the /metrics route.
+"""
+import logging
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+slow_query_logger = logging.getLogger("fastr.slow_query")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+    """Time spent on each kind of work during one request."""
+
+    __slots__ = ("sql_count", "sql_seconds", "render_seconds", "hash_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.hash_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "fastr_request_timings", default=None
+)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Timings for the request being handled, or None outside of a request."""
+    return _current.get()
+
+
+def add_render_time(seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.render_seconds += seconds
+
+
+def add_hash_time(seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.hash_seconds += seconds
+
+
+class Histogram:
+    """Cumulative histogram of observed values, with one series per route."""
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # route -> [count per bucket, sum of values, number of values]
+        self._series: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, value: float):
+        with self._lock:
+            series = self._series.get(route)
+            if series is None:
+                series = self._series[route] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        name = self.name
+        yield f"# HELP {name} {self.description}"
+        yield f"# TYPE {name} histogram"
+        with self._lock:
+            for route, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    yield f'{name}_bucket{{route="{route}",le="{bound}"}} {cumulative}'
+                yield f'{name}_bucket{{route="{route}",le="+Inf"}} {count}'
+                yield f'{name}_sum{{route="{route}"}} {total}'
+                yield f'{name}_count{{route="{route}"}} {count}'
+
+
+request_seconds = Histogram(
+    "fastr_request_duration_seconds", "Request latency.", LATENCY_BUCKETS
+)
+sql_statements = Histogram(
+    "fastr_request_sql_statements", "SQL statements per request.", COUNT_BUCKETS
+)
+sql_seconds = Histogram(
+    "fastr_request_sql_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS
+)
+render_seconds = Histogram(
+    "fastr_request_render_seconds",
+    "Time spent rendering templates per request.",
+    LATENCY_BUCKETS,
+)
+hash_seconds = Histogram(
+    "fastr_request_hash_seconds",
+    "Time spent waiting for password hashing per request.",
+    LATENCY_BUCKETS,
+)
+HISTOGRAMS = (
+    request_seconds,
+    sql_statements,
+    sql_seconds,
+    render_seconds,
+    hash_seconds,
+)
+
+
+def render_stats(prefix: str, stats: Dict[str, float]) -> Iterable[str]:
+    """Render a dict of running totals (e.g. cache hits) as Prometheus gauges."""
+    for key, value in stats.items():
+        yield f"# TYPE {prefix}_{key} gauge"
+        yield f"{prefix}_{key} {value}"
+
+
+def render_histograms() -> Iterable[str]:
+    for histogram in HISTOGRAMS:
+        yield from histogram.render()
+
+
+# engines already hooked up by instrument_engine
+_instrumented: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+def instrument_engine(engine: Engine, slow_query_ms: float):
+    """
+    Count and time the statements run by an engine, and log the ones that take longer
+    than slow_query_ms to the fastr.slow_query logger. Engines are only instrumented
+    once.
+    """
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("fastr_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["fastr_query_start"].pop()
+        timings = _current.get()
+        if timings is not None:
+            timings.sql_count += 1
+            timings.sql_seconds += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            slow_query_logger.warning(
+                "slow query (%.1f ms): %s %r", elapsed * 1000, statement, parameters
+            )
+
+
+class MetricsMiddleware:
+    """Time each request, add a Server-Timing header and record the histograms."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    server_timing(timings, time.perf_counter() - start),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "other")
+            request_seconds.observe(route, time.perf_counter() - start)
+            sql_statements.observe(route, timings.sql_count)
+            sql_seconds.observe(route, timings.sql_seconds)
+            render_seconds.observe(route, timings.render_seconds)
+            hash_seconds.observe(route, timings.hash_seconds)
+
+
+def server_timing(timings: RequestTimings, total_seconds: float) -> str:
+    """Format the timings as a Server-Timing header value, in milliseconds."""
+    sql_desc = f'desc="{timings.sql_count} queries"'
+    return (
+        f"total;dur={total_seconds * 1000:.1f}, "
+        f"sql;dur={timings.sql_seconds * 1000:.1f};{sql_desc}, "
+        f"render;dur={timings.render_seconds * 1000:.1f}, "
+        f"hash;dur={timings.hash_seconds * 1000:.1f}"
+    )
@@ -0,0 +1,208 @@
+"""
+Rate limiting with token buckets.
+
+Each key (an IP address, a username, ...) gets a bucket of `burst` tokens that refills
+at `per_minute` tokens a minute, and every request takes a token. The buckets are kept
+in the equivalent "generic cell rate algorithm" form: a single timestamp per key, the
+time at which its bucket will be full again. That makes each bucket one float, and a
+bucket that has refilled is the same as a missing one, so eviction is simply deleting
+timestamps in the past.
+
+MemoryRateLimitStore keeps the buckets in the worker process. SQLiteRateLimitStore
+keeps them in the rate_limit table of the app's database so every worker shares them,
+at the cost of a write per request.
+"""
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+
+class RateLimited(Exception):
+    """Raised when a key has used up its tokens. Retry after retry_after seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many requests, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RateLimitStore(ABC):
+    """Storage for the buckets, as the time each one will be full again."""
+
+    # run the methods on the threadpool because they do blocking I/O
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, interval: float, capacity: float, now: float) -> float:
+        """
+        Take a token from a bucket.
+
+        Parameters
+        ----------
+        key
+            the bucket
+        interval
+            seconds it takes to refill one token
+        capacity
+            seconds it takes to refill the whole bucket (interval * burst)
+        now
+            the current time
+
+        Returns
+        -------
+        0 if a token was taken, otherwise the seconds until one will be available
+        """
+
+    @abstractmethod
+    def evict(self, now: float) -> int:
+        """Remove the buckets that are full by now. Returns the number removed."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every bucket."""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Keep the buckets in a dict in this process."""
+
+    def __init__(self):
+        self._full_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, interval: float, capacity: float, now: float) -> float:
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now) + interval
+            if full_at - now > capacity:
+                return full_at - now - capacity
+            self._full_at[key] = full_at
+            return 0
+
+    def evict(self, now: float) -> int:
+        with self._lock:
+            full = [key for key, full_at in self._full_at.items() if full_at <= now]
+            for key in full:
+                del self._full_at[key]
+        return len(full)
+
+    def clear(self):
+        with self._lock:
+            self._full_at.clear()
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+
+# takes a token and returns the new time, or nothing if the bucket is empty
+TAKE = text(
+    "INSERT INTO rate_limit (key, full_at) VALUES (:key, :now + :interval) "
+    "ON CONFLICT (key) DO UPDATE SET full_at = max(full_at, :now) + :interval "
+    "WHERE max(full_at, :now) + :interval - :now <= :capacity "
+    "RETURNING full_at"
+)
+FULL_AT = text("SELECT full_at FROM rate_limit WHERE key = :key")
+EVICT = text("DELETE FROM rate_limit WHERE full_at <= :now")
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    Keep the buckets in the rate_limit table of the app's database, so they are shared
+    by every worker.
+    """
+
+    blocking = True
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def take(self, key: str, interval: float, capacity: float, now: float) -> float:
+        params = {"key": key, "now": now, "interval": interval, "capacity": capacity}
+        with self.engine.begin() as conn:
+            if conn.execute(TAKE, params).first() is not None:
+                return 0
+            full_at = conn.execute(FULL_AT, {"key": key}).scalar()
+        return max(full_at, now) + interval - now - capacity
+
+    def evict(self, now: float) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(EVICT, {"now": now}).rowcount
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM rate_limit")
+
+
+class RateLimiter:
+    """
+    Allow each key `burst` requests at once, and `per_minute` a minute after that.
+
+    Parameters
+    ----------
+    store
+        where the buckets are kept
+    prefix
+        added to the keys, so limiters can share a store
+    burst
+        the size of each bucket
+    per_minute
+        the rate each bucket refills at
+    evict_interval
+        seconds between removals of full buckets from the store
+    """
+
+    def __init__(
+        self,
+        store: RateLimitStore,
+        prefix: str,
+        burst: int,
+        per_minute: float,
+        evict_interval: float = 60,
+    ):
+        self.store = store
+        self.prefix = prefix
+        self.interval = 60 / per_minute
+        # with a little slack for rounding in the sums of times
+        self.capacity = self.interval * burst + 1e-6
+        self.evict_interval = evict_interval
+        self.allowed = 0
+        self.rejected = 0
+        self._next_evict = time.time() + evict_interval
+
+    async def _call(self, func, *args):
+        if self.store.blocking:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+    async def hit(self, key: str):
+        """
+        Take a token for key.
+
+        Raises
+        ------
+        RateLimited
+            if key has no tokens left
+        """
+        now = time.time()
+        if now >= self._next_evict:
+            self._next_evict = now + self.evict_interval
+            await self._call(self.store.evict, now)
+
+        wait = await self._call(
+            self.store.take, self.prefix + key, self.interval, self.capacity, now
+        )
+        if wait:
+            self.rejected += 1
+            raise RateLimited(wait)
+        self.allowed += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {"allowed": self.allowed, "rejected": self.rejected}
+
+
+def retry_after_header(exc: RateLimited) -> str:
+    """Retry-After in whole seconds, rounded up so clients don't retry too early."""
+    return str(max(1, math.ceil(exc.retry_after)))
@@ -0,0 +1,244 @@
+"""
+Production server: several uvicorn worker processes sharing one listening socket.
+
+bcrypt, template rendering and request handling are CPU bound, so a single process
+can't use more than one core. The launcher binds the socket, then starts one worker
+per available CPU (the CPUs this process may run on, which respects taskset and
+container CPU sets). Workers share nothing but the database; each has its own caches
+(see fastr.cache).
+
+A new worker warms up before it accepts connections. It imports the app, starts its
+password hashing processes, and runs the app's startup events, which connect to the
+database, compile the templates and load the static files; then it opens its database
+connections and runs a feed query. If any of that fails, the launcher stops rather
+than restarting workers that can't start. After Settings.serve_max_requests requests
+(plus up to serve_max_requests_jitter more, so they don't all go at once) a worker
+finishes the requests it has, shuts down, and is replaced by a new one, which bounds
+any growth in its memory use.
+
+The database must have been migrated first (see fastr.db.migrations).
+
+Usage:
+    python -m fastr.serve [--host 127.0.0.1] [--port 8000] [--workers N]
+        [--access-log]
+"""
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import List, Optional
+
+import uvicorn
+
+from fastr.config import Settings
+
+
+logger = logging.getLogger(__name__)
+
+# exit code of a worker whose app failed to start, which restarting won't fix
+STARTUP_FAILED = 3
+
+# seconds workers get to finish their requests when the server is stopped
+SHUTDOWN_TIMEOUT = 30
+
+
+def available_cpus() -> int:
+    """The number of CPUs this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS or Windows
+        return os.cpu_count() or 1
+
+
+def warm_up(app):
+    """Get a new worker ready, so its first requests are as fast as the rest."""
+    from fastr.hashing import hasher
+
+    # as the app will when it starts, so the processes aren't started twice
+    hasher.configure(app.state.settings)
+    hasher.start()
+
+
+def warm_up_database(app):
+    """Open the app's database connections once it has created them."""
+    from fastr.blog import POSTS_PER_PAGE
+    from fastr.db import crud
+    from fastr.db.database import warm_pool
+
+    database = app.state.database
+    warm_pool(database.engine, database.settings.database_pool_size)
+    # compiles the feed query and reads the newest posts into SQLite's page cache
+    with database.session_factory() as db:
+        crud.get_post_listings(db, limit=POSTS_PER_PAGE + 1)
+
+
+def run_worker(
+    sock: socket.socket,
+    max_requests: Optional[int],
+    access_log: bool,
+):
+    """Run one worker process, serving the app on the shared socket."""
+    import fastr.main
+
+    # after the app's own startup events, which connect it to the database
+    fastr.main.app.add_event_handler(
+        "startup", functools.partial(warm_up_database, fastr.main.app)
+    )
+    try:
+        warm_up(fastr.main.app)
+    except Exception:
+        # e.g. the database can't be opened; the supervisor would restart it forever
+        logger.exception("worker failed to warm up")
+        sys.exit(STARTUP_FAILED)
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "fastr.main:app",
+            limit_max_requests=max_requests,
+            access_log=access_log,
+            timeout_graceful_shutdown=SHUTDOWN_TIMEOUT,
+        )
+    )
+    # runs the app's startup events before accepting connections
+    server.run(sockets=[sock])
+    if not server.started:
+        sys.exit(STARTUP_FAILED)
+
+
+class Supervisor:
+    """
+    Start the workers and replace any that exit, until told to stop.
+
+    Parameters
+    ----------
+    sock
+        the bound listening socket, shared by the workers
+    workers
+        number of worker processes
+    max_requests
+        requests each worker serves before it is replaced, or None for no limit
+    max_requests_jitter
+        up to this many more requests are added to each worker's limit at random
+    access_log
+        log every request
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int,
+        max_requests: Optional[int],
+        max_requests_jitter: int = 0,
+        access_log: bool = False,
+    ):
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.access_log = access_log
+        self.processes: List[BaseProcess] = []
+        self.should_exit = False
+        # spawn rather than fork, so each worker imports the app itself
+        self._context = multiprocessing.get_context("spawn")
+
+    def start_worker(self) -> BaseProcess:
+        max_requests = self.max_requests
+        if max_requests is not None:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        process = self._context.Process(
+            target=run_worker,
+            args=(self.sock, max_requests, self.access_log),
+            name="fastr-worker",
+        )
+        process.start()
+        logger.info("started worker %s", process.pid)
+        return process
+
+    def run(self) -> int:
+        """Supervise the workers. Returns the exit code for the launcher."""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_signal)
+
+        self.processes = [self.start_worker() for _ in range(self.workers)]
+        exit_code = 0
+        while not self.should_exit:
+            wait([process.sentinel for process in self.processes], timeout=1)
+            for i, process in enumerate(self.processes):
+                if process.is_alive() or self.should_exit:
+                    continue
+                if process.exitcode == STARTUP_FAILED:
+                    logger.error("worker %s failed to start, stopping", process.pid)
+                    self.should_exit = True
+                    exit_code = 1
+                    break
+                logger.info(
+                    "worker %s exited with code %s, replacing it",
+                    process.pid,
+                    process.exitcode,
+                )
+                self.processes[i] = self.start_worker()
+
+        self.stop()
+        return exit_code
+
+    def handle_signal(self, signum, frame):
+        self.should_exit = True
+
+    def stop(self):
+        """Let the workers finish their requests, and kill any that take too long."""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("killing worker %s", process.pid)
+                process.kill()
+                process.join()
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.serve_workers or available_cpus(),
+        help="worker processes (default: one per available CPU)",
+    )
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    # fail here, once, rather than in every worker
+    from fastr.db import migrations
+    from fastr.db.database import create_db_engine
+
+    engine = create_db_engine(settings)
+    migrations.check(engine)
+    engine.dispose()
+
+    config = uvicorn.Config("fastr.main:app", host=args.host, port=args.port)
+    sock = config.bind_socket()
+    logger.info(
+        "serving on http://%s:%s with %s workers", args.host, args.port, args.workers
+    )
+    supervisor = Supervisor(
+        sock,
+        workers=args.workers,
+        max_requests=settings.serve_max_requests or None,
+        max_requests_jitter=settings.serve_max_requests_jitter,
+        access_log=args.access_log,
+    )
+    sys.exit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
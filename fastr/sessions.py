@@ -0,0 +1,240 @@
+"""
+Server-side sessions.
+
+Starlette's SessionMiddleware keeps the whole session in a signed cookie, which is
+re-serialized, signed and sent back on every response. ServerSessionMiddleware keeps
+the data in a SessionStore instead and only puts a random session id in the cookie.
+Sessions are only written when their data changes, and each write pushes the expiry of
+both the stored session and its cookie forward.
+"""
+import json
+import secrets
+import time
+import typing
+from abc import ABC, abstractmethod
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fastr.cache import LRUCache
+from fastr.db import models
+
+
+class SessionStore(ABC):
+    """Storage for session data, keyed by session id."""
+
+    # run the methods on the threadpool because they do blocking I/O
+    blocking = False
+
+    @abstractmethod
+    def load(self, session_id: str) -> typing.Optional[dict]:
+        """Return the data for a session, or None if it doesn't exist or expired."""
+
+    @abstractmethod
+    def save(self, session_id: str, data: dict, max_age: int):
+        """Store the data for a session, replacing any existing data."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session."""
+
+    def reap(self) -> int:
+        """Remove expired sessions. Returns the number removed."""
+        return 0
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Keep sessions in an in-process LRU cache. Sessions are lost on restart and aren't
+    shared between worker processes.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self._cache = LRUCache(maxsize=maxsize, ttl=0)
+
+    def load(self, session_id: str) -> typing.Optional[dict]:
+        data = self._cache.get(session_id)
+        return None if data is None else json.loads(data)
+
+    def save(self, session_id: str, data: dict, max_age: int):
+        # stored serialized so later changes to the request's dict don't leak in
+        self._cache.set(session_id, json.dumps(data), ttl=max_age)
+
+    def delete(self, session_id: str):
+        self._cache.delete(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Keep sessions in the session table of the app's database, so they survive restarts
+    and are shared by every worker.
+
+    Parameters
+    ----------
+    engine
+        engine for the app's database. The app sets it when it starts if it is None,
+        since it only creates its engine then.
+    reap_batch_size
+        number of expired sessions deleted per transaction, which keeps each write lock
+        short
+    """
+
+    blocking = True
+
+    def __init__(
+        self, engine: typing.Optional[Engine] = None, reap_batch_size: int = 500
+    ):
+        self.engine = engine
+        self.reap_batch_size = reap_batch_size
+        self._table = models.SessionRecord.__table__
+
+    def load(self, session_id: str) -> typing.Optional[dict]:
+        query = select(self._table.c.data).where(
+            self._table.c.id == session_id, self._table.c.expires > time.time()
+        )
+        with self.engine.connect() as conn:
+            data = conn.execute(query).scalar()
+        return None if data is None else json.loads(data)
+
+    def save(self, session_id: str, data: dict, max_age: int):
+        values = {"data": json.dumps(data), "expires": time.time() + max_age}
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                self._table.update()
+                .where(self._table.c.id == session_id)
+                .values(**values)
+            )
+            if updated.rowcount == 0:
+                conn.execute(self._table.insert().values(id=session_id, **values))
+
+    def delete(self, session_id: str):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self._table).where(self._table.c.id == session_id))
+
+    def reap(self) -> int:
+        removed = 0
+        while True:
+            expired = (
+                select(self._table.c.id)
+                .where(self._table.c.expires <= time.time())
+                .limit(self.reap_batch_size)
+            )
+            with self.engine.begin() as conn:
+                count = conn.execute(
+                    delete(self._table).where(self._table.c.id.in_(expired))
+                ).rowcount
+            removed += count
+            if count < self.reap_batch_size:
+                return removed
+
+
+class ServerSessionMiddleware:
+    """
+    Drop-in replacement for Starlette's SessionMiddleware that keeps session data in a
+    SessionStore. The cookie only holds the session id.
+
+    Parameters
+    ----------
+    app
+        the ASGI app
+    store
+        where session data is kept
+    session_cookie
+        name of the cookie holding the session id
+    max_age
+        seconds a session lasts after it was last changed
+    reap_interval
+        seconds between removals of expired sessions from the store
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: SessionStore,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, in seconds
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+        reap_interval: float = 60,
+    ):
+        self.app = app
+        self.store = store
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+        self.reap_interval = reap_interval
+        self._next_reap = time.monotonic() + reap_interval
+
+    async def _call(self, func: typing.Callable, *args: typing.Any) -> typing.Any:
+        if self.store.blocking:
+            return await run_in_threadpool(func, *args)
+        return func(*args)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        if time.monotonic() >= self._next_reap:
+            self._next_reap = time.monotonic() + self.reap_interval
+            await self._call(self.store.reap)
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        data = await self._call(self.store.load, session_id) if session_id else None
+        if data is None:
+            session_id = None
+        scope["session"] = data or {}
+        # compared with the session at the end of the request to detect changes
+        initial = json.dumps(scope["session"], sort_keys=True)
+        initial_user = scope["session"].get("user")
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                await self._persist(
+                    message, scope["session"], session_id, initial, initial_user
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _persist(
+        self,
+        message: Message,
+        session: dict,
+        session_id: typing.Optional[str],
+        initial: str,
+        initial_user: typing.Any,
+    ):
+        """Save the session if it changed, and set or clear the cookie if needed."""
+        if session:
+            if json.dumps(session, sort_keys=True) == initial:
+                return  # unchanged, so there is nothing to write
+            if session_id is not None and session.get("user") != initial_user:
+                # new id whenever the logged in user changes, against session fixation
+                await self._call(self.store.delete, session_id)
+                session_id = None
+            if session_id is None:
+                session_id = secrets.token_urlsafe(32)
+            await self._call(self.store.save, session_id, session, self.max_age)
+            # sent on every save so the cookie expires with the stored session
+            self._set_cookie(message, session_id, f"Max-Age={self.max_age}; ")
+        elif session_id is not None:
+            # the session has been cleared
+            await self._call(self.store.delete, session_id)
+            self._set_cookie(message, "null", "expires=Thu, 01 Jan 1970 00:00:00 GMT; ")
+
+    def _set_cookie(self, message: Message, value: str, expiry: str):
+        headers = MutableHeaders(scope=message)
+        headers.append(
+            "Set-Cookie",
+            f"{self.session_cookie}={value}; path={self.path}; "
+            f"{expiry}{self.security_flags}",
+        )
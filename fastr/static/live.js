@@ -0,0 +1,85 @@
+// Show posts on the first page of the index as they are created, updated and
+// deleted, from the server-sent events of /feed/stream (see fastr/live.py).
+(function () {
+  "use strict";
+  const feed = document.querySelector(".feed[data-stream]");
+  if (!feed || !window.EventSource) {
+    return;
+  }
+
+  // resume after the newest post on the page, so none created since it was
+  // rendered are missed
+  let url = feed.dataset.stream;
+  const newest = feed.querySelector("article[data-cursor]");
+  if (newest) {
+    url += "?last_event_id=" + encodeURIComponent(newest.dataset.cursor);
+  }
+  const source = new EventSource(url);
+
+  function element(tag, attributes, children) {
+    const el = document.createElement(tag);
+    for (const [name, value] of Object.entries(attributes)) {
+      el.setAttribute(name, value);
+    }
+    children.forEach((child) => el.append(child));
+    return el;
+  }
+
+  function render(post) {
+    const index = feed.dataset.index;
+    const link = element("a", {href: index + "post/" + post.id}, [post.title]);
+    const userUrl = index + "user/" + encodeURIComponent(post.username);
+    const author = element("a", {href: userUrl}, [post.username]);
+    const about = element(
+      "div", {class: "about"}, ["by ", author, " on " + post.created.slice(0, 10)]
+    );
+    const title = element("div", {}, [element("h2", {}, [link]), about]);
+    const header = element("header", {}, [title]);
+    const body = element("p", {class: "body"}, [post.body]);
+    return element("article", {class: "post", "data-id": post.id}, [header, body]);
+  }
+
+  function find(id) {
+    return feed.querySelector('article[data-id="' + id + '"]');
+  }
+
+  source.addEventListener("created", (event) => {
+    const post = JSON.parse(event.data);
+    if (find(post.id)) {
+      return;
+    }
+    const first = feed.querySelector("article");
+    if (first) {
+      feed.insertBefore(render(post), first);
+      feed.insertBefore(document.createElement("hr"), first);
+    } else {
+      feed.prepend(render(post));
+    }
+  });
+
+  source.addEventListener("updated", (event) => {
+    const post = JSON.parse(event.data);
+    const article = find(post.id);
+    if (article) {
+      article.querySelector("h2 a").textContent = post.title;
+      article.querySelector(".body").textContent = post.body;
+    }
+  });
+
+  source.addEventListener("deleted", (event) => {
+    const article = find(JSON.parse(event.data).id);
+    if (article) {
+      const rule = article.nextElementSibling || article.previousElementSibling;
+      if (rule && rule.tagName === "HR") {
+        rule.remove();
+      }
+      article.remove();
+    }
+  });
+
+  // too much was missed while disconnected to catch up on
+  source.addEventListener("reset", () => {
+    source.close();
+    window.location.reload();
+  });
+})();
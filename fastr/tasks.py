@@ -0,0 +1,240 @@
+"""
+Background tasks: work a request causes but doesn't need to wait for.
+
+Routes enqueue tasks on the TaskQueue instead of doing the work before they respond.
+Worker coroutines on the app's event loop run them in the order they were enqueued;
+plain functions run on the threadpool. A task that raises is retried after
+Settings.task_retry_delay seconds, doubling each time, up to task_max_attempts
+attempts, and then logged and dropped. A task that fails part way through runs again,
+so tasks must be safe to repeat.
+
+Tasks are only kept in memory, so the ones still queued when a process stops are lost.
+Only work that can be lost goes here: filling the process's own caches, and replacing
+a password hash that the next login will replace anyway. The side effects of a post
+write (cache invalidation, the full-text index and the author counts) stay in the
+request, in the write's transaction.
+
+The queue starts with the app. When the app shuts down it runs the tasks it has for
+up to Settings.task_drain_timeout seconds. Queue depth and lag are served on /metrics.
+"""
+import asyncio
+import collections
+import itertools
+import logging
+import time
+from starlette.concurrency import run_in_threadpool
+from starlette.applications import Starlette
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+
+from fastr.config import DEFAULTS, Settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Task(NamedTuple):
+    """A task waiting to run."""
+
+    name: str
+    args: tuple
+    # attempts that have failed so far
+    attempts: int = 0
+    # perf_counter time it joined the queue, for measuring lag
+    queued: float = 0
+
+
+class TaskQueue:
+    """
+    Run tasks in the background, retrying the ones that fail.
+
+    Parameters
+    ----------
+    workers
+        tasks that may run at once
+    max_attempts
+        times a task is tried before it is dropped
+    retry_delay
+        seconds before the first retry; each one after that waits twice as long
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_attempts: int,
+        retry_delay: float,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # the app, for tasks that render pages
+        self.app: Optional[Starlette] = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._tasks: Dict[str, Callable] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        # when each task in _queue joined it, oldest first
+        self._queued: Deque[float] = collections.deque()
+        self._workers: List[asyncio.Task] = []
+        self._retries: Dict[int, asyncio.TimerHandle] = {}
+        self._retry_ids = itertools.count()
+        self._stopping = False
+
+    def task(self) -> Callable[[Callable], Callable]:
+        """Register a function or coroutine function as a task to be enqueued."""
+
+        def register(func: Callable) -> Callable:
+            name = f"{func.__module__}.{func.__qualname__}"
+            self._tasks[name] = func
+            return func
+
+        return register
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    async def enqueue(self, func: Callable, *args: Any):
+        """
+        Run func(*args) in the background. If the queue isn't running, e.g. in an app
+        that was never started, it runs now instead.
+        """
+        name = f"{func.__module__}.{func.__qualname__}"
+        if name not in self._tasks:
+            raise ValueError(f"{name} isn't registered as a task")
+
+        task = Task(name, args)
+        if self.running:
+            self._put(task)
+        else:
+            await self._run(task)
+
+    def start(
+        self, app: Optional[Starlette] = None, settings: Optional[Settings] = None
+    ):
+        """
+        Start the workers on the running event loop.
+
+        Parameters
+        ----------
+        app
+            the app, for tasks that need its database or render its pages
+        settings
+            the app's settings, for the number of workers and the retries; defaults
+            to the ones the queue was created with
+        """
+        self.app = app
+        if settings is not None:
+            self.workers = settings.task_workers
+            self.max_attempts = settings.task_max_attempts
+            self.retry_delay = settings.task_retry_delay
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float):
+        """
+        Run the queued tasks, for up to timeout seconds, then stop the workers. Tasks
+        waiting to be retried are dropped.
+        """
+        if not self.running:
+            return
+        self._stopping = True
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("stopped with %s tasks still queued", self._queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._queued.clear()
+        self._stopping = False
+
+    async def join(self):
+        """Wait until every queued task has run."""
+        if self.running:
+            await self._queue.join()
+
+    def _put(self, task: Task):
+        self._queued.append(time.perf_counter())
+        self._queue.put_nowait(task._replace(queued=self._queued[-1]))
+
+    async def _work(self):
+        while True:
+            task = await self._queue.get()
+            self._queued.popleft()
+            try:
+                await self._run(task)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, task: Task):
+        """Run a task, and schedule a retry if it fails."""
+        if task.queued:
+            self.last_lag = time.perf_counter() - task.queued
+            self.max_lag = max(self.max_lag, self.last_lag)
+        func = self._tasks[task.name]
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func(*task.args)
+            else:
+                await run_in_threadpool(func, *task.args)
+        except Exception:
+            attempts = task.attempts + 1
+            if attempts >= self.max_attempts:
+                logger.exception("task %s failed %s times", task.name, attempts)
+                self.failed += 1
+                return
+
+            task = task._replace(attempts=attempts)
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            if not self.running or self._stopping:
+                logger.exception("task %s failed", task.name)
+                return
+            logger.warning(
+                "task %s failed, retrying in %ss", task.name, delay, exc_info=True
+            )
+            self.retried += 1
+            self._schedule(task, delay)
+            return
+
+        self.completed += 1
+
+    def _schedule(self, task: Task, delay: float):
+        key = next(self._retry_ids)
+
+        def put():
+            del self._retries[key]
+            self._put(task)
+
+        self._retries[key] = asyncio.get_running_loop().call_later(delay, put)
+
+    def stats(self) -> Dict[str, float]:
+        oldest = self._queued[0] if self._queued else None
+        return {
+            "depth": self._queue.qsize() if self.running else 0,
+            "retrying": len(self._retries),
+            # how long the oldest queued task has been waiting
+            "lag_seconds": 0 if oldest is None else time.perf_counter() - oldest,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+# configured by the app when it starts
+queue = TaskQueue(
+    workers=DEFAULTS.task_workers,
+    max_attempts=DEFAULTS.task_max_attempts,
+    retry_delay=DEFAULTS.task_retry_delay,
+)
@@ -0,0 +1,133 @@
+"""
+The Jinja2 environment shared by every view.
+
+Templates are compiled to bytecode once and cached on disk, so new workers don't
+recompile them. Auto-reload (checking each template file for changes on every render)
+is off unless Settings.template_auto_reload is set, which is handy during development.
+The app sets both from its settings when it starts (see configure).
+"""
+import time
+from typing import Any, Iterable, Iterator, Optional
+
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template, pass_context
+from markupsafe import Markup, escape
+
+from fastr.assets import static_files
+from fastr.config import DEFAULTS, Settings
+from fastr.db.crud import HIGHLIGHT_END, HIGHLIGHT_START
+from fastr.db.pagination import encode_cursor
+from fastr.metrics import add_render_time
+
+
+class TimedTemplate(Template):
+    """Template that adds its render time to the current request's timings."""
+
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            add_render_time(time.perf_counter() - start)
+
+    def generate(self, *args: Any, **kwargs: Any) -> Iterator[str]:
+        """
+        Render piece by piece, adding the time spent producing each piece, but not the
+        time the caller spends between them, e.g. sending a streamed page.
+        """
+        chunks = super().generate(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                add_render_time(time.perf_counter() - start)
+            yield chunk
+
+
+templates = Jinja2Templates(
+    directory="fastr/templates",
+    auto_reload=DEFAULTS.template_auto_reload,
+    bytecode_cache=FileSystemBytecodeCache(DEFAULTS.template_cache_dir),
+)
+templates.env.template_class = TimedTemplate
+
+
+def highlight(value: str) -> Markup:
+    """Escape a search result and mark the matched words, see crud.search_posts."""
+    return Markup(
+        str(escape(value))
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_END, "</mark>")
+    )
+
+
+templates.env.filters["highlight"] = highlight
+
+
+@pass_context
+def url_for(context: dict, name: str, **path_params: Any) -> str:
+    """Starlette's url_for, except that static files get their hashed URLs."""
+    if name == "static":
+        path_params["path"] = static_files.url_path(path_params["path"])
+    return context["request"].url_for(name, **path_params)
+
+
+templates.env.globals["url_for"] = url_for
+
+
+def post_cursor(post: Any) -> str:
+    """A post's pagination cursor, which the live feed resumes after."""
+    return encode_cursor(post.created, post.id)
+
+
+templates.env.globals["post_cursor"] = post_cursor
+
+# bytes of rendered output sent per chunk by stream_template
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def configure(settings: Settings):
+    """Use the app's template settings, when it starts."""
+    templates.env.auto_reload = settings.template_auto_reload
+    templates.env.bytecode_cache = FileSystemBytecodeCache(settings.template_cache_dir)
+
+
+def precompile_templates():
+    """Load every template now, so the first requests don't pay to compile them."""
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.get_template(name)
+
+
+def stream_response(
+    chunks: Iterable[str], headers: Optional[dict] = None
+) -> StreamingResponse:
+    """
+    Stream rendered HTML, e.g. from Template.generate(), to the client as it is
+    produced. Small pieces of output are joined into chunks of STREAM_CHUNK_SIZE.
+
+    Anything changed in request.session while the chunks are produced is lost, because
+    the session is saved when the response starts.
+    """
+    return StreamingResponse(
+        _buffer(chunks, STREAM_CHUNK_SIZE), media_type="text/html", headers=headers
+    )
+
+
+def _buffer(chunks: Iterable[str], size: int) -> Iterator[bytes]:
+    """
+    Join the many small strings produced by Jinja into larger chunks, so each write to
+    the client carries a reasonable amount of data.
+    """
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer).encode("utf8")
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf8")
@@ -1,4 +1,14 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Collection
+from urllib.parse import urlsplit
+
 from fastapi import Request
+from starlette.applications import Starlette
+
+
+# content codings in order of preference, see negotiate_encoding
+ENCODINGS = ("br", "gzip")
 
 
 def flash(request: Request, error: str):
@@ -14,3 +24,108 @@ def flash(request: Request, error: str):
         the error message to flash
     """
     request.session["flashes"] = request.session.get("flashes", []) + [error]
+
+
+def anonymous_request(app: Starlette, base_url: str, path: str = "/") -> Request:
+    """
+    A GET request from a visitor without a session, for rendering pages outside of
+    a real request, e.g. in a background task.
+    """
+    url = urlsplit(base_url)
+    root_path = url.path.rstrip("/")
+    default_port = 443 if url.scheme == "https" else 80
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": url.scheme,
+            "server": (url.hostname, url.port or default_port),
+            "root_path": root_path,
+            "path": root_path + path,
+            "query_string": b"",
+            "headers": [(b"host", url.netloc.encode("latin-1"))],
+            "app": app,
+            "router": app.router,
+            "session": {},
+        }
+    )
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Check whether the If-None-Match header of a request matches an ETag, meaning the
+    client's copy is current and a 304 can be sent instead of the body.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as required for If-None-Match
+    candidates = (tag.strip().removeprefix("W/") for tag in header.split(","))
+    return etag in candidates
+
+
+def http_date(timestamp: float) -> str:
+    """Format a unix timestamp for the Last-Modified header."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """
+    Check the conditional headers of a request against the current ETag and
+    modification time of a response, to decide whether a 304 can be sent.
+
+    If-None-Match takes precedence over If-Modified-Since, as RFC 9110 requires.
+    """
+    if "if-none-match" in request.headers:
+        return etag_matches(request, etag)
+
+    header = request.headers.get("if-modified-since")
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have a resolution of one second
+    return int(last_modified) <= since
+
+
+def negotiate_encoding(accept_encoding: str, available: Collection[str]) -> str:
+    """
+    Choose the content coding to send from an Accept-Encoding header.
+
+    Parameters
+    ----------
+    accept_encoding
+        the request's Accept-Encoding header, or "" if it didn't send one
+    available
+        the codings that can be sent, e.g. ("br", "gzip")
+
+    Returns
+    -------
+    The first coding in ENCODINGS that is available and accepted by the client, or
+    "identity" to send the body uncompressed
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[coding.strip().lower()] = quality
+
+    for coding in ENCODINGS:
+        if coding in available and accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
@@ -2,21 +2,28 @@
 # do this first so the override is used in the imports
 import os
 os.environ["FASTR_DATABASE_PATH"] = "./tests/test_db.sqlite"
+# new password hashes don't need to be slow in the tests
+os.environ["FASTR_BCRYPT_ROUNDS"] = "4"
 
 import pytest
 import requests
 
 from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 import sqlite3
 
-from fastr.main import app
-from fastr.db import models
-from fastr.db.database import get_db, engine
+from fastr import cache, tasks
+from fastr.main import create_app
+from fastr.db import migrations
+from fastr.db.database import create_db_engine
 from fastr.config import Settings
 
 
 settings = Settings()
+# for setting up and inspecting the test database; each app makes its own
+_engine = create_db_engine(settings)
 
 
 with open(os.path.join(os.path.dirname(__file__), "data.sql"), "rb") as f:
@@ -28,7 +35,7 @@ def test_db() -> Session:
     """Set up and tear down the test database each time so each test starts with the
     same data."""
     # create the test database
-    models.Base.metadata.create_all(bind=engine)
+    migrations.migrate(_engine)
 
     # populate the test data
     db = sqlite3.connect(
@@ -37,29 +44,49 @@ def test_db() -> Session:
     )
     db.executescript(_data_sql)
 
-    # yield TestingSessionLocal()
-    yield next(get_db())
+    # the database was replaced, so nothing cached from a previous test is valid
+    cache.invalidate_feed()
+    cache.user_cache.clear()
+
+    with Session(bind=_engine) as db:
+        yield db
 
     # remove the database when finished
+    _engine.dispose()
     os.unlink(settings.database_path)
 
 
 @pytest.fixture
-def client(test_db) -> TestClient:
-    with TestClient(app) as c:
+def engine(test_db) -> Engine:
+    """An engine for the test database."""
+    return _engine
+
+
+@pytest.fixture(params=["sync", "async"])
+def client(request, test_db) -> TestClient:
+    """Run each test against both database modes."""
+    with TestClient(create_app(Settings(database_mode=request.param))) as c:
         yield c
 
 
+def wait_for_tasks(client: TestClient):
+    """Wait for the background tasks the app has queued so far to run."""
+    client.portal.call(tasks.queue.join)
+
+
 class AuthActions:
     def __init__(self, client):
         self._client = client
 
     def login(self, username="test", password="test") -> requests.Response:
-        return self._client.post(
+        response = self._client.post(
             "/auth/login",
             data={"username": username, "password": password},
             allow_redirects=True,
         )
+        # logging in rehashes the test users' passwords in the background
+        wait_for_tasks(self._client)
+        return response
 
     def logout(self) -> requests.Response:
         return self._client.get("/auth/logout", allow_redirects=True)
@@ -68,3 +95,25 @@ class AuthActions:
 @pytest.fixture
 def auth(client) -> AuthActions:
     return AuthActions(client)
+
+
+class QueryCounter:
+    """Count the SQL statements executed on any engine while the block is active."""
+
+    def __init__(self):
+        self.count = 0
+
+    def _increment(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self._increment)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self._increment)
+
+
+@pytest.fixture
+def count_queries() -> QueryCounter:
+    return QueryCounter()
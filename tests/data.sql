@@ -1,7 +1,7 @@
-INSERT INTO user (username, hashed_password)
+INSERT INTO user (username, hashed_password, post_count, last_posted_at)
 VALUES
-  ('test', '$2b$12$Qjg76DZ1ix6.Fgd7N0Ka4u/FdEGK7VFl3q8PZpPNOAbatrDE6fEL.'),  -- test
-  ('other', '$2b$12$P8tP7WmYx3IoK8duwUKzJuZ7ZtNTZs8ZWpoaW.BRkImWhh/UDkK32')  -- passWord1
+  ('test', '$2b$12$Qjg76DZ1ix6.Fgd7N0Ka4u/FdEGK7VFl3q8PZpPNOAbatrDE6fEL.', 1, '2018-01-01 00:00:00'),  -- test
+  ('other', '$2b$12$P8tP7WmYx3IoK8duwUKzJuZ7ZtNTZs8ZWpoaW.BRkImWhh/UDkK32', 1, '2021-10-27 01:02:03')  -- passWord1
 ;
 
 INSERT INTO post (title, body, author_id, created)
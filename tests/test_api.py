@@ -0,0 +1,81 @@
+import pytest
+
+
+def test_list_posts(client):
+    response = client.get("/api/v1/posts")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "posts": [
+            {
+                "id": 2,
+                "title": "second post",
+                "body": "second body",
+                "created": "2021-10-27T01:02:03",
+                "author_id": 2,
+                "username": "other",
+            },
+            {
+                "id": 1,
+                "title": "test title",
+                "body": "test\nbody",
+                "created": "2018-01-01T00:00:00",
+                "author_id": 1,
+                "username": "test",
+            },
+        ],
+        "next_cursor": None,
+    }
+
+
+def test_list_posts_pagination(client):
+    first = client.get("/api/v1/posts", params={"limit": 1}).json()
+    assert [post["id"] for post in first["posts"]] == [2]
+
+    params = {"limit": 1, "cursor": first["next_cursor"]}
+    second = client.get("/api/v1/posts", params=params).json()
+    assert [post["id"] for post in second["posts"]] == [1]
+    assert second["next_cursor"] is None
+
+
+@pytest.mark.parametrize("params", ({"limit": 0}, {"limit": 101}, {"cursor": "x"}))
+def test_list_posts_invalid(client, params):
+    assert client.get("/api/v1/posts", params=params).status_code in (400, 422)
+
+
+def test_fields(client):
+    response = client.get("/api/v1/posts", params={"fields": "title, id,title"})
+    assert response.json()["posts"][0] == {"title": "second post", "id": 2}
+
+    response = client.get("/api/v1/posts/1", params={"fields": "username"})
+    assert response.json() == {"username": "test"}
+
+    response = client.get("/api/v1/posts", params={"fields": "id,password"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown fields: password"}
+
+
+def test_get_post(client):
+    response = client.get("/api/v1/posts/2")
+    assert response.json()["title"] == "second post"
+    assert client.get("/api/v1/posts/3").status_code == 404
+
+
+def test_get_user(client):
+    """Users are served without their password hash"""
+    response = client.get("/api/v1/users/test")
+    assert response.json() == {"username": "test", "id": 1}
+    assert client.get("/api/v1/users/nobody").status_code == 404
+
+
+def test_list_posts_cache(client, auth, count_queries):
+    """Pages are cached until a post is written"""
+    client.get("/api/v1/posts")
+    with count_queries:
+        response = client.get("/api/v1/posts")
+    assert count_queries.count == 0
+
+    auth.login()
+    client.post("/create", data={"title": "new post", "body": ""})
+    response = client.get("/api/v1/posts")
+    assert response.json()["posts"][0]["title"] == "new post"
@@ -0,0 +1,72 @@
+import re
+
+import pytest
+
+from fastr.assets import IMMUTABLE, brotli
+from fastr.utils import negotiate_encoding
+
+
+def static_url(client):
+    """The stylesheet URL from the page head"""
+    html = client.get("/").text
+    return re.search(r'href="http://testserver(/static/[^"]+)"', html).group(1)
+
+
+def test_hashed_url(client):
+    """Templates link to static files by a hashed URL, which is cached forever"""
+    url = static_url(client)
+    assert re.fullmatch(r"/static/style\.[0-9a-f]{12}\.css", url)
+
+    response = client.get(url, headers={"Accept-Encoding": ""})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert response.headers["content-type"].startswith("text/css")
+    assert "content-encoding" not in response.headers
+    with open("fastr/static/style.css", "rb") as f:
+        assert response.content == f.read()
+
+    # the plain URL still works, but must be revalidated
+    response = client.get("/static/style.css")
+    assert response.headers["cache-control"] == "no-cache"
+
+
+@pytest.mark.parametrize("encoding", ("gzip", "br"))
+def test_compressed(client, encoding):
+    if encoding == "br" and brotli is None:
+        pytest.skip("brotli isn't installed")
+    url = static_url(client)
+    identity = client.get(url, headers={"Accept-Encoding": ""})
+
+    response = client.get(url, headers={"Accept-Encoding": encoding})
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] != identity.headers["etag"]
+    assert int(response.headers["content-length"]) < len(identity.content)
+    # the client decodes the body
+    assert response.content == identity.content
+
+
+def test_not_modified(client):
+    url = static_url(client)
+    etag = client.get(url).headers["etag"]
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.post(url).status_code == 405
+    assert client.get("/static/missing.css").status_code == 404
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    (
+        ("", "identity"),
+        ("gzip, deflate, br", "br"),
+        ("gzip", "gzip"),
+        ("br;q=0, gzip;q=0.5", "gzip"),
+        ("*", "br"),
+        ("*, br;q=0", "gzip"),
+        ("GZIP;q=1.0", "gzip"),
+        ("deflate", "identity"),
+    ),
+)
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header, ("br", "gzip")) == expected
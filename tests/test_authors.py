@@ -0,0 +1,74 @@
+from datetime import datetime
+
+from fastr import blog
+from fastr.db import author_stats, crud, schemas
+
+
+def test_user_page(client):
+    """An author page lists only their posts, with their post count"""
+    response = client.get("/user/other")
+    assert response.status_code == 200
+    assert "<h1>other</h1>" in response.text
+    assert "1 post, last on 2021-10-27" in response.text
+    assert "second post" in response.text
+    assert "test title" not in response.text
+
+
+def test_user_page_not_found(client):
+    response = client.get("/user/nobody")
+    assert response.status_code == 404
+    assert "User nobody doesn't exist." in response.text
+
+
+def test_user_page_pagination(client, auth, monkeypatch):
+    """Author pages are paginated with a cursor, like the index"""
+    monkeypatch.setattr(blog, "POSTS_PER_PAGE", 1)
+    auth.login()
+    client.post("/create", data={"title": "newer", "body": ""})
+
+    response = client.get("/user/test")
+    assert "2 posts" in response.text
+    assert "newer" in response.text
+    assert "test title" not in response.text
+    next_url = f"{client.base_url}/user/test?cursor="
+    cursor = response.text.split(next_url)[1].split('"')[0]
+
+    response = client.get("/user/test", params={"cursor": cursor})
+    assert "test title" in response.text
+    assert "newer" not in response.text
+    assert next_url not in response.text
+
+
+def test_stats_follow_writes(test_db):
+    """Creating and deleting posts keeps the author's stats up to date"""
+    post = crud.create_post(test_db, schemas.Post(title="new", body=""), 1)
+    author = crud.get_author(test_db, "test")
+    assert author.post_count == 2
+    assert author.last_posted_at > datetime(2018, 1, 1)
+
+    crud.delete_post(test_db, post.id)
+    author = crud.get_author(test_db, "test")
+    assert author.post_count == 1
+    assert author.last_posted_at == datetime(2018, 1, 1)
+
+    crud.delete_post(test_db, 1)
+    author = crud.get_author(test_db, "test")
+    assert author.post_count == 0
+    assert author.last_posted_at is None
+
+
+def test_repair(test_db, engine):
+    """repair recomputes stats that are out of date, and leaves the rest alone"""
+    test_db.execute(
+        "INSERT INTO post (title, body, author_id, created) "
+        "VALUES ('untracked', '', 2, '2022-02-02 00:00:00')"
+    )
+    test_db.execute("UPDATE user SET post_count = 5 WHERE id = 1")
+    test_db.commit()
+
+    assert author_stats.repair(engine) == 2
+    assert crud.get_author(test_db, "test").post_count == 1
+    other = crud.get_author(test_db, "other")
+    assert other.post_count == 2
+    assert other.last_posted_at == datetime(2022, 2, 2)
+    assert author_stats.repair(engine) == 0
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from fastr.db import crud, schemas
+from fastr.db.batching import WriteBatcher
+
+
+@pytest.fixture
+def batcher(engine):
+    return WriteBatcher(
+        sessionmaker(expire_on_commit=False, bind=engine), max_delay=0.05, max_size=10
+    )
+
+
+def titles(test_db):
+    test_db.expire_all()
+    return [post.title for post in crud.get_posts(test_db)]
+
+
+def test_concurrent_writes_commit_together(test_db, batcher):
+    async def write():
+        posts = [schemas.Post(title=f"p{i}", body="") for i in range(5)]
+        return await asyncio.gather(
+            *(batcher.submit(crud.create_post, post, 1) for post in posts)
+        )
+
+    posts = asyncio.run(write())
+    assert [post.title for post in posts] == [f"p{i}" for i in range(5)]
+    assert all(post.id is not None for post in posts)
+    assert {f"p{i}" for i in range(5)} <= set(titles(test_db))
+    assert batcher.stats() == {"batches": 1, "writes": 5, "max_batch_size": 5}
+
+
+def test_full_batch_is_committed_early(test_db, batcher):
+    batcher.max_delay = 10
+
+    async def write():
+        post = schemas.Post(title="", body="")
+        writes = (batcher.submit(crud.create_post, post, 1) for _ in range(10))
+        return await asyncio.wait_for(asyncio.gather(*writes), 1)
+
+    assert len(asyncio.run(write())) == 10
+    assert batcher.stats()["batches"] == 1
+
+
+def test_failed_write_only_fails_itself(test_db, batcher):
+    async def write():
+        return await asyncio.gather(
+            batcher.submit(crud.create_post, schemas.Post(title="kept", body=""), 1),
+            # there is no post 100
+            batcher.submit(
+                crud.update_post, schemas.PostUpdate(id=100, title="", body="")
+            ),
+            batcher.submit(crud.delete_post, 1),
+            return_exceptions=True,
+        )
+
+    created, failed, deleted = asyncio.run(write())
+    assert created.title == "kept"
+    assert isinstance(failed, AttributeError)
+    assert deleted is None
+    assert titles(test_db) == ["kept", "second post"]
+
+
+def test_routes_with_batching(client, auth, monkeypatch):
+    monkeypatch.setattr(client.app.state.settings, "write_batching", True)
+    auth.login()
+    client.post("/create", data={"title": "batched", "body": ""})
+    assert "batched" in client.get("/").text
+
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    client.post("/3/delete")
+    page = client.get("/").text
+    assert "updated" in page
+    assert "batched" not in page
+    assert client.app.state.database.write_batcher.stats()["writes"] >= 3
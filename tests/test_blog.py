@@ -1,5 +1,8 @@
+import re
+
 import pytest
 
+from fastr import blog, cache
 from fastr.db.crud import get_post_by_id
 
 
@@ -15,12 +18,67 @@ def test_index(client, auth):
     assert f'href="{client.base_url}/create">New</a>' in response.text
     assert "Log Out" in response.text
     assert "test title" in response.text
-    assert "by test on 2018-01-01" in response.text
+    about = f'by <a href="{client.base_url}/user/test">test</a> on 2018-01-01'
+    assert about in response.text
     assert "test\nbody" in response.text
     print(response.text)
     assert f'href="{client.base_url}/1/update"' in response.text
 
 
+@pytest.mark.parametrize("n_posts", (0, 50))
+def test_index_query_count(client, auth, test_db, count_queries, n_posts):
+    """The index page loads posts and their authors in a single query"""
+    for i in range(n_posts):
+        test_db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES (:title, '', :author_id)",
+            {"title": f"post {i}", "author_id": i % 2 + 1},
+        )
+    test_db.commit()
+
+    auth.login()
+    cache.invalidate_feed()  # logging in redirected to /, which cached the feed
+    with count_queries:
+        response = client.get("/")
+    assert response.status_code == 200
+    assert count_queries.count == 1
+
+
+def test_index_pagination(client, test_db, monkeypatch):
+    """Following the next links visits every post exactly once, newest first"""
+    monkeypatch.setattr(blog, "POSTS_PER_PAGE", 2)
+    # several posts share a timestamp, so the id has to break ties between them
+    for i in range(5):
+        test_db.execute(
+            "INSERT INTO post (title, body, author_id, created) "
+            "VALUES (:title, '', 1, '2020-06-01 12:00:00')",
+            {"title": f"tied post {i}"},
+        )
+    test_db.commit()
+
+    titles = []
+    url = "/"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        titles += re.findall(r"<h2><a [^>]*>(.*?)</a></h2>", response.text)
+        match = re.search(r'href="[^"]*(\?cursor=[^"]+)">Next</a>', response.text)
+        url = f"/{match.group(1)}" if match else None
+
+    assert titles == [
+        "second post",
+        "tied post 4",
+        "tied post 3",
+        "tied post 2",
+        "tied post 1",
+        "tied post 0",
+        "test title",
+    ]
+
+
+def test_index_invalid_cursor(client):
+    assert client.get("/?cursor=not-a-cursor").status_code == 400
+
+
 @pytest.mark.parametrize(
     "path",
     (
@@ -0,0 +1,80 @@
+import io
+import json
+
+import pytest
+
+from fastr import bulk
+from fastr.db import crud
+from fastr.hashing import make_context
+
+
+def test_round_trip(test_db, engine):
+    """An export imports back into an empty database unchanged"""
+    out = io.StringIO()
+    counts = bulk.export_ndjson(engine, out, batch_size=1)
+    assert counts == {"user": 2, "post": 2}
+    exported = out.getvalue()
+    assert json.loads(exported.splitlines()[2]) == {
+        "type": "post",
+        "id": 1,
+        "author_id": 1,
+        "created": "2018-01-01T00:00:00",
+        "title": "test title",
+        "body": "test\nbody",
+    }
+
+    test_db.execute("DELETE FROM post")
+    test_db.execute("DELETE FROM user")
+    test_db.commit()
+
+    counts = bulk.import_ndjson(io.StringIO(exported), engine, batch_size=3)
+    assert counts == {"user": 2, "post": 2}
+    out = io.StringIO()
+    bulk.export_ndjson(engine, out)
+    assert out.getvalue() == exported
+
+    # imported posts sort and paginate like ones created by the app
+    posts = crud.get_post_listings(test_db, limit=1)
+    assert [p.id for p in posts] == [2]
+    before = (posts[0].created, posts[0].id)
+    assert [p.id for p in crud.get_post_listings(test_db, before=before)] == [1]
+
+
+def test_import_plain_passwords(test_db, engine):
+    """Plain passwords are hashed, and missing ids and times are filled in"""
+    lines = [
+        '{"type": "user", "username": "new", "password": "secret"}',
+        "",
+        '{"type": "post", "author_id": 3, "title": "hello"}',
+    ]
+    bulk.import_ndjson(lines, engine, workers=1, rounds=4)
+
+    user = crud.get_user_by_username(test_db, "new")
+    assert user.id == 3
+    assert make_context(4).verify("secret", user.hashed_password)
+    post = crud.get_post_by_id(test_db, 3)
+    assert post.author_id == 3
+    assert post.body == ""
+    assert post.created is not None
+    # the author's post stats are brought up to date
+    assert crud.get_author(test_db, "new").post_count == 1
+
+
+@pytest.mark.parametrize(
+    ("line", "message"),
+    (
+        ("not json", "line 2: Expecting value"),
+        ('{"type": "comment"}', "line 2: unknown type 'comment'"),
+        ('{"type": "post", "title": "x"}', "line 2: missing 'author_id'"),
+        (
+            '{"type": "user", "username": "x", "hashed_password": "plain"}',
+            "line 2: hashed_password is not a supported password hash",
+        ),
+    ),
+)
+def test_import_invalid(test_db, engine, line, message):
+    """A bad line stops the import before its batch is written"""
+    lines = ['{"type": "user", "username": "new", "password": "secret"}', line]
+    with pytest.raises(bulk.InvalidRecord, match=message):
+        bulk.import_ndjson(lines, engine, workers=1, rounds=4)
+    assert crud.get_user_by_username(test_db, "new") is None
@@ -0,0 +1,134 @@
+import time
+
+from fastr import cache
+from fastr.db import crud
+from fastr.cache import LRUCache
+
+
+def test_lru_eviction():
+    c = LRUCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1  # "b" is now the least recently used
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+
+
+def test_lru_ttl():
+    c = LRUCache(maxsize=2, ttl=60)
+    c.set("a", 1, ttl=0.01)
+    c.set("b", 2)
+    time.sleep(0.02)
+    assert c.get("a") is None
+    assert c.get("b") == 2
+
+
+def test_set_feed_after_invalidation():
+    """A render that started before a write isn't cached after the invalidation"""
+    generation = cache.feed_generation()
+    cache.invalidate_feed()
+    cache.set_feed("key", "stale", generation)
+    assert cache.feed_cache.get("key") is None
+
+
+def test_index_cached(client, count_queries):
+    """Repeat views of the index are served from the cache"""
+    first = client.get("/")
+    with count_queries:
+        second = client.get("/")
+    assert count_queries.count == 0
+    assert second.text == first.text
+
+
+def test_index_not_modified(client, count_queries):
+    """Clients with the current ETag get a 304 without touching the database"""
+    etag = client.get("/").headers["ETag"]
+    with count_queries:
+        response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert count_queries.count == 0
+
+    assert client.get("/", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_index_last_modified(client):
+    """Clients sending only If-Modified-Since are validated by the render time"""
+    last_modified = client.get("/").headers["Last-Modified"]
+    response = client.get("/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    old = "Sat, 01 Jan 2000 00:00:00 GMT"
+    assert client.get("/", headers={"If-Modified-Since": old}).status_code == 200
+    # If-None-Match takes precedence
+    headers = {"If-Modified-Since": last_modified, "If-None-Match": '"other"'}
+    assert client.get("/", headers=headers).status_code == 200
+
+
+def test_post_page_not_modified(client, auth):
+    """The single post page is cached and validated like the index"""
+    response = client.get("/post/1")
+    assert "<h1>test title</h1>" in response.text
+    about = f'by <a href="{client.base_url}/user/test">test</a> on 2018-01-01'
+    assert about in response.text
+    etag = response.headers["ETag"]
+    assert client.get("/post/1", headers={"If-None-Match": etag}).status_code == 304
+
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    auth.logout()
+    response = client.get("/post/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "<h1>updated</h1>" in response.text
+
+    assert client.get("/post/3").status_code == 404
+
+
+def test_write_invalidates(client, auth):
+    """Creating, updating and deleting posts all show up on the next view"""
+    auth.login()
+    client.post("/create", data={"title": "created title", "body": ""})
+    assert "created title" in client.get("/").text
+
+    client.post("/1/update", data={"title": "updated title", "body": ""})
+    assert "updated title" in client.get("/").text
+
+    client.post("/1/delete")
+    assert "updated title" not in client.get("/").text
+
+
+def test_per_user_feed(client, auth):
+    """Edit links from a logged in user's feed aren't shown to anyone else"""
+    auth.login()
+    assert f'href="{client.base_url}/1/update"' in client.get("/").text
+
+    auth.logout()
+    assert f'href="{client.base_url}/1/update"' not in client.get("/").text
+
+    auth.login("other", "passWord1")
+    text = client.get("/").text
+    assert f'href="{client.base_url}/1/update"' not in text
+    assert f'href="{client.base_url}/2/update"' in text
+
+
+def test_user_cache(test_db, count_queries):
+    """User lookups by username are cached after the first query"""
+    hits = cache.user_cache.hits
+    with count_queries:
+        user = crud.get_user_by_username(test_db, "test")
+        assert crud.get_user_by_username(test_db, "test") == user
+    assert count_queries.count == 1
+    assert cache.user_cache.hits == hits + 1
+
+
+def test_user_cache_negative(client, test_db, count_queries):
+    """Unknown usernames are cached until the user registers"""
+    with count_queries:
+        assert crud.get_user_by_username(test_db, "new") is None
+        assert crud.get_user_by_username(test_db, "new") is None
+    assert count_queries.count == 1
+
+    client.post("/auth/register", data={"username": "new", "password": "a"})
+    assert crud.get_user_by_username(test_db, "new").username == "new"
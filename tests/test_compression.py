@@ -0,0 +1,82 @@
+import gzip
+import zlib
+
+import pytest
+
+from fastr import blog
+from fastr.compression import Compressor, brotli
+
+
+def add_posts(test_db, n=20):
+    """Enough posts to push the index over the compression threshold"""
+    for i in range(n):
+        test_db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES (:title, :body, 1)",
+            {"title": f"post {i}", "body": "some words to compress " * 10},
+        )
+    test_db.commit()
+
+
+def test_index_gzip(client, test_db):
+    add_posts(test_db)
+    plain = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Cookie, Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(plain.content) / 2
+    assert response.text == plain.text
+
+    # the ETag is weakened but still validates the page
+    etag = response.headers["etag"]
+    assert etag == "W/" + plain.headers["etag"]
+    headers = {"Accept-Encoding": "gzip", "If-None-Match": etag}
+    response = client.get("/", headers=headers)
+    assert response.status_code == 304
+    assert "content-encoding" not in response.headers
+
+
+def test_brotli(client, test_db):
+    if brotli is None:
+        pytest.skip("brotli isn't installed")
+    add_posts(test_db)
+    response = client.get("/", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_streamed_index(client, test_db, monkeypatch):
+    """Streamed responses are compressed as they are sent"""
+    add_posts(test_db, n=200)
+    expected = client.get("/", headers={"Accept-Encoding": "identity"}).text
+
+    monkeypatch.setattr(client.app.state.settings, "stream_index", True)
+    blog.cache.invalidate_feed()
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == expected
+
+
+def test_skipped(client, auth):
+    """Small responses and redirects are sent as they are"""
+    headers = {"Accept-Encoding": "gzip"}
+    assert "content-encoding" not in client.get("/hello", headers=headers).headers
+
+    auth.login()
+    response = client.get("/auth/logout", headers=headers, allow_redirects=False)
+    assert response.status_code == 302
+    assert "content-encoding" not in response.headers
+
+
+def test_compressor_flushes():
+    """Each part of a streamed body can be decoded as soon as it arrives"""
+    compressor = Compressor("gzip", gzip_level=5, brotli_quality=4)
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(compressor.compress(b"first ", finish=False)) == b"first "
+    last = compressor.compress(b"second", finish=True)
+    assert decoder.decompress(last) == b"second"
+    assert decoder.eof
+
+    whole = Compressor("gzip", gzip_level=5, brotli_quality=4)
+    assert gzip.decompress(whole.compress(b"body", finish=True)) == b"body"
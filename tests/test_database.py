@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from sqlalchemy.pool import QueuePool
+
+from fastr.config import Settings
+from fastr.db.database import create_async_db_engine, create_db_engine
+
+
+@pytest.fixture
+def production_settings(tmp_path) -> Settings:
+    return Settings(
+        database_path=str(tmp_path / "db.sqlite"),
+        sqlite_profile="production",
+        database_pool_size=3,
+        database_max_overflow=2,
+    )
+
+
+def test_production_profile(production_settings):
+    """The production profile sets the pragmas on connect and sizes the pool"""
+    engine = create_db_engine(production_settings)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        assert conn.exec_driver_sql("PRAGMA temp_store").scalar() == 2  # MEMORY
+
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 2
+    engine.dispose()
+
+
+def test_production_profile_async(production_settings):
+    async def run():
+        engine = create_async_db_engine(production_settings)
+        async with engine.connect() as conn:
+            result = await conn.exec_driver_sql("PRAGMA busy_timeout")
+            assert result.scalar() == 5000
+        await engine.dispose()
+
+    asyncio.run(run())
+
+
+def test_default_profile(tmp_path):
+    """The default profile leaves SQLite's own defaults alone"""
+    engine = create_db_engine(Settings(database_path=str(tmp_path / "db.sqlite")))
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
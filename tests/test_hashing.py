@@ -0,0 +1,137 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from fastr import auth, cache, tasks
+from fastr.db.crud import get_user_by_username
+from fastr.hashing import HasherBusy, PasswordHasher, calibrate, make_context
+
+
+@pytest.fixture
+def hasher():
+    h = PasswordHasher(workers=1, queue_limit=1, rounds=4)
+    yield h
+    h.shutdown()
+
+
+def test_hash_and_verify(hasher):
+    """Hashes made in the worker pool verify, and the work is recorded in the stats"""
+
+    async def run():
+        hashed = await hasher.hash("secret")
+        assert hashed.startswith("$2b$04$")
+        assert await hasher.verify("secret", hashed)
+        assert not await hasher.verify("wrong", hashed)
+
+    asyncio.run(run())
+    assert hasher.stats.count == 3
+    assert hasher.stats.hash_seconds > 0
+    assert hasher.stats.queue_seconds >= 0
+
+
+def test_queue_limit(hasher):
+    """Hashes beyond the workers plus the queue limit are rejected"""
+
+    async def run():
+        return await asyncio.gather(
+            *(hasher.hash("secret") for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert sum(isinstance(r, HasherBusy) for r in results) == 1
+    assert hasher.stats.rejected == 1
+    assert hasher.stats.count == 2
+
+
+def test_process_killed(hasher):
+    """The pool is replaced when one of its processes dies"""
+
+    async def run():
+        hashed = await hasher.hash("secret")
+        broken = hasher.executor
+        for pid in list(broken._processes):
+            os.kill(pid, signal.SIGKILL)
+        assert await hasher.verify("secret", hashed)
+        assert hasher.executor is not broken
+        assert await hasher.verify("secret", hashed)
+
+    asyncio.run(run())
+    assert hasher.stats.count == 3
+    assert hasher.stats.rejected == 0
+
+
+def test_login_busy(client, monkeypatch):
+    """Logins get a 503 with Retry-After when the hashing queue is full"""
+    # no capacity at all, so every hash is rejected
+    monkeypatch.setattr(auth.hasher, "queue_limit", 0)
+    monkeypatch.setattr(auth.hasher, "workers", 0)
+    response = client.post("/auth/login", data={"username": "test", "password": "a"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_needs_update(hasher):
+    """Hashes with another cost or scheme need updating"""
+    assert not hasher.needs_update(make_context(4).hash("secret"))
+    assert hasher.needs_update(make_context(5).hash("secret"))
+
+
+
+def login(client, username="test", password="test"):
+    response = client.post(
+        "/auth/login", data={"username": username, "password": password}
+    )
+    assert response.headers["location"] == "/"
+    # the rehash is a background task
+    client.portal.call(tasks.queue.join)
+
+
+def test_login_rehash(client, test_db):
+    """Logging in replaces a hash made with another cost, in the background"""
+    old = get_user_by_username(test_db, "test").hashed_password
+    assert old.startswith("$2b$12$")
+    rehashed = auth.hasher.stats.rehashed
+
+    login(client)
+    test_db.expire_all()
+    cache.user_cache.clear()
+    new = get_user_by_username(test_db, "test").hashed_password
+    assert new.startswith("$2b$04$")
+    assert make_context(4).verify("test", new)
+    assert auth.hasher.stats.rehashed == rehashed + 1
+
+    # the cached user was dropped, so the next login sees the new hash
+    login(client)
+    assert auth.hasher.stats.rehashed == rehashed + 1
+
+
+def test_rehash_disabled(client, test_db, monkeypatch):
+    monkeypatch.setattr(client.app.state.settings, "password_rehash", False)
+    login(client)
+    cache.user_cache.clear()
+    assert get_user_by_username(test_db, "test").hashed_password.startswith("$2b$12$")
+
+
+def test_rehash_argon2(client, test_db, monkeypatch):
+    """Switching the scheme moves users to it as they log in"""
+    pytest.importorskip("argon2")
+    policy = auth.hasher.policy._replace(
+        scheme="argon2", argon2_time_cost=1, argon2_memory_cost=1024
+    )
+    monkeypatch.setattr(auth.hasher, "policy", policy)
+    login(client)
+    cache.user_cache.clear()
+    new = get_user_by_username(test_db, "test").hashed_password
+    assert new.startswith("$argon2")
+    # still verifies after switching back
+    monkeypatch.undo()
+    login(client)
+
+
+def test_calibrate():
+    """Calibration stops once a cost takes twice the target"""
+    results = calibrate("bcrypt", target=0.000_001, runs=1)
+    assert [policy.rounds for policy, _ in results] == [4]
+    assert results[0][1] > 0
@@ -0,0 +1,180 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from fastr import live
+from fastr.compression import compressible
+from fastr.config import Settings
+from fastr.db.database import Database
+from fastr.db.pagination import decode_cursor, encode_cursor
+from fastr.live import Broadcaster, make_event
+
+
+FIRST = (datetime(2018, 1, 1), 1)
+SECOND = (datetime(2021, 10, 27, 1, 2, 3), 2)
+
+
+@pytest.fixture
+def database(test_db):
+    database = Database(Settings())
+    yield database
+    asyncio.run(database.close())
+
+
+@pytest.fixture
+def subscriber():
+    # forget the posts published in other tests
+    live.broadcaster.newest = None
+    subscriber = live.broadcaster.subscribe()
+    yield subscriber
+    live.broadcaster.unsubscribe(subscriber)
+
+
+def parse(message: bytes) -> dict:
+    """The fields of a server-sent event"""
+    lines = message.decode().strip().splitlines()
+    fields = dict(line.split(": ", 1) for line in lines)
+    fields["data"] = json.loads(fields["data"])
+    return fields
+
+
+def collect(stream, n):
+    """The first n messages of a stream, after the retry interval"""
+
+    async def run():
+        assert await stream.__anext__() == live.RETRY
+        messages = [await stream.__anext__() for _ in range(n)]
+        await stream.aclose()
+        return messages
+
+    return asyncio.run(run())
+
+
+def test_broadcast():
+    """Events go to every client, and clients that fall behind are dropped"""
+    broadcaster = Broadcaster(buffer_size=2, max_clients=10, keepalive=15)
+    fast, slow = broadcaster.subscribe(), broadcaster.subscribe()
+
+    for i in range(3):
+        broadcaster.publish(make_event("deleted", {"id": i}))
+        fast.events.popleft()
+    assert slow.dropped and not fast.dropped
+    assert broadcaster.subscribers == {fast}
+    assert broadcaster.stats() == {
+        "clients": 1,
+        "published": 3,
+        "dropped": 1,
+        "rejected": 0,
+    }
+    assert asyncio.run(slow.next(timeout=1)) is None
+
+
+def test_created_once():
+    """Each created post is published once, in order"""
+    broadcaster = Broadcaster(buffer_size=10, max_clients=10, keepalive=15)
+    subscriber = broadcaster.subscribe()
+    for key in (FIRST, SECOND, FIRST, SECOND):
+        broadcaster.publish(make_event("created", {}, key))
+    assert [event.key for event in subscriber.events] == [FIRST, SECOND]
+
+
+def test_keepalive():
+    broadcaster = Broadcaster(buffer_size=10, max_clients=10, keepalive=15)
+    assert asyncio.run(broadcaster.subscribe().next(timeout=0.01)) is None
+
+
+def test_publish_from_routes(client, auth, subscriber):
+    """Creating, updating and deleting posts sends events to connected clients"""
+    auth.login()
+    client.post("/create", data={"title": "created", "body": "new"})
+    client.post("/3/update", data={"title": "updated", "body": ""})
+    client.post("/3/delete")
+
+    created, updated, deleted = [parse(e.message) for e in subscriber.events]
+    assert created["event"] == "created"
+    assert created["data"]["title"] == "created"
+    assert created["data"]["username"] == "test"
+    assert decode_cursor(created["id"])[1] == created["data"]["id"] == 3
+    assert updated["event"] == "updated"
+    assert updated["data"]["title"] == "updated"
+    assert "id" not in updated
+    assert deleted == {"event": "deleted", "data": {"id": 3}}
+
+
+def test_stream(database):
+    """A stream sends the events published while it is open"""
+    stream = live._stream(database, after=None)
+
+    async def run():
+        assert await stream.__anext__() == live.RETRY
+        live.broadcaster.publish(make_event("deleted", {"id": 1}))
+        message = await stream.__anext__()
+        await stream.aclose()
+        return message
+
+    assert parse(asyncio.run(run())) == {"event": "deleted", "data": {"id": 1}}
+    assert not live.broadcaster.subscribers
+
+
+def test_resume(database):
+    """A client that reconnects is sent the posts it missed first"""
+    (message,) = collect(live._stream(database, after=FIRST), 1)
+    event = parse(message)
+    assert event["data"]["title"] == "second post"
+    assert decode_cursor(event["id"]) == SECOND
+
+
+def test_resume_too_far(database, monkeypatch):
+    """A client that missed too many posts is told to reload the page"""
+    monkeypatch.setattr(live, "BACKLOG_SIZE", 1)
+    stream = live._stream(database, after=(datetime(2000, 1, 1), 0))
+    assert collect(stream, 1) == [live.RESET]
+
+
+def test_poll(test_db, database, subscriber, monkeypatch):
+    """Posts created by other processes are found by polling"""
+    monkeypatch.setattr(live.broadcaster, "database", database)
+    asyncio.run(live.broadcaster.poll())
+    assert live.broadcaster.newest == SECOND
+    test_db.execute("INSERT INTO post (title, body, author_id) VALUES ('other', '', 1)")
+    test_db.commit()
+
+    asyncio.run(live.broadcaster.poll())
+    (event,) = subscriber.events
+    assert parse(event.message)["data"]["title"] == "other"
+    asyncio.run(live.broadcaster.poll())
+    assert len(subscriber.events) == 1
+
+
+def test_invalid_last_event_id(client):
+    response = client.get("/feed/stream", headers={"Last-Event-ID": "nope"})
+    assert response.status_code == 400
+
+
+def test_too_many_clients(client, monkeypatch):
+    monkeypatch.setattr(live.broadcaster, "max_clients", 0)
+    response = client.get("/feed/stream")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "10"
+
+
+def test_not_compressed():
+    start = {
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8")],
+    }
+    assert not compressible(start, min_size=0)
+
+
+def test_index_links_stream(client):
+    """The first page of the index connects to the stream, after its newest post"""
+    page = client.get("/").text
+    assert 'data-stream="http://testserver/feed/stream"' in page
+    assert f'data-cursor="{encode_cursor(*SECOND)}"' in page
+    assert "live" in page and ".js" in page
+
+    other_page = client.get("/", params={"cursor": encode_cursor(*SECOND)}).text
+    assert "data-stream" not in other_page
@@ -0,0 +1,77 @@
+import logging
+import re
+
+from fastapi.testclient import TestClient
+
+from fastr import cache, metrics, templating
+from fastr.config import Settings
+from fastr.main import create_app
+from fastr.metrics import Histogram
+
+
+def server_timing(response) -> dict:
+    """Parse a Server-Timing header into {name: duration}"""
+    header = response.headers["Server-Timing"]
+    return {
+        m.group(1): float(m.group(2))
+        for m in re.finditer(r"(\w+);dur=([\d.]+)", header)
+    }
+
+
+def test_server_timing(client, auth):
+    """Responses report the time spent on SQL, rendering and password hashing"""
+    response = client.get("/")
+    assert 'desc="1 queries"' in response.headers["Server-Timing"]
+    assert server_timing(response)["render"] > 0
+
+    response = auth.login()
+    assert server_timing(response.history[0])["hash"] > 0
+
+
+def test_generate_render_time():
+    """Rendering a template piece by piece, as streamed pages do, is timed too"""
+    timings = metrics.RequestTimings()
+    token = metrics._current.set(timings)
+    try:
+        env = templating.templates.env
+        template = env.from_string("{% for i in x %}{{ i }}{% endfor %}")
+        chunks = template.generate(x=range(1000))
+        assert timings.render_seconds == 0
+        "".join(chunks)
+    finally:
+        metrics._current.reset(token)
+    assert timings.render_seconds > 0
+
+
+def test_metrics_page(client):
+    client.get("/")
+    text = client.get("/metrics").text
+    assert 'fastr_request_duration_seconds_count{route="index"}' in text
+    assert 'fastr_request_sql_statements_bucket{route="index",le="1"}' in text
+    assert "fastr_feed_cache_hits" in text
+    assert "fastr_password_hash_count" in text
+
+
+def test_slow_query_log(client, caplog):
+    """Statements slower than the threshold are logged"""
+    caplog.set_level(logging.WARNING, logger="fastr.slow_query")
+    client.get("/")
+    assert not caplog.records
+
+    cache.invalidate_feed()
+    with TestClient(create_app(Settings(slow_query_ms=0))) as slow_client:
+        slow_client.get("/")
+    assert "slow query" in caplog.text
+    assert "FROM post JOIN user" in caplog.text
+
+
+def test_histogram():
+    histogram = Histogram("test_seconds", "Test.", buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe("index", value)
+    lines = list(histogram.render())
+    assert 'test_seconds_bucket{route="index",le="1"} 2' in lines
+    assert 'test_seconds_bucket{route="index",le="5"} 3' in lines
+    assert 'test_seconds_bucket{route="index",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{route="index"} 14.5' in lines
+    assert 'test_seconds_count{route="index"} 4' in lines
@@ -0,0 +1,157 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from fastr import cache, live, tasks, templating
+from fastr.config import Settings
+from fastr.db import crud, migrations
+from fastr.db.database import create_db_engine
+from fastr.hashing import hasher
+from fastr.main import create_app
+
+# the schema from before migrations were versioned
+OLD_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR NOT NULL UNIQUE,
+    hashed_password VARCHAR NOT NULL
+);
+CREATE TABLE post (
+    id INTEGER NOT NULL PRIMARY KEY,
+    author_id INTEGER REFERENCES user (id),
+    created DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL,
+    title VARCHAR NOT NULL,
+    body VARCHAR NOT NULL
+);
+INSERT INTO user (username, hashed_password) VALUES ('old', 'x');
+INSERT INTO post (title, body, author_id, created)
+VALUES ('old post', 'from before', 1, '2019-05-05 00:00:00');
+"""
+
+
+def version(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_new_database(engine):
+    """A new database gets the latest schema"""
+    assert migrations.migrate(engine) == (migrations.LATEST_VERSION,) * 2
+    migrations.check(engine)
+
+
+def test_migrate_unversioned(tmp_path):
+    """A database from before versioning gets the missing tables, columns and data"""
+    path = str(tmp_path / "old.sqlite")
+    with sqlite3.connect(path) as db:
+        db.executescript(OLD_SCHEMA)
+    old_engine = create_db_engine(Settings(database_path=path))
+
+    with pytest.raises(migrations.SchemaVersionError):
+        migrations.check(old_engine)
+    assert migrations.migrate(old_engine) == (0, migrations.LATEST_VERSION)
+    migrations.check(old_engine)
+
+    db = Session(bind=old_engine)
+    author = crud.get_author(db, "old")
+    assert author.post_count == 1
+    assert [post.title for post, _ in crud.search_posts(db, "before")] == ["old post"]
+    assert db.execute("SELECT count(*) FROM session").scalar() == 0
+    db.close()
+    old_engine.dispose()
+
+
+def schema(path):
+    """The tables and triggers in a database, with each table's columns"""
+    # not the indexes: OLD_SCHEMA has a UNIQUE constraint where create_all has indexes
+    with sqlite3.connect(path) as db:
+        names = db.execute(
+            "SELECT type, name FROM sqlite_master WHERE type != 'index'"
+        ).fetchall()
+        tables = [name for type, name in names if type == "table"]
+        columns = {
+            table: {row[1] for row in db.execute(f"PRAGMA table_info('{table}')")}
+            for table in tables
+        }
+    return set(names), columns
+
+
+def test_migrated_schema_matches_new(tmp_path):
+    """Migrating a database from before versioning gives the same schema as a new one"""
+    old_path, new_path = str(tmp_path / "old.sqlite"), str(tmp_path / "new.sqlite")
+    with sqlite3.connect(old_path) as db:
+        db.executescript(OLD_SCHEMA)
+    for path in (old_path, new_path):
+        engine = create_db_engine(Settings(database_path=path))
+        migrations.migrate(engine)
+        engine.dispose()
+    assert schema(old_path) == schema(new_path)
+
+
+def test_newer_database(test_db, engine):
+    """Code older than the database doesn't touch it"""
+    test_db.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    with pytest.raises(migrations.SchemaVersionError):
+        migrations.migrate(engine)
+
+
+def test_app_checks_version(test_db, engine):
+    """The app won't start on a database that hasn't been migrated"""
+    test_db.execute("PRAGMA user_version = 1")
+    with pytest.raises(migrations.SchemaVersionError, match="fastr.db.migrations"):
+        with TestClient(create_app()):
+            pass
+
+    migrations.migrate(engine)
+    with TestClient(create_app()) as client:
+        assert client.get("/hello").status_code == 200
+
+
+def test_create_app(test_db):
+    """create_app builds an app with the given settings"""
+    headers = {"Accept-Encoding": "gzip"}
+    with TestClient(create_app(Settings(compression_enabled=False))) as client:
+        assert "Content-Encoding" not in client.get("/", headers=headers).headers
+    with TestClient(create_app(Settings(compression_enabled=True))) as client:
+        assert client.get("/", headers=headers).headers["Content-Encoding"] == "gzip"
+
+
+def test_create_app_shared(test_db):
+    """create_app configures the objects shared by the process when it starts"""
+    settings = Settings(
+        feed_cache_size=7,
+        user_cache_negative_ttl=1,
+        bcrypt_rounds=5,
+        task_max_attempts=2,
+        feed_stream_keepalive=3,
+        template_auto_reload=True,
+    )
+    with TestClient(create_app(settings)):
+        assert cache.feed_cache.maxsize == 7
+        assert cache.user_negative_ttl == 1
+        assert hasher.policy.rounds == 5
+        assert tasks.queue.max_attempts == 2
+        assert live.broadcaster.keepalive == 3
+        assert templating.templates.env.auto_reload
+
+    # the next app to start sets them back
+    with TestClient(create_app()):
+        assert cache.feed_cache.maxsize == Settings().feed_cache_size
+        assert hasher.policy.rounds == 4
+
+
+def test_create_app_database(test_db, tmp_path):
+    """create_app connects to the database in its settings"""
+    path = str(tmp_path / "other.sqlite")
+    with sqlite3.connect(path) as db:
+        db.executescript(OLD_SCHEMA)
+    other_engine = create_db_engine(Settings(database_path=path))
+    migrations.migrate(other_engine)
+    other_engine.dispose()
+
+    with TestClient(create_app(Settings(database_path=path))) as client:
+        page = client.get("/").text
+    assert "old post" in page
+    assert "test title" not in page
@@ -0,0 +1,86 @@
+import pytest
+
+from fastr.hashing import hasher
+from fastr.auth import LoginLimits
+from fastr.ratelimit import (
+    MemoryRateLimitStore,
+    RateLimiter,
+    SQLiteRateLimitStore,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, engine):
+    if request.param == "memory":
+        return MemoryRateLimitStore()
+    return SQLiteRateLimitStore(engine)
+
+
+def test_bucket(store):
+    """A bucket allows a burst, then refills one token per interval"""
+    # 3 tokens, one every 10 seconds
+    take = lambda key, now: store.take(key, 10, 30, now)  # noqa: E731
+    assert [take("a", 100) for _ in range(3)] == [0, 0, 0]
+    assert take("a", 100) == 10
+    assert take("a", 104) == 6
+    # other keys have their own buckets
+    assert take("b", 104) == 0
+
+    assert take("a", 110) == 0
+    assert take("a", 110) == 10
+    assert take("a", 200) == 0
+
+
+def test_evict(store):
+    """Buckets are evicted once they have refilled"""
+    store.take("a", 10, 30, 100)
+    store.take("b", 10, 30, 100)
+    store.take("b", 10, 30, 100)
+    assert store.evict(110) == 1
+    assert store.evict(120) == 1
+    assert store.evict(1000) == 0
+
+
+@pytest.fixture
+def limiters(client) -> LoginLimits:
+    """Allow two attempts per username and five per IP"""
+    store = MemoryRateLimitStore()
+    limits = LoginLimits(
+        ip=RateLimiter(store, "ip:", 5, 1),
+        username=RateLimiter(store, "user:", 2, 1),
+    )
+    client.app.state.login_limits = limits
+    return limits
+
+
+def test_login_rate_limit(client, limiters):
+    """Attempts over the limit get a 429 without any bcrypt work"""
+    for _ in range(2):
+        response = client.post(
+            "/auth/login", data={"username": "test", "password": "wrong"}
+        )
+        assert response.status_code == 302
+
+    hashes = hasher.stats.count
+    response = client.post("/auth/login", data={"username": "TEST", "password": "a"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) in (59, 60)
+    assert hasher.stats.count == hashes
+
+    # other usernames aren't limited, until the IP runs out too. The rejected attempt
+    # still took one of its tokens.
+    for username in ("a", "b"):
+        response = client.post(
+            "/auth/register", data={"username": username, "password": "a"}
+        )
+        assert response.status_code == 302
+    response = client.post("/auth/login", data={"username": "c", "password": "a"})
+    assert response.status_code == 429
+    assert limiters.ip.stats() == {"allowed": 5, "rejected": 1}
+
+
+def test_rate_limit_disabled(client, limiters, monkeypatch):
+    monkeypatch.setattr(client.app.state.settings, "login_rate_limit", False)
+    for _ in range(3):
+        response = client.post("/auth/login", data={"username": "x", "password": "a"})
+        assert response.status_code == 302
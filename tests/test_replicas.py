@@ -0,0 +1,120 @@
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from fastr import cache
+from fastr.config import Settings
+from fastr.db.database import create_replica_engine
+from fastr.db.replicas import ReplicaSet
+
+
+settings = Settings()
+
+
+def replicate(replica_path):
+    """Copy the primary database to the replica, like a replication tool would"""
+    with sqlite3.connect(settings.database_path) as primary:
+        with sqlite3.connect(replica_path) as replica:
+            primary.backup(replica)
+
+
+@pytest.fixture
+def replica_path(client, tmp_path, monkeypatch):
+    """A replica that is up to date with the test database, and used for reads"""
+    path = str(tmp_path / "replica.sqlite")
+    database = client.app.state.database
+    replica_set = ReplicaSet(
+        database.engine,
+        [create_replica_engine(f"sqlite:///{path}", settings)],
+        max_lag=5,
+    )
+    monkeypatch.setattr(database, "replicas", replica_set)
+
+    replica_set.check()  # writes the heartbeat
+    replicate(path)
+    replica_set.check()
+    assert replica_set.choose() is not None
+    yield path
+    replica_set.replicas[0].engine.dispose()
+
+
+def add_post(test_db, title):
+    """Add a post to the primary only"""
+    test_db.execute(
+        "INSERT INTO post (title, body, author_id) VALUES (:title, '', 1)",
+        {"title": title},
+    )
+    test_db.commit()
+    cache.invalidate_feed()
+
+
+def titles(client):
+    return [post["title"] for post in client.get("/api/v1/posts").json()["posts"]]
+
+
+def test_reads_use_replica(client, test_db, replica_path):
+    add_post(test_db, "not replicated")
+    assert "not replicated" not in titles(client)
+
+    replicate(replica_path)
+    cache.invalidate_feed()
+    assert "not replicated" in titles(client)
+
+
+def test_replica_reads_not_cached(client, test_db, replica_path):
+    """Pages rendered from a replica that hasn't caught up aren't cached"""
+    add_post(test_db, "not replicated")
+    assert "not replicated" not in client.get("/").text
+    assert "not replicated" not in titles(client)
+
+    replicate(replica_path)
+    assert "not replicated" in client.get("/").text
+    assert "not replicated" in titles(client)
+
+
+def test_read_your_writes(client, auth, replica_path, monkeypatch):
+    """After a POST, the user's reads go to the primary for a while"""
+    auth.login()
+    response = client.post(
+        "/create", data={"title": "my new post", "body": ""}, allow_redirects=True
+    )
+    assert "my new post" in response.text
+    assert "my new post" in titles(client)
+
+    monkeypatch.setattr(client.app.state.settings, "read_your_writes_seconds", 0)
+    cache.invalidate_feed()
+    assert "my new post" not in titles(client)
+
+
+def test_lagging_replica(client, test_db, replica_path):
+    """A replica whose heartbeat is too old stops getting reads"""
+    with sqlite3.connect(replica_path) as replica:
+        replica.execute("UPDATE replica_heartbeat SET updated = ?", (time.time() - 60,))
+    replicas = client.app.state.database.replicas
+    replicas.check()
+    assert replicas.choose() is None
+    assert replicas.stats()["healthy"] == 0
+    assert replicas.stats()["max_lag_seconds"] >= 60
+
+    add_post(test_db, "not replicated")
+    assert "not replicated" in titles(client)
+
+
+def test_unreachable_replica(engine, tmp_path):
+    replica_set = ReplicaSet(
+        engine,
+        [create_replica_engine(f"sqlite:///{tmp_path}/missing/db.sqlite", settings)],
+        max_lag=5,
+    )
+    replica_set.check()
+    assert replica_set.choose() is None
+    assert replica_set.stats() == {"count": 1, "healthy": 0, "max_lag_seconds": 0}
+
+
+def test_replica_is_read_only(client, replica_path):
+    replica = client.app.state.database.replicas.replicas[0].engine
+    with pytest.raises(OperationalError, match="readonly"):
+        with replica.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM post")
@@ -0,0 +1,103 @@
+import re
+
+import pytest
+
+from fastr.db import crud, fts, schemas
+from fastr.db.pagination import decode_rank_cursor, encode_rank_cursor
+from fastr.templating import highlight
+
+
+def test_search(client):
+    """Search finds posts by title and body, with the matched words highlighted"""
+    response = client.get("/search", params={"q": "second"})
+    assert response.status_code == 200
+    assert "<mark>second</mark> post" in response.text
+    assert "<mark>second</mark> body" in response.text
+    about = f'by <a href="{client.base_url}/user/other">other</a> on 2021-10-27'
+    assert about in response.text
+    assert "test title" not in response.text
+
+
+def test_search_all_words(test_db):
+    """Every word in the query has to match"""
+    assert [post.id for post, _ in crud.search_posts(test_db, "test")] == [1]
+    assert crud.search_posts(test_db, "test second") == []
+
+
+@pytest.mark.parametrize(
+    "q", ("", "   ", 'title"', "test OR second", "NEAR(a b)", "\x00", "\x00 \x1f")
+)
+def test_search_user_syntax(client, q):
+    """FTS5 syntax in the query is matched literally instead of being an error"""
+    response = client.get("/search", params={"q": q})
+    assert response.status_code == 200
+    assert "second body" not in response.text
+
+
+def test_search_control_characters(test_db):
+    """Control characters are removed from the words instead of reaching FTS5"""
+    assert [post.id for post, _ in crud.search_posts(test_db, "sec\x00ond")] == [2]
+
+
+def test_search_escapes_html(test_db):
+    """Post text is escaped before the matches are marked"""
+    crud.create_post(test_db, schemas.Post(title="<b>bold</b>", body=""), user_id=1)
+
+    [(post, _)] = crud.search_posts(test_db, "bold")
+    assert highlight(post.title) == "&lt;b&gt;<mark>bold</mark>&lt;/b&gt;"
+
+
+def test_search_index_sync(test_db):
+    """The index follows posts as they are created, updated and deleted"""
+    crud.create_post(test_db, schemas.Post(title="apple", body="pie"), user_id=1)
+    [(post, _)] = crud.search_posts(test_db, "apple")
+
+    crud.update_post(test_db, schemas.PostUpdate(id=post.id, title="pear", body="pie"))
+    assert crud.search_posts(test_db, "apple") == []
+    assert len(crud.search_posts(test_db, "pear")) == 1
+
+    crud.delete_post(test_db, post.id)
+    assert crud.search_posts(test_db, "pie") == []
+
+
+def test_search_pagination(client, test_db):
+    """Following the Next links visits every match once, best matches first"""
+    for i in range(45):
+        test_db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES (:title, :body, 1)",
+            {"title": f"page {i}", "body": "word " * (i % 7 + 1)},
+        )
+    test_db.commit()
+
+    results = crud.search_posts(test_db, "page")
+    expected = [highlight(post.title) for post, _ in results]
+    assert len(expected) == 45
+
+    seen, params = [], {"q": "page"}
+    while True:
+        response = client.get("/search", params=params)
+        seen += re.findall(r"<h2><a [^>]*>(.*?)</a></h2>", response.text)
+        if "Next</a>" not in response.text:
+            break
+        params["cursor"] = re.search(r"cursor=([\w-]+)", response.text).group(1)
+    assert seen == expected
+
+
+def test_search_invalid_cursor(client):
+    response = client.get("/search", params={"q": "test", "cursor": "nope"})
+    assert response.status_code == 400
+
+
+def test_rank_cursor_round_trip():
+    rank = -1.9447513812154696e-06
+    assert decode_rank_cursor(encode_rank_cursor(rank, 7)) == (rank, 7)
+
+
+def test_reindex(test_db, engine):
+    """reindex rebuilds an index that is missing or out of sync"""
+    test_db.execute("INSERT INTO post_fts (post_fts) VALUES ('delete-all')")
+    test_db.commit()
+    assert crud.search_posts(test_db, "test") == []
+
+    fts.reindex(engine)
+    assert len(crud.search_posts(test_db, "test")) == 1
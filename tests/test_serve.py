@@ -0,0 +1,71 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from fastr import serve
+from fastr.config import Settings
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_available_cpus():
+    assert 1 <= serve.available_cpus() <= os.cpu_count()
+
+
+def test_warm_up_failure(monkeypatch):
+    """A worker that can't warm up exits with the code that stops the supervisor"""
+
+    def fail(app):
+        raise OSError("database unreachable")
+
+    monkeypatch.setattr(serve, "warm_up", fail)
+    with socket.socket() as sock, pytest.raises(SystemExit) as exc_info:
+        serve.run_worker(sock, max_requests=None, access_log=False)
+    assert exc_info.value.code == serve.STARTUP_FAILED
+
+
+def test_workers_are_replaced(test_db):
+    """Workers serve the app, and are replaced after their request limit"""
+    port = free_port()
+    env = {
+        **os.environ,
+        "FASTR_DATABASE_PATH": Settings().database_path,
+        "FASTR_SERVE_MAX_REQUESTS": "3",
+        "FASTR_SERVE_MAX_REQUESTS_JITTER": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "fastr.serve", "--port", str(port), "--workers", "1"],
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/"
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(url)
+                break
+            except httpx.TransportError:
+                assert time.time() < deadline, "server didn't start"
+                time.sleep(0.1)
+
+        for _ in range(8):
+            response = httpx.get(url)
+            assert response.status_code == 200
+            assert "test title" in response.text
+    finally:
+        server.terminate()
+        _, log = server.communicate(timeout=30)
+
+    assert server.returncode == 0
+    assert "exited with code 0, replacing it" in log
@@ -0,0 +1,121 @@
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from fastr.sessions import (
+    MemorySessionStore,
+    SQLiteSessionStore,
+    ServerSessionMiddleware,
+)
+
+
+class CountingStore(MemorySessionStore):
+    """Memory store that counts how often sessions are written"""
+
+    def __init__(self):
+        super().__init__()
+        self.saves = 0
+
+    def save(self, session_id, data, max_age):
+        self.saves += 1
+        super().save(session_id, data, max_age)
+
+
+def make_client(store) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(ServerSessionMiddleware, store=store)
+
+    @app.get("/get")
+    def get(request: Request):
+        return request.session
+
+    @app.post("/set")
+    def set(request: Request, key: str, value: str):
+        request.session[key] = value
+
+    @app.post("/clear")
+    def clear(request: Request):
+        request.session.clear()
+
+    return TestClient(app)
+
+
+def test_cookie_holds_session_id():
+    """Only the session id goes in the cookie, and the data stays on the server"""
+    store = CountingStore()
+    client = make_client(store)
+    response = client.post("/set", params={"key": "a", "value": "x" * 1000})
+    session_id = response.cookies["session"]
+    assert len(session_id) < 50
+    assert store.load(session_id) == {"a": "x" * 1000}
+    assert client.get("/get").json() == {"a": "x" * 1000}
+
+
+def test_unmodified_session_not_written():
+    """Requests that don't change the session don't write it or set a cookie"""
+    store = CountingStore()
+    client = make_client(store)
+    client.post("/set", params={"key": "a", "value": "1"})
+    assert store.saves == 1
+
+    response = client.get("/get")
+    assert "set-cookie" not in response.headers
+    assert store.saves == 1
+
+    client.post("/set", params={"key": "a", "value": "2"})
+    assert store.saves == 2
+
+
+def test_cookie_refreshed_on_save():
+    """The cookie is sent again whenever the session is saved, so it doesn't expire
+    before the stored session"""
+    client = make_client(MemorySessionStore())
+    first = client.post("/set", params={"key": "a", "value": "1"})
+    second = client.post("/set", params={"key": "a", "value": "2"})
+    assert second.cookies["session"] == first.cookies["session"]
+    assert "Max-Age=1209600" in second.headers["set-cookie"]
+
+
+def test_new_id_on_login():
+    """A new session id is issued when the logged in user changes"""
+    client = make_client(MemorySessionStore())
+    first = client.post("/set", params={"key": "flashes", "value": "hi"})
+    second = client.post("/set", params={"key": "user", "value": "test"})
+    assert second.cookies["session"] != first.cookies["session"]
+    assert client.get("/get").json() == {"flashes": "hi", "user": "test"}
+
+
+def test_clear_session():
+    store = MemorySessionStore()
+    client = make_client(store)
+    response = client.post("/set", params={"key": "a", "value": "1"})
+    session_id = response.cookies["session"]
+    client.post("/clear")
+    assert store.load(session_id) is None
+    assert client.get("/get").json() == {}
+
+
+def test_sqlite_store(engine):
+    """Sessions are kept in the database and expired ones are reaped in batches"""
+    store = SQLiteSessionStore(engine, reap_batch_size=2)
+    client = make_client(store)
+    client.post("/set", params={"key": "a", "value": "1"})
+    assert client.get("/get").json() == {"a": "1"}
+
+    for i in range(5):
+        store.save(f"expired{i}", {"a": i}, max_age=-1)
+    assert store.load("expired0") is None
+    assert store.reap() == 5
+    assert client.get("/get").json() == {"a": "1"}
+
+
+@pytest.mark.parametrize("store", [MemorySessionStore(), "sqlite"])
+def test_session_expires(engine, store):
+    if store == "sqlite":
+        store = SQLiteSessionStore(engine)
+    store.save("session", {"a": 1}, max_age=0.01)
+    assert store.load("session") == {"a": 1}
+    time.sleep(0.02)
+    assert store.load("session") is None
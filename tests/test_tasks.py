@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import pytest
+
+from fastr import cache, tasks
+from fastr.tasks import TaskQueue
+
+
+def make_queue(**kwargs) -> TaskQueue:
+    kwargs = {"workers": 1, "max_attempts": 3, "retry_delay": 0.01, **kwargs}
+    return TaskQueue(**kwargs)
+
+
+def test_run_in_order():
+    """Tasks run in the background, in order, whether they are async or not"""
+    queue = make_queue()
+    done = []
+
+    @queue.task()
+    async def async_task(x):
+        done.append(x)
+
+    @queue.task()
+    def sync_task(x):
+        done.append(x)
+
+    async def run():
+        queue.start()
+        await queue.enqueue(async_task, 1)
+        await queue.enqueue(sync_task, 2)
+        await queue.enqueue(async_task, 3)
+        assert queue.stats()["depth"] == 3
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert done == [1, 2, 3]
+    stats = queue.stats()
+    assert stats["completed"] == 3
+    assert stats["depth"] == 0
+    assert stats["max_lag_seconds"] > 0
+
+
+def test_not_running():
+    """Without workers, tasks run as they are enqueued"""
+    queue = make_queue()
+    done = []
+    queue.task()(done.append)
+    asyncio.run(queue.enqueue(done.append, 1))
+    assert done == [1]
+
+
+def test_unregistered():
+    with pytest.raises(ValueError, match="isn't registered"):
+        asyncio.run(make_queue().enqueue(print, 1))
+
+
+def test_retry():
+    """Failed tasks are retried after a delay that doubles each time"""
+    queue = make_queue(max_attempts=3)
+    attempts = []
+
+    @queue.task()
+    def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise RuntimeError("try again")
+
+    async def run():
+        queue.start()
+        await queue.enqueue(flaky)
+        await asyncio.sleep(0.2)
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert len(attempts) == 3
+    assert attempts[2] - attempts[1] > attempts[1] - attempts[0] >= 0.01
+    assert queue.stats()["retried"] == 2
+    assert queue.stats()["completed"] == 1
+
+
+def test_give_up():
+    queue = make_queue(max_attempts=2)
+    attempts = []
+
+    @queue.task()
+    def broken():
+        attempts.append(1)
+        raise RuntimeError("broken")
+
+    async def run():
+        queue.start()
+        await queue.enqueue(broken)
+        await asyncio.sleep(0.1)
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+    assert queue.stats()["failed"] == 1
+
+
+def test_drain():
+    """Stopping runs the queued tasks first, within the timeout"""
+    queue = make_queue()
+    done = []
+
+    @queue.task()
+    async def slow(x):
+        await asyncio.sleep(0.01)
+        done.append(x)
+
+    async def run():
+        queue.start()
+        for x in range(5):
+            await queue.enqueue(slow, x)
+        await queue.stop(timeout=1)
+        assert not queue.running
+
+    asyncio.run(run())
+    assert done == [0, 1, 2, 3, 4]
+
+
+def test_feed_warmup(client, auth, count_queries):
+    """After a post is written, the index is rendered for the next visitor"""
+    auth.login()
+    client.post("/create", data={"title": "new", "body": ""})
+    client.portal.call(tasks.queue.join)
+    page = cache.feed_cache.get(("page", str(client.base_url) + "/", None))
+    assert b"new" in page.body
+
+    auth.logout()
+    with count_queries:
+        assert b"new" in client.get("/").content
+    assert count_queries.count == 0
+
+
+def test_metrics(client):
+    text = client.get("/metrics").text
+    assert "fastr_tasks_depth 0" in text
+    assert "fastr_tasks_lag_seconds" in text
@@ -0,0 +1,39 @@
+from fastr import auth, blog, templating
+
+
+def test_shared_environment():
+    """All views render with the same Jinja environment"""
+    assert auth.templates is blog.templates is templating.templates
+    assert templating.templates.env.bytecode_cache is not None
+
+
+def test_precompile_templates(monkeypatch):
+    """Every template is compiled and cached by precompile_templates"""
+    env = templating.templates.env
+    monkeypatch.setattr(env, "cache", {})
+    templating.precompile_templates()
+    loaded = {name for _, name in env.cache}
+    assert loaded == set(env.list_templates(extensions=["html"]))
+
+
+def test_stream_index(client, auth, monkeypatch):
+    """The streamed index has the same content as the regular one, and is cached"""
+    auth.login()
+    expected = client.get("/").text
+
+    monkeypatch.setattr(client.app.state.settings, "stream_index", True)
+    blog.cache.invalidate_feed()
+    streamed = client.get("/")
+    assert "etag" not in streamed.headers
+    assert streamed.text == expected
+
+    # the streamed feed was cached, so the next view is a regular response
+    response = client.get("/")
+    assert "etag" in response.headers
+    assert response.text == expected
+
+
+def test_stream_chunks():
+    """Small pieces of output are joined into chunks of at least the given size"""
+    chunks = templating._buffer(["ab", "cd", "efg", "h", "i"], size=4)
+    assert list(chunks) == [b"abcd", b"efgh", b"i"]